@@ -1,8 +1,99 @@
+def cache_cli(args: list[str]):
+    import argparse
+    from cool_ip_api.utils.cache import SQLiteCache
+    parser = argparse.ArgumentParser(prog='cool-ip-api cache', description='Maintain a SQLite lookup cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compact_parser = subparsers.add_parser('compact', help='Delete expired entries and shrink the database file')
+    compact_parser.add_argument('path', type=str, help='Path of the cache database')
+    expire_parser = subparsers.add_parser('expire', help='Delete expired entries')
+    expire_parser.add_argument('path', type=str, help='Path of the cache database')
+    args = parser.parse_args(args)
+    cache = SQLiteCache(args.path)
+    deleted = cache.compact() if args.command == 'compact' else cache.expire()
+    print(f"Deleted {deleted} expired entries, {len(cache)} entries left")
+    cache.close()
+
+
+BULK_PROVIDERS = {
+    'ip-api.com': ('cool_ip_api.provider.ip_api_com', 'IPAPICom'),
+    'ipapi.co': ('cool_ip_api.provider.ipapi_co', 'IPApiCO'),
+    'ipwho.is': ('cool_ip_api.provider.ip_who_is_io', 'IPWhoIsIo'),
+    'abstractapi.com': ('cool_ip_api.provider.abstractapi_com', 'AbstractApiCom'),
+    'ipapi.com': ('cool_ip_api.provider.ipapi_com', 'APIIPApiCOM'),
+    'ipinfo.io': ('cool_ip_api.provider.ipinfo_io', 'IPInfoIo'),
+}
+
+
+def bulk_provider(spec: str):
+    import importlib
+    name, _, api_key = spec.partition(':')
+    if name not in BULK_PROVIDERS:
+        raise ValueError(f"Unknown provider {name}, use one of {', '.join(BULK_PROVIDERS)}")
+    module, cls = BULK_PROVIDERS[name]
+    provider = getattr(importlib.import_module(module), cls)
+    return provider(api_key) if api_key else provider()
+
+
+def bulk_cli(args: list[str]):
+    import argparse
+    import sys
+    from cool_ip_api.provider.bulk_job import BulkJob
+    from cool_ip_api.utils.journal import Journal
+    parser = argparse.ArgumentParser(prog='cool-ip-api bulk',
+                                     description='Resolve a file of IP addresses within the rate limits of providers')
+    parser.add_argument('path', type=str, help='File with one IP address per line, - for stdin')
+    parser.add_argument('--provider', '-p', action='append', type=bulk_provider, dest='providers',
+                        help=f"Provider to use, repeatable, name[:api-key] of {', '.join(BULK_PROVIDERS)}. "
+                             f"Defaults to ip-api.com.")
+    parser.add_argument('--dry-run', action='store_true', help='Print the plan without sending any requests')
+    parser.add_argument('--output', '-o', type=str, default='-', help='JSON lines output file, - for stdout')
+    parser.add_argument('--journal', '-j', type=str, default=None,
+                        help='Checkpoint file, a run with the same journal resumes where the last one stopped')
+    args = parser.parse_args(args)
+    providers = args.providers or [bulk_provider('ip-api.com')]
+    journal = Journal(args.journal) if args.journal else None
+    with sys.stdin if args.path == '-' else open(args.path) as f:
+        job = BulkJob(providers, (line.strip() for line in f if line.strip()), journal=journal)
+    print(job.plan(), file=sys.stderr)
+    if not args.dry_run:
+        bulk_run(job, args.output)
+    for provider in providers:
+        provider.close()
+    if journal is not None:
+        journal.close()
+
+
+def bulk_run(job, output: str):
+    import json
+    import sys
+
+    def report(progress):
+        eta = '?' if progress.eta is None else f"{progress.eta:.0f}s"
+        print(f"\r{progress.done}/{progress.total} done, {progress.failed} failed, "
+              f"{progress.throughput:.1f}/s, ETA {eta}", end='', file=sys.stderr)
+
+    results = job.run(report)
+    print(file=sys.stderr)
+    with sys.stdout if output == '-' else open(output, 'w') as f:
+        for ip, result in results.items():
+            if isinstance(result, Exception):
+                f.write(json.dumps({'ip': ip, 'error': str(result)}) + '\n')
+            else:
+                f.write(json.dumps({'ip': ip, 'response': json.loads(result.json())}) + '\n')
+
+
 def cli():
     import argparse
+    import sys
     from cool_ip_api.provider.ip_api_com import IPAPICom
     from pprint import pprint
-    parser = argparse.ArgumentParser(description='Get IP info')
+    if sys.argv[1:2] == ['cache']:
+        return cache_cli(sys.argv[2:])
+    if sys.argv[1:2] == ['bulk']:
+        return bulk_cli(sys.argv[2:])
+    parser = argparse.ArgumentParser(description='Get IP info',
+                                     epilog='Use "cool-ip-api cache --help" to maintain a lookup cache and '
+                                            '"cool-ip-api bulk --help" to resolve a file of IP addresses.')
     parser.add_argument('ip', type=str, help='IP address', default=None, nargs='?')
     args = parser.parse_args()
     ip_info_provider = IPAPICom()
@@ -1,14 +1,16 @@
 from __future__ import annotations
 from __future__ import annotations
 
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import timedelta
+from typing import Mapping, Optional
 
 import httpx
 from pydantic import BaseModel
 
-from cool_ip_api.provider.resolver_abc import ResolverFull, valid_ip_types
-from cool_ip_api.utils.errors import RateLimitError, QuotaError
+from cool_ip_api.provider.resolver_abc import ResolverFull, cached, valid_ip_types
+from cool_ip_api.utils.errors import ApiException, AuthenticationError, RateLimitError, QuotaError
+from cool_ip_api.utils.geo import GeoResult
+from cool_ip_api.utils.limiter import retry_after
 
 
 class Security(BaseModel):
@@ -66,6 +68,24 @@ class AbstractApiComResponse(BaseModel):
     currency: Optional[Currency]
     connection: Connection
 
+    def geo(self) -> GeoResult:
+        return GeoResult(self.ip_address, self.country_code, self.country, self.region, self.city, self.latitude,
+                         self.longitude, self.connection.autonomous_system_number,
+                         self.connection.autonomous_system_organization, self.timezone.name, self.country_is_eu,
+                         self.security.is_vpn)
+
+    @staticmethod
+    def geo_from_payload(payload: Mapping) -> GeoResult:
+        """
+        | GeoResult of the JSON of a response, without validating it.
+        """
+        connection = payload.get("connection") or {}
+        return GeoResult(payload.get("ip_address"), payload.get("country_code"), payload.get("country"),
+                         payload.get("region"), payload.get("city"), payload.get("latitude"), payload.get("longitude"),
+                         connection.get("autonomous_system_number"), connection.get("autonomous_system_organization"),
+                         (payload.get("timezone") or {}).get("name"), payload.get("country_is_eu"),
+                         (payload.get("security") or {}).get("is_vpn"))
+
 
 class AbstractApiCom(ResolverFull):
     """
@@ -78,61 +98,61 @@ class AbstractApiCom(ResolverFull):
     # TODO: Premium API support
 
     base_url = "https://ipgeolocation.abstractapi.com/v1/"
+    response_model = AbstractApiComResponse
     _request_limit_amount = 1
     _request_limit_time_period_seconds = 1
+    _quota_limit_amount = 20000
+    _quota_limit_time_period_seconds = 60 * 60 * 24 * 30
 
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.requests_left = self._request_limit_amount
-        self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-
-    def __pre_request(self):
-        if self.reset_time < datetime.now():
-            self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-            self.requests_left = self._request_limit_amount
-        if self.requests_left <= 0:
-            raise RateLimitError("You have reached the request limit for this API")
+    def __init__(self, api_key: str | list[str], **kwargs):
+        """
+        :param api_key: The API key, or a list of API keys that are used in turn (each with its own quota).
+        :param kwargs: Arguments of Resolver.
+        """
+        super().__init__(api_key=api_key, **kwargs)
 
+    @cached
     def resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> AbstractApiComResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: AbstractApiComResponse
         """
         ip = ip or ""
-        self.__pre_request()
+        self._pre_request()
         url = f"{self.base_url}?api_key={self.api_key}{f'&ip_address={ip}' if ip else ''}"
 
-        r = httpx.get(url, **httpx_args or {})
+        r = self._get(url, httpx_args)
         return self.__post_request(r)
 
     def __post_request(self, r: httpx.Response):
         if r.status_code in [200, 204]:
-            self.requests_left -= 1
-            return AbstractApiComResponse(**r.json())
+            return self._parse(self._json(r))
         elif r.status_code == 429:
-            self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-            self.requests_left = 0
+            self._exhaust(retry_after(r.headers) or self._request_limit_time_period_seconds)
             raise RateLimitError("You sent requests too fast")
         elif r.status_code == 422:
-            self.requests_left = 0
-            self.reset_time = datetime.now() + timedelta(days=30)
+            self._retire_api_key(timedelta(days=30).total_seconds())
             raise QuotaError("You have reached the request limit for this API")
+        elif r.status_code in [401, 403]:
+            self._retire_api_key()
+            raise AuthenticationError("Invalid API key")
+        raise ApiException(f"Unknown error: {r.status_code} {r.text}")
 
+    @cached
     async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> AbstractApiComResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: AbstractApiComResponse
         """
         ip = ip or ""
-        self.__pre_request()
+        await self._async_pre_request()
         url = f"{self.base_url}?api_key={self.api_key}{f'&ip_address={ip}' if ip else ''}"
 
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, **httpx_args or {})
-            return self.__post_request(r)
+        r = await self._async_get(url, httpx_args)
+        return self.__post_request(r)
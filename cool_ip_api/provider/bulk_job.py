@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Callable, Iterable, NamedTuple, Optional
+
+from cool_ip_api.provider.resolver_abc import Resolver, normalize_ip, valid_ip_types
+from cool_ip_api.utils.chunks import chunked
+from cool_ip_api.utils.errors import InvalidInputError, RateLimitError
+from cool_ip_api.utils.journal import Journal
+from cool_ip_api.utils.priority import Priority, priority
+
+
+class ProviderPlan(NamedTuple):
+    provider: str
+    lookups: int
+    requests: int  # Requests of the rate limit the lookups use
+    finish_in: float  # Seconds until the provider has sent its last request
+
+
+class JobPlan(NamedTuple):
+    total: int  # IP addresses passed to the job, including duplicates
+    unique: int
+    resumed: int  # Resolved by an earlier run, see Journal
+    providers: list[ProviderPlan]
+    eta: float  # Seconds until the last request is sent, inf if the providers can't do all lookups
+
+    def __str__(self) -> str:
+        lines = [f"{self.unique} unique IP addresses ({self.total - self.unique} duplicates, "
+                 f"{self.resumed} resolved before), ETA {_duration(self.eta)}"]
+        for plan in self.providers:
+            lines.append(f"  {plan.provider}: {plan.lookups} lookups in {plan.requests} requests, "
+                         f"done in {_duration(plan.finish_in)}")
+        return "\n".join(lines)
+
+
+class JobProgress(NamedTuple):
+    done: int  # Lookups done, including failed and resumed ones
+    failed: int
+    total: int
+    elapsed: float
+    throughput: float  # Lookups per second
+    eta: Optional[float]  # Seconds left, None until the first lookup is done
+
+
+def _duration(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "never"
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}:{rest // 60:02}:{rest % 60:02}"
+
+
+class BulkJob:
+    """
+    | Resolves a large set of IP addresses with a pool of providers within their rate limits.
+    | The IP addresses are deduplicated, then plan() assigns them to the providers so the last request is sent as
+    | early as possible: every provider gets the lookups its rate limits allow soonest, window after window.
+    | Batch APIs (IPAPICom.resolve_batch()) count batch_size lookups per request.
+    | run() executes the plan, one thread per provider, as bulk lookups (see cool_ip_api.utils.priority) so interactive
+    | lookups of the same resolvers go first. Providers with an open circuit breaker are left out of the plan.
+    | The plan doesn't model latency or quota used by other processes (see QuotaLedger), run() reports the actual
+    | progress.
+    | With a journal every resolved IP address is checkpointed, a job created with the same journal after a crash
+    | only resolves the rest.
+    """
+    chunk_size = 100  # Lookups per resolve_many() call of providers without a batch API, progress is reported per call
+
+    def __init__(self, providers: Iterable[Resolver], ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None,
+                 max_workers: int = 10, journal: Optional[Journal] = None):
+        """
+        :param providers: The providers to resolve the IP addresses with, they are not closed by the job.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.Client.get() / post()
+        :param max_workers: Threads per provider without a batch API.
+        :param journal: Journal to checkpoint the lookups to and resume from, it is not closed by the job.
+        """
+        self.httpx_args = httpx_args
+        self.max_workers = max_workers
+        self.providers: dict[str, Resolver] = {}
+        for provider in providers:
+            name = type(provider).__name__
+            if name in self.providers:
+                name = f"{name}#{sum(key.split('#')[0] == name for key in self.providers) + 1}"
+            self.providers[name] = provider
+        if not self.providers:
+            raise ValueError("The job needs at least one provider")
+        self.total = 0
+        unique = {}
+        for ip in ips:
+            self.total += 1
+            unique.setdefault(normalize_ip(ip), None)
+        self.ips = list(unique)
+        self.journal = journal
+        self.results: dict[str, Any] = {}
+        if journal is not None:
+            self.results.update((ip, response) for ip, (_, response) in journal.replay().items() if ip in unique)
+        self.resumed = len(self.results)
+        self.pending = [ip for ip in self.ips if ip not in self.results]
+        self._lock = threading.Lock()
+        self._failed = 0
+        self._start: Optional[float] = None
+
+    @staticmethod
+    def lookups_per_request(provider: Resolver) -> int:
+        """
+        | Lookups one request of the rate limit of provider allows.
+        """
+        return provider.batch_size if hasattr(provider, "resolve_batch") else 1
+
+    def plan(self) -> JobPlan:
+        """
+        | Assigns the IP addresses to the providers, without sending any requests (a dry run).
+        """
+        # Every limiter frees bulk_amount requests per period, the ones left now are free right away.
+        # Events are (time, provider index, limiter index, limiter, requests freed), the indices break ties.
+        events = []
+        for index, provider in enumerate(self.providers.values()):
+            if not provider.health().usable:
+                continue
+            # Every API key / egress with its own limiter, routes can share one
+            limiters = list({id(limiter): limiter for limiter in provider._limiters.values()}.values())
+            if None in limiters:
+                # Not rate limited, takes everything that is left at the start
+                events.append((0.0, index, 0, None, len(self.pending)))
+                continue
+            if hasattr(provider, "_batch_limiter"):
+                # Batch APIs can have a rate limit of their own (IPAPICom)
+                limiters = [provider._batch_limiter(limiter) for limiter in limiters]
+            for number, limiter in enumerate(limiters):
+                # The lookups run as bulk, they leave the share reserved for interactive ones
+                reserved = limiter.amount - limiter.bulk_amount
+                events.append((0.0, index, number, limiter, max(limiter.remaining - reserved, 0)))
+        heapq.heapify(events)
+        names = list(self.providers)
+        # Requests left in the quotas of the API keys (AbstractApiCom), they don't refill within a job
+        quotas = [sum(quota.remaining for quota in provider._quotas.values()) if provider._quotas else float("inf")
+                  for provider in self.providers.values()]
+        lookups = [0] * len(names)
+        requests = [0] * len(names)
+        finish = [0.0] * len(names)
+        left = len(self.pending)
+        while left and events:
+            at, index, number, limiter, granted = heapq.heappop(events)
+            if limiter is not None:
+                heapq.heappush(events, (at + limiter.period, index, number, limiter, limiter.bulk_amount))
+            granted = min(granted, quotas[index] - requests[index])
+            if granted <= 0:
+                continue
+            per_request = self.lookups_per_request(self.providers[names[index]])
+            taken = min(granted * per_request, left)
+            left -= taken
+            lookups[index] += taken
+            requests[index] += -(-taken // per_request)
+            finish[index] = at
+        providers = [ProviderPlan(name, lookups[index], requests[index], finish[index])
+                     for index, name in enumerate(names) if lookups[index]]
+        eta = float("inf") if left else max(plan.finish_in for plan in providers) if providers else 0.0
+        return JobPlan(self.total, len(self.ips), self.resumed, providers, eta)
+
+    def progress(self) -> JobProgress:
+        """
+        | Progress of run(), throughput and ETA are measured since it started.
+        """
+        with self._lock:
+            done, failed = len(self.results), self._failed
+        elapsed = 0.0 if self._start is None else time.monotonic() - self._start
+        throughput = (done - self.resumed) / elapsed if elapsed else 0.0
+        eta = (len(self.ips) - done) / throughput if throughput else None
+        return JobProgress(done, failed, len(self.ips), elapsed, throughput, eta)
+
+    def __store(self, provider: str, ips: list[str], results: list[Any]):
+        with self._lock:
+            for ip, result in zip(ips, results):
+                self.results[ip] = result
+                self._failed += isinstance(result, Exception)
+        if self.journal is not None:
+            # Like the negative cache only invalid IP addresses are final failures, the others are retried on resume
+            self.journal.append_many((ip, provider, result) for ip, result in zip(ips, results)
+                                     if not isinstance(result, Exception) or isinstance(result, InvalidInputError))
+
+    def __resolve_chunk(self, provider: Resolver, chunk: list[str]) -> list[Any]:
+        while True:
+            try:
+                if hasattr(provider, "resolve_batch"):
+                    return provider.resolve_batch(chunk, httpx_args=self.httpx_args)
+                return provider.resolve_many(chunk, httpx_args=self.httpx_args, max_workers=self.max_workers)
+            except RateLimitError:
+                time.sleep(provider._rate_limit_delay() or 1)
+            except Exception as e:
+                return [e] * len(chunk)
+
+    def __work(self, name: str, ips: list[str], on_progress: Optional[Callable[[JobProgress], None]]):
+        provider = self.providers[name]
+        size = provider.batch_size if hasattr(provider, "resolve_batch") else self.chunk_size
+        for chunk in chunked(ips, size):
+            self.__store(name, chunk, self.__resolve_chunk(provider, chunk))
+            if on_progress is not None:
+                on_progress(self.progress())
+
+    def run(self, on_progress: Optional[Callable[[JobProgress], None]] = None) -> dict[str, Any]:
+        """
+        | Plans the job and resolves the IP addresses that aren't in the journal yet.
+        :param on_progress: Called with the progress after every chunk of lookups, from the threads of the providers.
+        :return: API Responses as pydantic models, or the raised exception, by normalized IP address
+        """
+        plan = self.plan()
+        self._start = time.monotonic()
+        ips = iter(self.pending)
+        assignments = [(item.provider, [next(ips) for _ in range(item.lookups)]) for item in plan.providers]
+        try:
+            with priority(Priority.BULK), ThreadPoolExecutor(max_workers=max(len(assignments), 1)) as executor:
+                futures = [executor.submit(copy_context().run, self.__work, name, assigned, on_progress)
+                           for name, assigned in assignments]
+                for future in futures:
+                    future.result()
+        finally:
+            if self.journal is not None:
+                self.journal.sync()
+        # Lookups the providers can't do (no requests left in any window) are left out of the plan
+        missing = list(ips)
+        with self._lock:
+            for ip in missing:
+                self.results[ip] = RateLimitError("No provider has requests left for this lookup")
+            self._failed += len(missing)
+        return self.results
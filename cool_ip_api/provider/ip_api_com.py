@@ -1,114 +1,246 @@
 # Site: https://ip-api.com/
 from __future__ import annotations
 
-from datetime import datetime, timedelta
-from typing import Literal
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, Literal, Mapping
 from typing import Optional
 
-import httpx
 from httpx import Response
 from pydantic import BaseModel, Field
 
-from cool_ip_api.provider.resolver_abc import ResolverFull, valid_ip_types
-from cool_ip_api.utils.errors import RateLimitError
+from cool_ip_api.provider.resolver_abc import ResolverFull, cached, valid_ip_types
+from cool_ip_api.utils.chunks import chunked
+from cool_ip_api.utils.errors import ApiException, RateLimitError
+from cool_ip_api.utils.geo import GeoResult, split_asn
+from cool_ip_api.utils.limiter import RateLimiter
 
 
 class IPAPIComResponse(BaseModel):
+    # On status "fail" only status, message and query are returned
     status: str
     message: Optional[str]
-    continent: str
-    continent_code: str = Field(alias='continentCode')
-    country: str
-    country_code: str = Field(alias='countryCode')
-    region: str
-    region_name: str = Field(alias='regionName')
-    city: str
-    district: str
-    zip: str
-    lat: float
-    lon: float
-    timezone: str
-    offset: int
-    currency: str
-    isp: str
-    org: str
-    as_: str = Field(alias='as')
-    asname: str
-    reverse: str
-    mobile: bool
-    proxy: bool
-    hosting: bool
-    query: str
+    continent: Optional[str]
+    continent_code: Optional[str] = Field(None, alias='continentCode')
+    country: Optional[str]
+    country_code: Optional[str] = Field(None, alias='countryCode')
+    region: Optional[str]
+    region_name: Optional[str] = Field(None, alias='regionName')
+    city: Optional[str]
+    district: Optional[str]
+    zip: Optional[str]
+    lat: Optional[float]
+    lon: Optional[float]
+    timezone: Optional[str]
+    offset: Optional[int]
+    currency: Optional[str]
+    isp: Optional[str]
+    org: Optional[str]
+    as_: Optional[str] = Field(None, alias='as')
+    asname: Optional[str]
+    reverse: Optional[str]
+    mobile: Optional[bool]
+    proxy: Optional[bool]
+    hosting: Optional[bool]
+    query: Optional[str]
+
+    def geo(self) -> GeoResult:
+        asn, _ = split_asn(self.as_)
+        return GeoResult(self.query, self.country_code, self.country, self.region_name, self.city, self.lat, self.lon,
+                         asn, self.org, self.timezone, None, self.proxy, self.hosting, self.mobile)
+
+    @staticmethod
+    def geo_from_payload(payload: Mapping) -> GeoResult:
+        """
+        | GeoResult of the JSON of a response, without validating it.
+        """
+        asn, _ = split_asn(payload.get("as"))
+        return GeoResult(payload.get("query"), payload.get("countryCode"), payload.get("country"),
+                         payload.get("regionName"), payload.get("city"), payload.get("lat"), payload.get("lon"), asn,
+                         payload.get("org"), payload.get("timezone"), None, payload.get("proxy"),
+                         payload.get("hosting"), payload.get("mobile"))
 
 
 class IPAPICom(ResolverFull):
     """
     | Resolver for IP address.
     | Website: https://ip-api.com/
-    | Limit is 45 requests per minute (ip based check)
+    | Limit is 45 requests per minute (ip based check), the batch API has its own limit of 15 requests per minute
     | No commercial use allowed see https://members.ip-api.com/#pricing
     """
     # TODO: Premium API support
-    # TODO: Batch API support
     # TODO: Add better error handling
-    # Sadly the API doesn't provide an ACCURATE way to check the remaining requests, so we have to do it ourselves
 
     base_url = "http://ip-api.com/"
+    response_model = IPAPIComResponse
     localizations = Literal["en", "de", "es", "fr", "ja", "pt-BR", "ru", "zh-CN"]
+    fields = 66846719  # 66846719 is symbolic for all fields
+    batch_size = 100
     _request_limit_amount = 45
     _request_limit_time_period_seconds = 60
+    _batch_limit_amount = 15
+    _batch_limit_time_period_seconds = 60
 
-    def __init__(self):
-        self.requests_left = self._request_limit_amount
-        self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
+    def __init__(self, *args, **kwargs):
+        """
+        :param args: Arguments of Resolver.
+        :param kwargs: Arguments of Resolver.
+        """
+        # Batch requests use the limiter of the batch API, see limiter
+        self._batch_request: ContextVar[bool] = ContextVar(f"cool_ip_api_batch_{id(self)}", default=False)
+        self._batch_limiters: dict[RateLimiter, RateLimiter] = {}
+        self._batch_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _batch_limiter(self, limiter: RateLimiter) -> RateLimiter:
+        """
+        | The limiter of the batch API of the API key / egress limited by limiter, every one gets its own.
+        """
+        with self._batch_lock:
+            if limiter not in self._batch_limiters:
+                self._batch_limiters[limiter] = RateLimiter(self._batch_limit_amount,
+                                                            self._batch_limit_time_period_seconds, limiter.reserve,
+                                                            limiter.max_bulk_queue)
+            return self._batch_limiters[limiter]
+
+    @ResolverFull.limiter.getter
+    def limiter(self) -> Optional[RateLimiter]:
+        """
+        | Rate limiter of the API key or egress in use, the one of the batch API during resolve_batch().
+        """
+        limiter = ResolverFull.limiter.fget(self)
+        if limiter is None or not self._batch_request.get():
+            return limiter
+        return self._batch_limiter(limiter)
+
+    def batch_route_limiters(self) -> dict[str, Optional[RateLimiter]]:
+        """
+        | The rate limiter of the batch API of every API key (masked) or egress, see route_limiters().
+        """
+        return {name: None if limiter is None else self._batch_limiter(limiter)
+                for name, limiter in self.route_limiters().items()}
 
-    def __pre_request(self):
-        if self.reset_time < datetime.now():
-            self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-            self.requests_left = self._request_limit_amount
-        if self.requests_left <= 0:
-            raise RateLimitError("You have reached the request limit for this API")
+    def _quota_scope(self) -> str:
+        scope = super()._quota_scope()
+        return f"{scope}/batch" if self._batch_request.get() else scope
+
+    @contextmanager
+    def __batch(self) -> Iterator[None]:
+        # The requests (and retries) in the block acquire, sync and exhaust the batch limiter
+        token = self._batch_request.set(True)
+        try:
+            yield
+        finally:
+            self._batch_request.reset(token)
+
+    def _is_negative(self, response: IPAPIComResponse | dict) -> bool:
+        return (response.get("status") if isinstance(response, dict) else response.status) == "fail"
+
+    def _rate_limit_state(self, r: Response) -> tuple[Optional[int], Optional[float]]:
+        # X-Rl is the amount of requests left, X-Ttl the seconds until the window resets
+        try:
+            remaining = int(r.headers["x-rl"])
+        except (KeyError, ValueError):
+            return super()._rate_limit_state(r)
+        try:
+            reset_in = float(r.headers["x-ttl"])
+        except (KeyError, ValueError):
+            reset_in = None
+        return remaining, reset_in
 
     def __post_request(self, r: Response) -> IPAPIComResponse:
-        if r.headers.get("x-rl") == "0":
-            self.requests_left = 0
+        if r.status_code != 200:
+            self._exhaust()
+        return self._parse(self._json(r))
+
+    def __post_batch_request(self, r: Response) -> list[IPAPIComResponse]:
         if r.status_code == 200:
-            self.requests_left -= 1
-        else:
-            self.requests_left = 0
-        return IPAPIComResponse(**r.json())
+            return [self._parse(item) for item in self._json(r)]
+        self._exhaust()
+        if r.status_code == 429:
+            raise RateLimitError("You sent too many requests")
+        raise ApiException(f"Unknown error: {r.status_code} {r.text}")
 
+    def __batch_payload(self, ips: list[valid_ip_types], localization: localizations) -> list[dict]:
+        return [{"query": str(ip), "fields": self.fields, "lang": localization} for ip in ips]
+
+    @cached
     def resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None,
                 localization: localizations = "en") -> IPAPIComResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :param localization: The localization of the response. Defaults to "en".
         :return: API Response as a pydantic model
         :rtype: IPAPIComResponse
         """
         ip = ip or ""
-        url = f"{self.base_url}json/{ip}?fields=66846719&lang={localization}"  # 66846719 is symbolic for all fields
-        self.__pre_request()
+        url = f"{self.base_url}json/{ip}?fields={self.fields}&lang={localization}"
+        self._pre_request()
 
-        r = httpx.get(url, **httpx_args or {})
+        r = self._get(url, httpx_args)
         return self.__post_request(r)
 
+    @cached
     async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None,
                             localization: localizations = "en") -> IPAPIComResponse:
         """
         | Resolves an IP addresses.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :param localization: The localization of the response. Defaults to "en".
         :return: API Response as a pydantic model
         :rtype: IPAPIComResponse
         """
         ip = ip or ""
-        url = f"{self.base_url}json/{ip}?fields=66846719&lang={localization}"  # 66846719 is symbolic for all fields
+        url = f"{self.base_url}json/{ip}?fields={self.fields}&lang={localization}"
+
+        await self._async_pre_request()
+        r = await self._async_get(url, httpx_args)
+        return self.__post_request(r)
+
+    def resolve_batch(self, ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None,
+                      localization: localizations = "en") -> list[IPAPIComResponse]:
+        """
+        | Resolves many IP addresses with the batch API, every 100 IP addresses count as one request of its own limit.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.Client.post()
+        :param localization: The localization of the responses. Defaults to "en".
+        :return: API Responses as pydantic models in the same order as the IP addresses
+        :rtype: list[IPAPIComResponse]
+        """
+        def resolve_misses(misses: list[valid_ip_types]) -> list[IPAPIComResponse]:
+            url = f"{self.base_url}batch"
+            responses = []
+            with self.__batch():
+                for chunk in chunked(misses, self.batch_size):
+                    self._pre_request()
+                    r = self._post(url, self.__batch_payload(chunk, localization), httpx_args)
+                    responses.extend(self.__post_batch_request(r))
+            return responses
+
+        return self._resolve_many_cached(ips, resolve_misses, localization=localization)
+
+    async def async_resolve_batch(self, ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None,
+                                  localization: localizations = "en") -> list[IPAPIComResponse]:
+        """
+        | Resolves many IP addresses with the batch API, every 100 IP addresses count as one request of its own limit.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.AsyncClient.post()
+        :param localization: The localization of the responses. Defaults to "en".
+        :return: API Responses as pydantic models in the same order as the IP addresses
+        :rtype: list[IPAPIComResponse]
+        """
+        async def resolve_misses(misses: list[valid_ip_types]) -> list[IPAPIComResponse]:
+            url = f"{self.base_url}batch"
+            responses = []
+            with self.__batch():
+                for chunk in chunked(misses, self.batch_size):
+                    await self._async_pre_request()
+                    r = await self._async_post(url, self.__batch_payload(chunk, localization), httpx_args)
+                    responses.extend(self.__post_batch_request(r))
+            return responses
 
-        self.__pre_request()
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, **httpx_args or {})
-            return self.__post_request(r)
+        return await self._async_resolve_many_cached(ips, resolve_misses, localization=localization)
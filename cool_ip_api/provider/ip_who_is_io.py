@@ -1,11 +1,13 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Mapping, Optional
 
 import httpx
 from pydantic import BaseModel
 
-from cool_ip_api.provider.resolver_abc import ResolverFull, valid_ip_types
+from cool_ip_api.provider.resolver_abc import ResolverFull, cached, valid_ip_types
+from cool_ip_api.utils.errors import ApiException, RateLimitError
+from cool_ip_api.utils.geo import GeoResult
 
 
 class Flag(BaseModel):
@@ -52,6 +54,20 @@ class IPWhoIsIoResponse(BaseModel):
     connection: Connection
     timezone: Timezone
 
+    def geo(self) -> GeoResult:
+        return GeoResult(self.ip, self.country_code, self.country, self.region, self.city, self.latitude,
+                         self.longitude, self.connection.asn, self.connection.org, self.timezone.id, self.is_eu)
+
+    @staticmethod
+    def geo_from_payload(payload: Mapping) -> GeoResult:
+        """
+        | GeoResult of the JSON of a response, without validating it.
+        """
+        connection = payload.get("connection") or {}
+        return GeoResult(payload.get("ip"), payload.get("country_code"), payload.get("country"), payload.get("region"),
+                         payload.get("city"), payload.get("latitude"), payload.get("longitude"), connection.get("asn"),
+                         connection.get("org"), (payload.get("timezone") or {}).get("id"), payload.get("is_eu"))
+
 
 class IPWhoIsIo(ResolverFull):
     """
@@ -65,32 +81,46 @@ class IPWhoIsIo(ResolverFull):
     # TODO: Add error handling
 
     base_url = "https://ipwho.is/"
-
+    response_model = IPWhoIsIoResponse
+    _request_limit_amount = 10000
+    _request_limit_time_period_seconds = 60 * 60 * 24 * 30
+
+    def __post_request(self, r: httpx.Response) -> IPWhoIsIoResponse:
+        if r.status_code == 200:
+            return self._parse(self._json(r))
+        elif r.status_code == 429:
+            self._exhaust()
+            raise RateLimitError("You sent too many requests")
+        raise ApiException(f"Unknown error: {r.status_code} {r.text}")
+
+    @cached
     def resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> IPWhoIsIoResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: IPWhoIsIoResponse
         """
         ip = ip or ""
         url = f"{self.base_url}{ip}"
 
-        r = httpx.get(url, **httpx_args or {})
-        return IPWhoIsIoResponse(**r.json())
+        self._pre_request()
+        r = self._get(url, httpx_args)
+        return self.__post_request(r)
 
+    @cached
     async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> IPWhoIsIoResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: IPWhoIsIoResponse
         """
         ip = ip or ""
         url = f"{self.base_url}{ip}"
 
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, **httpx_args or {})
-            return IPWhoIsIoResponse(**r.json())
+        await self._async_pre_request()
+        r = await self._async_get(url, httpx_args)
+        return self.__post_request(r)
@@ -2,15 +2,16 @@ from __future__ import annotations
 from __future__ import annotations
 from __future__ import annotations
 
-from datetime import datetime, timedelta
 from enum import Enum
-from typing import Optional
+from typing import Mapping, Optional
 
 import httpx
 from pydantic import BaseModel
 
-from cool_ip_api.provider.resolver_abc import ResolverFull, valid_ip_types
+from cool_ip_api.provider.resolver_abc import ResolverFull, cached, valid_ip_types
 from cool_ip_api.utils.errors import RateLimitError, AuthenticationError, ApiException, InvalidInputError
+from cool_ip_api.utils.geo import GeoResult, split_asn
+from cool_ip_api.utils.limiter import retry_after
 
 
 class Version(Enum):
@@ -47,6 +48,21 @@ class IPApiCOResponse(BaseModel):
     asn: str
     org: str
 
+    def geo(self) -> GeoResult:
+        asn, _ = split_asn(self.asn)
+        return GeoResult(self.ip, self.country_code, self.country_name, self.region, self.city, self.latitude,
+                         self.longitude, asn, self.org, self.timezone, self.in_eu)
+
+    @staticmethod
+    def geo_from_payload(payload: Mapping) -> GeoResult:
+        """
+        | GeoResult of the JSON of a response, without validating it.
+        """
+        asn, _ = split_asn(payload.get("asn"))
+        return GeoResult(payload.get("ip"), payload.get("country_code"), payload.get("country_name"),
+                         payload.get("region"), payload.get("city"), payload.get("latitude"), payload.get("longitude"),
+                         asn, payload.get("org"), payload.get("timezone"), payload.get("in_eu"))
+
 
 class IPApiCO(ResolverFull):
     """
@@ -58,42 +74,31 @@ class IPApiCO(ResolverFull):
     # TODO: Premium API support
 
     base_url = "https://ipapi.co/"
+    response_model = IPApiCOResponse
     _request_limit_amount = 1000
     _request_limit_time_period_seconds = 60 * 60 * 24
 
-    def __init__(self):
-        self.requests_left = self._request_limit_amount
-        self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-
-    def __pre_request(self):
-        if self.reset_time < datetime.now():
-            self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-            self.requests_left = self._request_limit_amount
-        if self.requests_left <= 0:
-            raise RateLimitError("You have reached the request limit for this API")
-
+    @cached
     def resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> IPApiCOResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: IPApiCOResponse
         """
         ip = ip or ""
-        self.__pre_request()
+        self._pre_request()
         url = f"{self.base_url}{str(ip) + '/' if ip else ''}json/"
 
-        r = httpx.get(url, **httpx_args or {})
+        r = self._get(url, httpx_args)
         return self.__post_request(r)
 
     def __post_request(self, r: httpx.Response):
         if r.status_code == 200:
-            self.requests_left -= 1
-            return IPApiCOResponse(**r.json())
+            return self._parse(self._json(r))
         elif r.status_code == 429:
-            self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-            self.requests_left = 0
+            self._exhaust(retry_after(r.headers) or self._request_limit_time_period_seconds)
             raise RateLimitError("You sent too many requests")
         elif r.status_code == 403:
             raise AuthenticationError("Invalid API key")
@@ -105,18 +110,18 @@ class IPApiCO(ResolverFull):
             raise InvalidInputError("Bad request")
         raise ApiException(f"Unknown error: {r.status_code} {r.text}")
 
+    @cached
     async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> IPApiCOResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: IPApiCOResponse
         """
         ip = ip or ""
-        self.__pre_request()
+        await self._async_pre_request()
         url = f"{self.base_url}{str(ip) + '/' if ip else ''}json/"
 
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, **httpx_args or {})
-            return self.__post_request(r)
+        r = await self._async_get(url, httpx_args)
+        return self.__post_request(r)
@@ -2,16 +2,19 @@ from __future__ import annotations
 from __future__ import annotations
 from __future__ import annotations
 
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from enum import Enum
-from typing import List
+from typing import Iterable, List, Mapping
 from typing import Optional
 
 import httpx
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-from cool_ip_api.provider.resolver_abc import ResolverFull, valid_ip_types
-from cool_ip_api.utils.errors import RateLimitError, ApiException, AuthenticationError, QuotaError, InvalidInputError
+from cool_ip_api.provider.resolver_abc import ResolverFull, cached, normalize_ip, valid_ip_types
+from cool_ip_api.utils.chunks import chunked
+from cool_ip_api.utils.errors import ApiException, AuthenticationError, QuotaError, InvalidInputError
+from cool_ip_api.utils.geo import GeoResult
 
 
 class Language(BaseModel):
@@ -51,6 +54,20 @@ class APIIPApiCOMResponse(BaseModel):
     longitude: float
     location: Location
 
+    def geo(self) -> GeoResult:
+        # The free plan doesn't return the connection or the time zone
+        return GeoResult(self.ip, self.country_code, self.country_name, self.region_name, self.city, self.latitude,
+                         self.longitude, is_eu=self.location.is_eu)
+
+    @staticmethod
+    def geo_from_payload(payload: Mapping) -> GeoResult:
+        """
+        | GeoResult of the JSON of a response, without validating it.
+        """
+        return GeoResult(payload.get("ip"), payload.get("country_code"), payload.get("country_name"),
+                         payload.get("region_name"), payload.get("city"), payload.get("latitude"),
+                         payload.get("longitude"), is_eu=(payload.get("location") or {}).get("is_eu"))
+
 
 class APIIPApiCOM(ResolverFull):
     """
@@ -61,69 +78,151 @@ class APIIPApiCOM(ResolverFull):
     """
     # TODO: Premium API support
     base_url = "http://api.ipapi.com/api/"
+    response_model = APIIPApiCOMResponse
+    bulk_size = 50
 
     _request_limit_amount = 1000
     _request_limit_time_period_seconds = 60 * 60 * 24 * 30
 
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.requests_left = self._request_limit_amount
-        self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-
-    def __pre_request(self):
-        if self.reset_time < datetime.now():
-            self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-            self.requests_left = self._request_limit_amount
-        if self.requests_left <= 0:
-            raise RateLimitError("You have reached the request limit for this API")
+    def __init__(self, api_key: str | list[str], **kwargs):
+        """
+        :param api_key: The API key, or a list of API keys that are used in turn (each with its own quota).
+        :param kwargs: Arguments of Resolver.
+        """
+        super().__init__(api_key=api_key, **kwargs)
 
+    @cached
     def resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> APIIPApiCOMResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: APIIPApiCOMResponse
         """
         ip = ip or ""
-        self.__pre_request()
+        self._pre_request()
         url = f"{self.base_url}{ip or 'check'}?access_key={self.api_key}"
 
-        r = httpx.get(url, **httpx_args or {})
+        r = self._get(url, httpx_args)
         return self.__post_request(r)
 
+    def __error(self, error: dict, whole_request: bool = False) -> ApiException:
+        # Unknown errors of a whole bulk request (e.g. bulk not supported by the plan) are not the fault of its IP
+        # addresses, they must not be reported as invalid input (BulkJob keeps those as final)
+        error_code = error.get("code")
+        error_info = error.get("info")
+        if error_code in [101, 102]:
+            self._retire_api_key()
+            return AuthenticationError(error_info)
+        elif error_code == 103:
+            return ApiException(error_info)
+        elif error_code == 104:
+            self._exhaust(self._request_limit_time_period_seconds)
+            return QuotaError(error_info)
+        elif error_code == 106 or not whole_request:
+            return InvalidInputError(error_info)
+        else:
+            return ApiException(error_info)
+
     def __post_request(self, r: httpx.Response):
-        if r.json().get("success") is False:
-            error_code = r.json().get("error").get("code")
-            error_info = r.json().get("error").get("info")
-            if error_code == 101:
-                raise AuthenticationError(error_info)
-            elif error_code == 102:
-                raise AuthenticationError(error_info)
-            elif error_code == 103:
-                raise ApiException(error_info)
-            elif error_code == 104:
-                self.reset_time = datetime.now() + timedelta(seconds=self._request_limit_time_period_seconds)
-                self.requests_left = 0
-                raise QuotaError(error_info)
-            else:
-                raise InvalidInputError(error_info)
+        data = self._json(r)
+        if data.get("success") is False:
+            raise self.__error(data.get("error"))
         else:
-            self.requests_left -= 1
-            return APIIPApiCOMResponse(**r.json())
+            return self._parse(data)
+
+    def __post_bulk_request(self, r: httpx.Response, ips: list[valid_ip_types]) \
+            -> list[APIIPApiCOMResponse | ApiException]:
+        data = self._json(r)
+        if isinstance(data, dict) and data.get("success") is False:
+            raise self.__error(data.get("error"), whole_request=True)
+        if isinstance(data, dict):
+            data = [data]
+        # Results are matched by their IP address, the API may leave out entries
+        by_ip = {normalize_ip(item["ip"]): item for item in data if isinstance(item, dict) and item.get("ip")}
+        missing = [ip for ip in ips if normalize_ip(ip) not in by_ip]
+        # Errors don't name their IP address, they can only be matched if every IP address without a result has one
+        errors = [item for item in data if isinstance(item, dict) and not item.get("ip")]
+        if len(errors) == len(missing):
+            by_ip.update((normalize_ip(ip), item) for ip, item in zip(missing, errors))
+        results = []
+        for ip in ips:
+            item = by_ip.get(normalize_ip(ip))
+            if item is None:
+                results.append(ApiException(f"No result for {ip}"))
+            elif item.get("success") is False:
+                results.append(self.__error(item.get("error") or {}))
+            else:
+                try:
+                    results.append(self._parse(item))
+                except ValidationError as e:
+                    results.append(InvalidInputError(f"Invalid result for {ip}: {e}"))
+        return results
 
+    @cached
     async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> APIIPApiCOMResponse:
         """
         | Resolves an IP address.
         :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: APIIPApiCOMResponse
         """
         ip = ip or ""
-        self.__pre_request()
+        await self._async_pre_request()
         url = f"{self.base_url}{ip or 'check'}?access_key={self.api_key}"
 
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, **httpx_args or {})
-            return self.__post_request(r)
+        r = await self._async_get(url, httpx_args)
+        return self.__post_request(r)
+
+    def __resolve_chunk(self, chunk: list[valid_ip_types], httpx_args: Optional[dict]) \
+            -> list[APIIPApiCOMResponse | ApiException]:
+        self._pre_request(len(chunk))
+        url = f"{self.base_url}{','.join(str(ip) for ip in chunk)}?access_key={self.api_key}"
+
+        r = self._get(url, httpx_args, len(chunk))
+        return self.__post_bulk_request(r, chunk)
+
+    def resolve_many(self, ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None,
+                     max_workers: int = 10) -> list[APIIPApiCOMResponse | ApiException]:
+        """
+        | Resolves many IP addresses with the bulk API, up to 50 IP addresses are sent per request.
+        | Every IP address counts as one request.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.Client.get()
+        :param max_workers: The amount of threads sending requests.
+        :return: API Responses as pydantic models, or the error of the IP address, in the same order as the IP addresses
+        :rtype: list[APIIPApiCOMResponse | ApiException]
+        """
+        def resolve_misses(misses: list[valid_ip_types]) -> list[APIIPApiCOMResponse | ApiException]:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                batches = list(chunked(misses, self.bulk_size))
+                # Every batch runs in a copy of the caller's context, so it keeps its priority
+                chunks = executor.map(lambda chunk, context: context.run(self.__resolve_chunk, chunk, httpx_args),
+                                      batches, [copy_context() for _ in batches])
+                return [result for chunk in chunks for result in chunk]
+
+        return self._resolve_many_cached(ips, resolve_misses)
+
+    async def async_resolve_many(self, ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None) \
+            -> list[APIIPApiCOMResponse | ApiException]:
+        """
+        | Resolves many IP addresses with the bulk API, up to 50 IP addresses are sent per request.
+        | Every IP address counts as one request.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.AsyncClient.get()
+        :return: API Responses as pydantic models, or the error of the IP address, in the same order as the IP addresses
+        :rtype: list[APIIPApiCOMResponse | ApiException]
+        """
+        async def resolve_misses(misses: list[valid_ip_types]) -> list[APIIPApiCOMResponse | ApiException]:
+            results = []
+            for chunk in chunked(misses, self.bulk_size):
+                await self._async_pre_request(len(chunk))
+                url = f"{self.base_url}{','.join(str(ip) for ip in chunk)}?access_key={self.api_key}"
+
+                r = await self._async_get(url, httpx_args, len(chunk))
+                results.extend(self.__post_bulk_request(r, chunk))
+            return results
+
+        return await self._async_resolve_many_cached(ips, resolve_misses)
@@ -7,6 +7,7 @@ import httpx
 from pydantic import BaseModel, Field
 
 from cool_ip_api.provider.resolver_abc import ResolverLimited
+from cool_ip_api.utils.parsing import validated
 
 
 class IpifyOrgResponse(BaseModel):
@@ -18,13 +19,16 @@ class IpifyOrgResponse(BaseModel):
         allow_population_by_field_name = True
 
     def __init__(self, **data):
+        super().__init__(**self._prepare(data))
+
+    @staticmethod
+    def _prepare(data: dict) -> dict:
         if data.get("ip"):
             try:
                 data["ipv4"] = str(IPv4Address(data["ip"]))
             except ValueError:
                 data["ipv6"] = str(IPv6Address(data["ip"]))
-
-        super().__init__(**data)
+        return data
 
 
 class IpifyOrg(ResolverLimited):
@@ -35,6 +39,7 @@ class IpifyOrg(ResolverLimited):
     | Commercial seems allowed? https://ipapi.co/pricing/
     """
 
+    response_model = IpifyOrgResponse
     ipv4_url = "https://api4.ipify.org/?format=json"
     ipv6_url = "https://api6.ipify.org/?format=json"
     dualstack_url = "https://api64.ipify.org/?format=json"
@@ -44,22 +49,22 @@ class IpifyOrg(ResolverLimited):
         """
         | Resolves your own IP address.
         :param ip_version: The IP version to resolve. Can be "ipv4", "ipv6", "dualstack"(what your pc prefers) or "combined"(ipv4 & ipv6).
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: IpifyOrgResponse
         """
         if ip_version == "ipv4":
             url = self.ipv4_url
-            r = httpx.get(url, **httpx_args or {})
-            return IpifyOrgResponse(**r.json())
+            r = self._get(url, httpx_args)
+            return self._parse(self._json(r))
         elif ip_version == "ipv6":
             url = self.ipv6_url
-            r = httpx.get(url, **httpx_args or {})
-            return IpifyOrgResponse(**r.json())
+            r = self._get(url, httpx_args)
+            return self._parse(self._json(r))
         elif ip_version == "dualstack":
             url = self.dualstack_url
-            r = httpx.get(url, **httpx_args or {})
-            return IpifyOrgResponse(**r.json())
+            r = self._get(url, httpx_args)
+            return self._parse(self._json(r))
         elif ip_version == "combined":
             try:
                 ipv4 = self.resolve("ipv4", httpx_args)
@@ -71,7 +76,8 @@ class IpifyOrg(ResolverLimited):
                 ipv6 = None
             if ipv4 is None and ipv6 is None:
                 raise httpx.ConnectError("Could not resolve any IP address")
-            return IpifyOrgResponse(ipv4=ipv4.ipv4 if ipv4 else ipv4, ipv6=ipv6.ipv6 if ipv6 else ipv6)
+            ipv4, ipv6 = validated(IpifyOrgResponse, ipv4), validated(IpifyOrgResponse, ipv6)
+            return self._parse({"ipv4": ipv4.ipv4 if ipv4 else ipv4, "ipv6": ipv6.ipv6 if ipv6 else ipv6})
 
     async def async_resolve(self, ip_version: Literal["ipv4", "ipv6", "dualstack", "combined"],
                             httpx_args: Optional[dict] = None) \
@@ -79,25 +85,22 @@ class IpifyOrg(ResolverLimited):
         """
         | Resolves your own IP address.
         :param ip_version: The IP version to resolve. Can be "ipv4", "ipv6", "dualstack"(what your pc prefers) or "combined"(ipv4 & ipv6).
-        :param httpx_args: Arguments to pass to httpx.get()
+        :param httpx_args: Arguments to pass to httpx.Client.get()
         :return: API Response as a pydantic model
         :rtype: IpifyOrgResponse
         """
         if ip_version == "ipv4":
             url = self.ipv4_url
-            async with httpx.AsyncClient() as client:
-                r = await client.get(url, **httpx_args or {})
-                return IpifyOrgResponse(**r.json())
+            r = await self._async_get(url, httpx_args)
+            return self._parse(self._json(r))
         elif ip_version == "ipv6":
             url = self.ipv6_url
-            async with httpx.AsyncClient() as client:
-                r = await client.get(url, **httpx_args or {})
-                return IpifyOrgResponse(**r.json())
+            r = await self._async_get(url, httpx_args)
+            return self._parse(self._json(r))
         elif ip_version == "dualstack":
             url = self.dualstack_url
-            async with httpx.AsyncClient() as client:
-                r = await client.get(url, **httpx_args or {})
-                return IpifyOrgResponse(**r.json())
+            r = await self._async_get(url, httpx_args)
+            return self._parse(self._json(r))
         elif ip_version == "combined":
             try:
                 ipv4 = await self.async_resolve("ipv4", httpx_args)
@@ -107,4 +110,5 @@ class IpifyOrg(ResolverLimited):
                 ipv6 = await self.async_resolve("ipv6", httpx_args)
             except httpx.ConnectError:
                 ipv6 = None
-            return IpifyOrgResponse(ipv4=ipv4.ipv4 if ipv4 else ipv4, ipv6=ipv6.ipv6 if ipv6 else ipv6)
+            ipv4, ipv6 = validated(IpifyOrgResponse, ipv4), validated(IpifyOrgResponse, ipv6)
+            return self._parse({"ipv4": ipv4.ipv4 if ipv4 else ipv4, "ipv6": ipv6.ipv6 if ipv6 else ipv6})
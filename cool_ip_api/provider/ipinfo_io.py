@@ -1,11 +1,17 @@
 from __future__ import annotations
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Iterable, Mapping, Optional
 
 import httpx
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-from cool_ip_api.provider.resolver_abc import ResolverFull, valid_ip_types
+from cool_ip_api.provider.resolver_abc import ResolverFull, cached, valid_ip_types
+from cool_ip_api.utils.chunks import chunked
+from cool_ip_api.utils.errors import ApiException, AuthenticationError, InvalidInputError, RateLimitError
+from cool_ip_api.utils.geo import GeoResult, split_asn, split_location
+from cool_ip_api.utils.limiter import retry_after
 
 
 class IPInfoIoResponse(BaseModel):
@@ -19,6 +25,23 @@ class IPInfoIoResponse(BaseModel):
     postal: str
     timezone: str
 
+    def geo(self) -> GeoResult:
+        # country is the country code, org the autonomous system
+        latitude, longitude = split_location(self.loc)
+        asn, org = split_asn(self.org)
+        return GeoResult(self.ip, self.country, None, self.region, self.city, latitude, longitude, asn, org,
+                         self.timezone)
+
+    @staticmethod
+    def geo_from_payload(payload: Mapping) -> GeoResult:
+        """
+        | GeoResult of the JSON of a response, without validating it.
+        """
+        latitude, longitude = split_location(payload.get("loc"))
+        asn, org = split_asn(payload.get("org"))
+        return GeoResult(payload.get("ip"), payload.get("country"), None, payload.get("region"), payload.get("city"),
+                         latitude, longitude, asn, org, payload.get("timezone"))
+
 
 class IPInfoIo(ResolverFull):
     """
@@ -28,25 +51,120 @@ class IPInfoIo(ResolverFull):
     | No commercial use allowed see https://ipinfo.io/pricing
     """
     # TODO: Premium API support
-    # TODO: Add error handling
 
     base_url = "https://ipinfo.io/"
+    response_model = IPInfoIoResponse
+    batch_size = 1000
+    _request_limit_amount = 50000
+    _request_limit_time_period_seconds = 60 * 60 * 24 * 30
 
-    def __init__(self, api_key: str):
-        self.api_key = api_key
+    def __init__(self, api_key: str | list[str], **kwargs):
+        """
+        :param api_key: The API key, or a list of API keys that are used in turn (each with its own quota).
+        :param kwargs: Arguments of Resolver.
+        """
+        super().__init__(api_key=api_key, **kwargs)
 
+    @cached
     def resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> IPInfoIoResponse:
         ip = ip or ""
+        self._pre_request()
         url = f"{self.base_url}{ip}?token={self.api_key}"
+        r = self._get(url, httpx_args)
+        return self.__post_request(r)
 
-        r = httpx.get(url, **httpx_args or {})
-        return IPInfoIoResponse(**r.json())
-
+    @cached
     async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> IPInfoIoResponse:
         ip = ip or ""
-        url = f"{self.base_url}{ip}"
+        await self._async_pre_request()
+        url = f"{self.base_url}{ip}?token={self.api_key}"
+        r = await self._async_get(url, httpx_args)
+        return self.__post_request(r)
+
+    def __check_status(self, r: httpx.Response):
+        if r.status_code == 429:
+            # The quota of the month (or a Retry-After) is used up
+            self._exhaust(retry_after(r.headers))
+            raise RateLimitError("You have reached the request limit for this API")
+        elif r.status_code in [401, 403]:
+            self._retire_api_key()
+            raise AuthenticationError("Invalid API key")
+
+    def __post_request(self, r: httpx.Response) -> IPInfoIoResponse:
+        self.__check_status(r)
+        if r.status_code in [400, 404]:
+            raise InvalidInputError(f"Invalid IP address: {r.text}")
+        elif r.status_code != 200:
+            raise ApiException(f"Unknown error: {r.status_code} {r.text}")
+        return self._parse(self._json(r))
+
+    def __post_batch_request(self, r: httpx.Response, ips: list[valid_ip_types]) \
+            -> list[IPInfoIoResponse | ApiException]:
+        self.__check_status(r)
+        if r.status_code != 200:
+            raise ApiException(f"Unknown error: {r.status_code} {r.text}")
+        data = self._json(r)
+        results = []
+        for ip in ips:
+            item = data.get(str(ip))
+            if not isinstance(item, dict):
+                results.append(InvalidInputError(f"No result for {ip}"))
+            elif "error" in item:
+                results.append(InvalidInputError(f"{ip}: {item['error']}"))
+            elif item.get("bogon"):
+                results.append(InvalidInputError(f"{ip} is a bogon IP address"))
+            else:
+                try:
+                    results.append(self._parse(item))
+                except ValidationError as e:
+                    results.append(InvalidInputError(f"Invalid result for {ip}: {e}"))
+        return results
+
+    def __resolve_chunk(self, chunk: list[valid_ip_types], httpx_args: Optional[dict]) \
+            -> list[IPInfoIoResponse | ApiException]:
+        self._pre_request(len(chunk))
+        url = f"{self.base_url}batch?token={self.api_key}"
+        r = self._post(url, [str(ip) for ip in chunk], httpx_args, len(chunk))
+        return self.__post_batch_request(r, chunk)
+
+    def resolve_many(self, ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None,
+                     max_workers: int = 10) -> list[IPInfoIoResponse | ApiException]:
+        """
+        | Resolves many IP addresses with the batch API, up to 1000 IP addresses are sent per request.
+        | Every IP address counts as one request.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.Client.post()
+        :param max_workers: The amount of threads sending batches.
+        :return: API Responses as pydantic models, or the error of the IP address, in the same order as the IP addresses
+        :rtype: list[IPInfoIoResponse | ApiException]
+        """
+        def resolve_misses(misses: list[valid_ip_types]) -> list[IPInfoIoResponse | ApiException]:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                batches = list(chunked(misses, self.batch_size))
+                # Every batch runs in a copy of the caller's context, so it keeps its priority
+                chunks = executor.map(lambda chunk, context: context.run(self.__resolve_chunk, chunk, httpx_args),
+                                      batches, [copy_context() for _ in batches])
+                return [result for chunk in chunks for result in chunk]
+
+        return self._resolve_many_cached(ips, resolve_misses)
 
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, **httpx_args or {})
-            return IPInfoIoResponse(**r.json())
+    async def async_resolve_many(self, ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None) \
+            -> list[IPInfoIoResponse | ApiException]:
+        """
+        | Resolves many IP addresses with the batch API, up to 1000 IP addresses are sent per request.
+        | Every IP address counts as one request.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.AsyncClient.post()
+        :return: API Responses as pydantic models, or the error of the IP address, in the same order as the IP addresses
+        :rtype: list[IPInfoIoResponse | ApiException]
+        """
+        async def resolve_misses(misses: list[valid_ip_types]) -> list[IPInfoIoResponse | ApiException]:
+            results = []
+            for chunk in chunked(misses, self.batch_size):
+                await self._async_pre_request(len(chunk))
+                url = f"{self.base_url}batch?token={self.api_key}"
+                r = await self._async_post(url, [str(ip) for ip in chunk], httpx_args, len(chunk))
+                results.extend(self.__post_batch_request(r, chunk))
+            return results
 
+        return await self._async_resolve_many_cached(ips, resolve_misses)
@@ -1,13 +1,737 @@
-from abc import ABC, abstractmethod, ABCMeta
-from ipaddress import IPv4Address, IPv6Address
-from typing import Optional, Literal
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import inspect
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timedelta
+from functools import wraps
+from ipaddress import IPv4Address, IPv6Address, ip_address
+from typing import (Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Hashable, Iterable, Mapping, Optional,
+                    Literal, get_args)
+
+import httpx
+from pydantic import BaseModel
+
+from cool_ip_api.utils.cache import AccessCounter, Cache
+from cool_ip_api.utils.circuit import CircuitBreaker, Health
+from cool_ip_api.utils.egress import Egress
+from cool_ip_api.utils.errors import CircuitOpenError, InvalidInputError, QuotaError, RateLimitError
+from cool_ip_api.utils.geo import GeoResult
+from cool_ip_api.utils.ledger import QuotaLedger
+from cool_ip_api.utils.limiter import PriorityStats, RateLimiter, rate_limit_headers, retry_after
+from cool_ip_api.utils.parsing import json_loads, parse_modes, parse_response
+from cool_ip_api.utils.priority import Priority
+from cool_ip_api.utils.retry import RetryPolicy
+from cool_ip_api.utils.singleflight import SingleFlight
 
 valid_ip_types = IPv4Address | IPv6Address | str
 
 
+async def _aiter(iterable: Iterable):
+    for item in iterable:
+        yield item
+
+
+def normalize_ip(ip: valid_ip_types) -> str:
+    """
+    | Returns the canonical string of an IP address, e.g. 2001:DB8:0::1 -> 2001:db8::1.
+    """
+    try:
+        return str(ip_address(str(ip).strip()))
+    except ValueError:
+        return str(ip).strip()
+
+
+def cached(func):
+    """
+    | Decorator for resolve() and async_resolve() that answers lookups from the cache of the resolver if it has one,
+    | and coalesces concurrent identical lookups if the resolver uses single flight.
+    | The key is the provider, the normalized IP address and the other call parameters except httpx_args.
+    | Lookups of the own IP address (no IP address) are never cached or coalesced.
+    """
+    signature = inspect.signature(func)
+
+    def cache_key(self: Resolver, args: tuple, kwargs: dict) -> Optional[Hashable]:
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        del params["self"]
+        params.pop("httpx_args", None)
+        ip = params.pop("ip")
+        if not ip:
+            return None
+        if self.parse != "validated":
+            # Raw and lazy responses have other types than the models
+            params["parse"] = self.parse
+        return type(self).__name__, normalize_ip(ip), tuple(sorted(params.items()))
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapper(self: Resolver, *args, **kwargs):
+            if (self.cache is None and self.single_flight is None) or (key := cache_key(self, args, kwargs)) is None:
+                return await func(self, *args, **kwargs)
+            return await self._async_cached_call(key, lambda: func(self, *args, **kwargs))
+    else:
+        @wraps(func)
+        def wrapper(self: Resolver, *args, **kwargs):
+            if (self.cache is None and self.single_flight is None) or (key := cache_key(self, args, kwargs)) is None:
+                return func(self, *args, **kwargs)
+            return self._cached_call(key, lambda: func(self, *args, **kwargs))
+    wrapper.cache_key = cache_key
+    return wrapper
+
+
+class Resolver(ABC):
+    """
+    | Base class of all resolvers.
+    | Every resolver owns a long-lived sync and async httpx client, so consecutive lookups reuse warm connections
+    | instead of doing a new TCP connection and TLS handshake each time.
+    | Clients are created lazily on first use, clients passed in by the caller are never closed by the resolver.
+    | Resolvers can be shared between threads, the rate limit state is only changed while holding a lock.
+    | Rate limited resolvers wait for their limiter instead of raising RateLimitError, for up to rate_limit_timeout
+    | seconds.
+    """
+    default_limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+    default_retry = RetryPolicy()
+    response_model: Optional[type[BaseModel]] = None  # Model of the responses of resolve()
+    _request_limit_amount: Optional[int] = None
+    _request_limit_time_period_seconds: Optional[int] = None
+    # Quota of every API key on top of the rate limit, e.g. requests per month of a key limited per second
+    _quota_limit_amount: Optional[int] = None
+    _quota_limit_time_period_seconds: Optional[int] = None
+
+    def __init__(self, client: Optional[httpx.Client] = None, async_client: Optional[httpx.AsyncClient] = None,
+                 limits: Optional[httpx.Limits] = None, timeout: Optional[httpx.Timeout | float] = None,
+                 client_args: Optional[dict] = None, cache: Optional[Cache] = None,
+                 cache_ttl: Optional[float] = None, negative_cache_ttl: Optional[float] = None,
+                 stale_while_revalidate: bool = False, hot_key_hits: int = 2, refresh_reserve: float = 0.1,
+                 single_flight: bool = False, rate_limit_timeout: Optional[float] = 60,
+                 ledger: Optional[QuotaLedger] = None, retry: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None, api_key: Optional[str | list[str]] = None,
+                 egress: Optional[list[str | Egress]] = None, priority_reserve: float = 0.1,
+                 max_bulk_queue: Optional[int] = None, parse: parse_modes = "validated"):
+        """
+        :param client: A sync httpx client to use instead of creating one.
+        :param async_client: An async httpx client to use instead of creating one.
+        :param limits: Connection pool limits (max connections, keep-alive) of the clients created by the resolver.
+        :param timeout: Timeout of the clients created by the resolver. Defaults to the httpx default.
+        :param client_args: Additional arguments to pass to httpx.Client() and httpx.AsyncClient()
+        :param cache: Cache for the lookups of the resolver, can be shared between resolvers.
+        :param cache_ttl: Seconds responses of this resolver are cached, defaults to the cache ttl.
+        :param negative_cache_ttl: Seconds failed lookups of this resolver are cached, defaults to the cache one.
+        :param stale_while_revalidate: Let async_resolve() answer hot keys with expired entries (see stale_ttl of the
+            cache) immediately and refresh them in the background.
+        :param hot_key_hits: Lookups of a key per minute that make it hot.
+        :param refresh_reserve: Share of the rate limit background refreshes leave for regular lookups.
+        :param single_flight: Let concurrent identical lookups (sync and async) share one request and its result.
+        :param rate_limit_timeout: Maximum seconds a lookup waits for the rate limit before raising RateLimitError,
+            None waits as long as needed and 0 never waits.
+        :param ledger: Quota ledger shared with the other processes on the host, every request is debited from it.
+        :param retry: When to retry failed requests, RetryPolicy(max_attempts=1) disables retries. Every retry is
+            charged against the rate limit.
+        :param circuit_breaker: Circuit breaker of the resolver, a default one (opens at 50% errors of at least 10
+            requests per minute) if not provided.
+        :param api_key: API key of providers that need one, or a list of API keys. Every key has its own rate limit,
+            each request uses the key with the most requests left.
+        :param egress: Proxy URLs or local IP addresses (or Egress objects) to send the requests through, instead of
+            the clients. Providers limiting by client IP address allow every egress its own requests, each request uses
+            the egress with the most requests left.
+        :param priority_reserve: Share of every rate limit window bulk lookups (see cool_ip_api.utils.priority) leave
+            for interactive ones.
+        :param max_bulk_queue: Maximum bulk lookups waiting for the rate limit, further ones raise RateLimitError right
+            away. None doesn't limit it.
+        :param parse: What lookups return: "validated" pydantic models, "lazy" LazyResponses that validate a field
+            when it is read, or the "raw" decoded JSON. Raw and lazy responses skip the validation cost in bulk runs.
+        """
+        if parse not in get_args(parse_modes):
+            raise ValueError(f"Unknown parse mode {parse}, use one of {', '.join(get_args(parse_modes))}")
+        self.parse = parse
+        self._client = client
+        self._async_client = async_client
+        self._owns_client = client is None
+        self._owns_async_client = async_client is None
+        self._client_args = dict(client_args or {})
+        self._client_args["limits"] = limits or self.default_limits
+        if timeout is not None:
+            self._client_args["timeout"] = timeout
+        self._lock = threading.RLock()
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.negative_cache_ttl = negative_cache_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hot_key_hits = hot_key_hits
+        self.refresh_reserve = refresh_reserve
+        self.access_counter = AccessCounter()
+        self._refreshing: dict[Hashable, asyncio.Task] = {}
+        self.single_flight = SingleFlight() if single_flight else None
+        self.rate_limit_timeout = rate_limit_timeout
+        self.ledger = ledger
+        self.retry = retry or self.default_retry
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.api_keys: list[Optional[str]] = [api_key] if api_key is None or isinstance(api_key, str) else list(api_key)
+        if not self.api_keys:
+            raise ValueError("At least one API key is needed")
+        if egress is not None and (client is not None or async_client is not None):
+            raise ValueError("Pass either clients or egress, not both")
+        self.egress: list[Egress] = [Egress.parse(path) for path in egress or []]
+        self._egress_clients: dict[int, httpx.Client] = {}
+        self._egress_async_clients: dict[int, httpx.AsyncClient] = {}
+        # A route is an API key and an egress (index), None for resolvers without keys / egress pool
+        self._routes: list[tuple[Optional[str], Optional[int]]] = [
+            (key, index) for key in self.api_keys for index in (range(len(self.egress)) if self.egress else [None])]
+        self._next_route = 0
+        self._limiters: dict[tuple[Optional[str], Optional[int]], Optional[RateLimiter]] = {}
+        self.limiter = None if self._request_limit_amount is None else \
+            RateLimiter(self._request_limit_amount, self._request_limit_time_period_seconds, priority_reserve,
+                        max_bulk_queue)
+        self._quotas: dict[Optional[str], RateLimiter] = {} if self._quota_limit_amount is None else {
+            key: RateLimiter(self._quota_limit_amount, self._quota_limit_time_period_seconds) for key in self.api_keys}
+        # The route of the request in progress, per thread and asyncio task
+        self._current_route: ContextVar[Optional[tuple[Optional[str], Optional[int]]]] = \
+            ContextVar(f"cool_ip_api_route_{id(self)}", default=None)
+
+    @property
+    def client(self) -> httpx.Client:
+        """
+        | The sync client, of the egress of the request in progress if the resolver has an egress pool.
+        """
+        if (index := self.__route()[1]) is not None:
+            return self.__egress_client(index)
+        if self._client is None or self._client.is_closed:
+            with self._lock:
+                if self._client is None or self._client.is_closed:
+                    self._client = httpx.Client(**self._client_args)
+                    self._owns_client = True
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """
+        | The async client, of the egress of the request in progress if the resolver has an egress pool.
+        """
+        if (index := self.__route()[1]) is not None:
+            return self.__egress_async_client(index)
+        if self._async_client is None or self._async_client.is_closed:
+            with self._lock:
+                if self._async_client is None or self._async_client.is_closed:
+                    self._async_client = httpx.AsyncClient(**self._client_args)
+                    self._owns_async_client = True
+        return self._async_client
+
+    def __egress_client(self, index: int) -> httpx.Client:
+        client = self._egress_clients.get(index)
+        if client is None or client.is_closed:
+            with self._lock:
+                client = self._egress_clients.get(index)
+                if client is None or client.is_closed:
+                    args = {**self._client_args, **self.egress[index].client_args(self._client_args["limits"])}
+                    client = self._egress_clients[index] = httpx.Client(**args)
+        return client
+
+    def __egress_async_client(self, index: int) -> httpx.AsyncClient:
+        client = self._egress_async_clients.get(index)
+        if client is None or client.is_closed:
+            with self._lock:
+                client = self._egress_async_clients.get(index)
+                if client is None or client.is_closed:
+                    args = {**self._client_args, **self.egress[index].async_client_args(self._client_args["limits"])}
+                    client = self._egress_async_clients[index] = httpx.AsyncClient(**args)
+        return client
+
+    def __best_route(self, amount: int = 1) -> tuple[Optional[str], Optional[int]]:
+        if len(self._routes) == 1:
+            return self._routes[0]
+        with self._lock:
+            # Rotate the start, so routes with the same headroom take turns
+            self._next_route = (self._next_route + 1) % len(self._routes)
+            routes = self._routes[self._next_route:] + self._routes[:self._next_route]
+        if self._limiters[routes[0]] is None:
+            return routes[0]
+        # Retired keys are blocked in their limiter, so the route available first (with the most requests left) wins
+        return min(routes, key=lambda route: self.__route_headroom(route, amount))
+
+    def __route_headroom(self, route: tuple[Optional[str], Optional[int]], amount: int) -> tuple[float, int]:
+        # Seconds until amount requests can be sent, and the requests left (of the quota if the key has one)
+        limiter, quota = self._limiters[route], self._quotas.get(route[0])
+        if quota is None:
+            return limiter.wait_time(amount), -limiter.remaining
+        return max(limiter.wait_time(amount), quota.wait_time(amount)), -quota.remaining
+
+    def __route(self) -> tuple[Optional[str], Optional[int]]:
+        route = self._current_route.get()
+        return route if route is not None else self.__best_route()
+
+    @property
+    def api_key(self) -> Optional[str]:
+        """
+        | The API key of the request in progress, outside of a request the key with the most requests left.
+        """
+        return self.__route()[0]
+
+    @property
+    def limiter(self) -> Optional[RateLimiter]:
+        """
+        | Rate limiter of the API key or egress in use (see api_key), None if the resolver isn't rate limited.
+        """
+        return self._limiters[self.__route()]
+
+    @limiter.setter
+    def limiter(self, limiter: Optional[RateLimiter]):
+        # Limits apply per API key, or per egress (client IP address) for providers without keys. Every key or
+        # egress gets its own copy of the limiter.
+        copies = {}
+        for route in self._routes:
+            scope = route[0] if route[0] is not None else route[1]
+            if scope not in copies:
+                single = len(self._routes) == 1
+                copies[scope] = limiter if limiter is None or single else limiter.copy()
+            self._limiters[route] = copies[scope]
+
+    @property
+    def quota(self) -> Optional[RateLimiter]:
+        """
+        | Quota of the API key in use (see api_key), None if the provider has no quota on top of its rate limit.
+        """
+        return self._quotas.get(self.__route()[0])
+
+    def route_limiters(self) -> dict[str, Optional[RateLimiter]]:
+        """
+        | The rate limiter of every API key (masked, with a short hash so keys with the same start don't collide) or
+        | egress, for dashboards.
+        """
+        limiters = {}
+        for key, index in self._routes:
+            if key is not None:
+                name = f"{key[:4]}...{hashlib.sha256(key.encode()).hexdigest()[:6]}"
+            else:
+                name = self.egress[index].name if index is not None else "default"
+            limiter = self._limiters[(key, index)]
+            if name in limiters and limiters[name] is not limiter:
+                name = f"{name}#{index}"  # Egresses with the same name
+            limiters.setdefault(name, limiter)
+        return limiters
+
+    def priority_stats(self) -> dict[Priority, PriorityStats]:
+        """
+        | Queue depth and wait times of the lookups per priority, summed over the rate limiters of all API keys and
+        | egresses. Empty if the resolver isn't rate limited.
+        """
+        totals: dict[Priority, PriorityStats] = {}
+        for limiter in {id(limiter): limiter for limiter in self._limiters.values() if limiter is not None}.values():
+            for level, stats in limiter.stats().items():
+                total = totals.get(level)
+                if total is None:
+                    totals[level] = stats
+                    continue
+                acquired = total.acquired + stats.acquired
+                mean_wait = (total.mean_wait * total.acquired + stats.mean_wait * stats.acquired) / acquired \
+                    if acquired else 0.0
+                totals[level] = PriorityStats(total.waiting + stats.waiting, acquired, total.shed + stats.shed,
+                                              mean_wait, max(total.max_wait, stats.max_wait))
+        return totals
+
+    def _retire_api_key(self, seconds: Optional[float] = None):
+        """
+        | Stops using the API key of the current request, for example after the API rejected it, until seconds (a full
+        | quota period, or rate limit period without a quota, if not provided) passed. The other keys are used
+        | meanwhile.
+        """
+        quota = self.quota
+        if seconds is None and quota is not None:
+            seconds = quota.period
+        if quota is not None:
+            quota.block(seconds)
+        if self.limiter is not None:
+            self._exhaust(self.limiter.period if seconds is None else seconds)
+
+    @property
+    def requests_left(self) -> Optional[int]:
+        """
+        | Requests that can be sent right now without waiting, None if the resolver isn't rate limited.
+        """
+        return None if self.limiter is None else self.limiter.remaining
+
+    @property
+    def reset_time(self) -> Optional[datetime]:
+        """
+        | When the next request can be sent, None if the resolver isn't rate limited.
+        """
+        return None if self.limiter is None else datetime.now() + timedelta(seconds=self.limiter.wait_time())
+
+    def _quota_scope(self) -> str:
+        """
+        | What the rate limit applies to in the quota ledger: the provider, and a hash of the API key if it has one or
+        | else the egress.
+        """
+        api_key, index = self.__route()
+        if api_key is not None:
+            return f"{type(self).__name__}:{hashlib.sha256(api_key.encode()).hexdigest()[:16]}"
+        if index is not None:
+            return f"{type(self).__name__}@{self.egress[index].name}"
+        return type(self).__name__
+
+    def __ledger_delay(self, amount: int) -> Optional[float]:
+        # Debits amount requests from the ledger, returns the seconds until its window resets if it is used up
+        if self.ledger is None or self.ledger.debit(self._quota_scope(), amount, self.limiter.amount,
+                                                    self.limiter.period):
+            return None
+        return self.ledger.reset_in(self.limiter.period)
+
+    def __ledger_deadline(self) -> Optional[float]:
+        return None if self.rate_limit_timeout is None else time.monotonic() + self.rate_limit_timeout
+
+    def __check_ledger_delay(self, delay: float, deadline: Optional[float]):
+        if deadline is not None and time.monotonic() + delay > deadline:
+            raise RateLimitError("You have reached the request limit for this API (shared quota ledger)")
+
+    def __check_quota(self, amount: int):
+        # Checked before waiting for the rate limit, so lookups don't wait for a key that can't send them anyway
+        if (quota := self.quota) is not None and quota.remaining < amount:
+            raise QuotaError("You have reached the quota of the API key")
+
+    def __take_quota(self, amount: int):
+        if (quota := self.quota) is not None and not quota.try_acquire(amount, Priority.INTERACTIVE):
+            raise QuotaError("You have reached the quota of the API key")
+
+    def __check_circuit(self):
+        # Don't spend rate limit on a request the circuit breaker would stop anyway
+        if not self.circuit_breaker.available:
+            raise CircuitOpenError("The provider is unhealthy, the circuit breaker is open")
+
+    def health(self) -> Health:
+        """
+        | Health of the provider: circuit breaker state, error rate and mean latency of the last requests.
+        """
+        return self.circuit_breaker.health()
+
+    def _pre_request(self, amount: int = 1, same_route: bool = False):
+        """
+        | Picks the API key / egress with the most requests left and acquires amount requests of its rate limit (and the
+        | quota of the key and the quota ledger), waits up to rate_limit_timeout seconds for them.
+        :param same_route: Keep the API key and egress of the current request, e.g. for a retry.
+        :raises RateLimitError: If the requests aren't available within rate_limit_timeout.
+        :raises QuotaError: If the quota of the API key is used up.
+        """
+        if not same_route:
+            self._current_route.set(self.__best_route(amount))
+        if self.limiter is None:
+            return
+        self.__check_circuit()
+        self.__check_quota(amount)
+        deadline = self.__ledger_deadline()
+        if not self.limiter.acquire(amount, self.rate_limit_timeout):
+            raise RateLimitError("You have reached the request limit for this API")
+        self.__take_quota(amount)
+        while (delay := self.__ledger_delay(amount)) is not None:
+            self.__check_ledger_delay(delay, deadline)
+            time.sleep(delay)
+
+    async def _async_pre_request(self, amount: int = 1, same_route: bool = False):
+        """
+        | Picks the API key / egress with the most requests left and acquires amount requests of its rate limit (and the
+        | quota of the key and the quota ledger), waits up to rate_limit_timeout seconds for them.
+        :param same_route: Keep the API key and egress of the current request, e.g. for a retry.
+        :raises RateLimitError: If the requests aren't available within rate_limit_timeout.
+        :raises QuotaError: If the quota of the API key is used up.
+        """
+        if not same_route:
+            self._current_route.set(self.__best_route(amount))
+        if self.limiter is None:
+            return
+        self.__check_circuit()
+        self.__check_quota(amount)
+        deadline = self.__ledger_deadline()
+        if not await self.limiter.async_acquire(amount, self.rate_limit_timeout):
+            raise RateLimitError("You have reached the request limit for this API")
+        self.__take_quota(amount)
+        while (delay := self.__ledger_delay(amount)) is not None:
+            self.__check_ledger_delay(delay, deadline)
+            await asyncio.sleep(delay)
+
+    def _exhaust(self, reset_in_seconds: Optional[float] = None):
+        """
+        | Marks the rate limit as used up, for example after the API answered with 429.
+        :param reset_in_seconds: Seconds until the rate limit resets, the end of the current window if not provided.
+        """
+        if self.limiter is None:
+            return
+        if reset_in_seconds is not None:
+            self.limiter.block(reset_in_seconds)
+        else:
+            self.limiter.drain()
+        if self.ledger is not None:
+            self.ledger.exhaust(self._quota_scope(), self.limiter.amount, self.limiter.period)
+
+    def _rate_limit_state(self, r: httpx.Response) -> tuple[Optional[int], Optional[float]]:
+        """
+        | Remaining requests and seconds until the reset the API reported in a response, None for unknown values.
+        | Reads the RateLimit-Remaining / RateLimit-Reset headers, providers with own headers override this.
+        """
+        return rate_limit_headers(r.headers)
+
+    def _sync_rate_limit(self, r: httpx.Response) -> httpx.Response:
+        """
+        | Resyncs the limiter with the rate limit state of every response, so the full allowance of the API can be used
+        | without running into 429s. Honors Retry-After of 429 and 503 responses.
+        """
+        if self.limiter is None:
+            return r
+        remaining, reset_in = self._rate_limit_state(r)
+        if remaining is not None:
+            self.limiter.sync(remaining, reset_in)
+            if self.ledger is not None:
+                self.ledger.sync(self._quota_scope(), self.limiter.amount - remaining, self.limiter.period)
+        if r.status_code in [429, 503] and (delay := retry_after(r.headers)) is not None:
+            self.limiter.block(delay)
+        return r
 
+    @staticmethod
+    def _json(r: httpx.Response) -> Any:
+        """
+        | Decodes the JSON of a response, with orjson if it is installed.
+        """
+        return json_loads(r.content)
 
-class ResolverFull(ABC):
+    def _parse(self, data: dict, model: Optional[type[BaseModel]] = None) -> Any:
+        """
+        | Turns the decoded JSON of a response into what lookups return in the parse mode of the resolver.
+        :param model: The model of the response, response_model if not provided.
+        """
+        return parse_response(model or self.response_model, data, self.parse)
+
+    def _is_negative(self, response) -> bool:
+        """
+        | Whether a response is a failed lookup that should only be cached for the negative ttl.
+        """
+        return False
+
+    @staticmethod
+    def __cached_value(value: Any) -> Any:
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _cache_get(self, key: Hashable) -> Optional[Any]:
+        return self.__cached_value(self.cache.get(key))
+
+    def _cache_ttl(self, value: Any) -> float:
+        if isinstance(value, Exception) or self._is_negative(value):
+            return self.cache.negative_ttl if self.negative_cache_ttl is None else self.negative_cache_ttl
+        return self.cache.ttl if self.cache_ttl is None else self.cache_ttl
+
+    def _cache_put(self, key: Hashable, value: Any):
+        self.cache.put(key, value, self._cache_ttl(value))
+
+    def _cache_put_many(self, items: list[tuple[Hashable, Any]]):
+        by_ttl = {}
+        for key, value in items:
+            by_ttl.setdefault(self._cache_ttl(value), []).append((key, value))
+        for ttl, ttl_items in by_ttl.items():
+            self.cache.put_many(ttl_items, ttl)
+
+    def __fetch(self, key: Hashable, call: Callable[[], Any]) -> Any:
+        if self.cache is None:
+            return call()
+        try:
+            value = call()
+        except InvalidInputError as e:
+            self._cache_put(key, e)
+            raise
+        self._cache_put(key, value)
+        return value
+
+    def _cached_call(self, key: Hashable, call: Callable[[], Any]) -> Any:
+        """
+        | Answers a lookup from the cache, or does it with call() (once for concurrent callers) and caches the result.
+        """
+        if self.cache is not None and (value := self._cache_get(key)) is not None:
+            return value
+        if self.single_flight is not None:
+            return self.single_flight.do(key, lambda: self.__fetch(key, call))
+        return self.__fetch(key, call)
+
+    async def __async_fetch(self, key: Hashable, call: Callable[[], Awaitable]) -> Any:
+        if self.cache is None:
+            return await call()
+        try:
+            value = await call()
+        except InvalidInputError as e:
+            self._cache_put(key, e)
+            raise
+        self._cache_put(key, value)
+        return value
+
+    async def __async_coalesced_fetch(self, key: Hashable, call: Callable[[], Awaitable]) -> Any:
+        if self.single_flight is not None:
+            return await self.single_flight.async_do(key, lambda: self.__async_fetch(key, call))
+        return await self.__async_fetch(key, call)
+
+    def __refresh_allowed(self) -> bool:
+        if self.limiter is None:
+            return True
+        return self.limiter.remaining - 1 >= self.refresh_reserve * self.limiter.amount
+
+    async def __refresh(self, key: Hashable, call: Callable[[], Awaitable]):
+        try:
+            await self.__async_fetch(key, call)
+        except Exception:
+            # The stale entry stays until it is refreshed by a later lookup
+            pass
+        finally:
+            del self._refreshing[key]
+
+    async def _async_cached_call(self, key: Hashable, call: Callable[[], Awaitable]) -> Any:
+        """
+        | Answers a lookup from the cache, or does it with await call() (once for concurrent callers) and caches the
+        | result.
+        | With stale_while_revalidate, expired entries of hot keys are returned immediately and refreshed in the
+        | background, as long as the refresh leaves refresh_reserve of the rate limit.
+        """
+        if self.cache is None or not self.stale_while_revalidate:
+            if self.cache is not None and (value := self._cache_get(key)) is not None:
+                return value
+            return await self.__async_coalesced_fetch(key, call)
+        hot = self.access_counter.hit(key) >= self.hot_key_hits
+        if (found := self.cache.get_stale(key)) is not None:
+            value, stale = found
+            if not stale:
+                return self.__cached_value(value)
+            if hot:
+                if key not in self._refreshing and self.__refresh_allowed():
+                    self._refreshing[key] = asyncio.ensure_future(self.__refresh(key, call))
+                return self.__cached_value(value)
+        return await self.__async_coalesced_fetch(key, call)
+
+    def __send(self, send: Callable[[], httpx.Response], amount: int,
+               retry: Optional[RetryPolicy] = None) -> httpx.Response:
+        retry = retry or self.retry
+        attempt = 1
+        while True:
+            self.circuit_breaker.check()
+            start = time.monotonic()
+            try:
+                r = self._sync_rate_limit(send())
+            except Exception as e:
+                self.circuit_breaker.record(True, time.monotonic() - start)
+                if (delay := retry.delay(attempt, exception=e)) is None:
+                    raise
+            else:
+                self.circuit_breaker.record(r.status_code >= 500, time.monotonic() - start)
+                if (delay := retry.delay(attempt, response=r)) is None:
+                    return r
+            time.sleep(delay)
+            self._pre_request(amount, same_route=True)
+            attempt += 1
+
+    async def __async_send(self, send: Callable[[], Awaitable[httpx.Response]], amount: int,
+                           retry: Optional[RetryPolicy] = None) -> httpx.Response:
+        retry = retry or self.retry
+        attempt = 1
+        while True:
+            self.circuit_breaker.check()
+            start = time.monotonic()
+            try:
+                r = self._sync_rate_limit(await send())
+            except Exception as e:
+                self.circuit_breaker.record(True, time.monotonic() - start)
+                if (delay := retry.delay(attempt, exception=e)) is None:
+                    raise
+            except BaseException:
+                # Cancelled, e.g. the loser of a hedged request
+                self.circuit_breaker.cancel()
+                raise
+            else:
+                self.circuit_breaker.record(r.status_code >= 500, time.monotonic() - start)
+                if (delay := retry.delay(attempt, response=r)) is None:
+                    return r
+            await asyncio.sleep(delay)
+            await self._async_pre_request(amount, same_route=True)
+            attempt += 1
+
+    def _get(self, url: str, httpx_args: Optional[dict] = None, amount: int = 1,
+             retry: Optional[RetryPolicy] = None) -> httpx.Response:
+        """
+        | Sends a GET request, retried according to the retry policy.
+        :param amount: Requests of the rate limit a retry is charged.
+        :param retry: Retry policy of this request, the one of the resolver if not provided.
+        """
+        return self.__send(lambda: self.client.get(url, **httpx_args or {}), amount, retry)
+
+    async def _async_get(self, url: str, httpx_args: Optional[dict] = None, amount: int = 1,
+                         retry: Optional[RetryPolicy] = None) -> httpx.Response:
+        """
+        | Sends a GET request, retried according to the retry policy.
+        :param amount: Requests of the rate limit a retry is charged.
+        :param retry: Retry policy of this request, the one of the resolver if not provided.
+        """
+        return await self.__async_send(lambda: self.async_client.get(url, **httpx_args or {}), amount, retry)
+
+    def _post(self, url: str, json, httpx_args: Optional[dict] = None, amount: int = 1,
+              retry: Optional[RetryPolicy] = None) -> httpx.Response:
+        """
+        | Sends a POST request, retried according to the retry policy.
+        :param amount: Requests of the rate limit a retry is charged.
+        :param retry: Retry policy of this request, the one of the resolver if not provided.
+        """
+        return self.__send(lambda: self.client.post(url, json=json, **httpx_args or {}), amount, retry)
+
+    async def _async_post(self, url: str, json, httpx_args: Optional[dict] = None, amount: int = 1,
+                          retry: Optional[RetryPolicy] = None) -> httpx.Response:
+        """
+        | Sends a POST request, retried according to the retry policy.
+        :param amount: Requests of the rate limit a retry is charged.
+        :param retry: Retry policy of this request, the one of the resolver if not provided.
+        """
+        return await self.__async_send(lambda: self.async_client.post(url, json=json, **httpx_args or {}), amount,
+                                       retry)
+
+    def _rate_limit_delay(self) -> float:
+        """
+        | Seconds until the resolver has requests left again, 0 if it has requests left or isn't rate limited.
+        """
+        if self.limiter is None:
+            return 0
+        return self.limiter.wait_time()
+
+    def close(self):
+        """
+        | Closes the sync client(s) if created by the resolver.
+        """
+        if self._client is not None and self._owns_client:
+            self._client.close()
+        for client in self._egress_clients.values():
+            client.close()
+
+    async def aclose(self):
+        """
+        | Closes the sync and async client(s) if created by the resolver.
+        """
+        self.close()
+        if self._async_client is not None and self._owns_async_client:
+            await self._async_client.aclose()
+        for client in self._egress_async_clients.values():
+            await client.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+
+class ResolverFull(Resolver):
 
     @abstractmethod
     def resolve(self, ip: valid_ip_types, httpx_args: Optional[dict] = None):
@@ -17,8 +741,172 @@ class ResolverFull(ABC):
     async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None):
         pass
 
+    def _geo(self, response: Any) -> GeoResult:
+        """
+        | GeoResult of a response of any parse mode.
+        """
+        if isinstance(response, Mapping):
+            return self.response_model.geo_from_payload(response)
+        return response.geo()
+
+    def resolve_geo(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> GeoResult:
+        """
+        | Resolves an IP address to the GeoResult shared by all providers, see resolve().
+        """
+        return self._geo(self.resolve(ip, httpx_args=httpx_args))
+
+    async def async_resolve_geo(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> GeoResult:
+        """
+        | Resolves an IP address to the GeoResult shared by all providers, see async_resolve().
+        """
+        return self._geo(await self.async_resolve(ip, httpx_args=httpx_args))
+
+    def __cache_keys(self, ips: list[valid_ip_types], params: dict) -> Optional[list[Optional[Hashable]]]:
+        cache_key = getattr(type(self).resolve, "cache_key", None)
+        if self.cache is None or cache_key is None:
+            return None
+        return [cache_key(self, (ip,), params) for ip in ips]
+
+    def __merge_cached(self, ips: list[valid_ip_types], keys: list[Optional[Hashable]], cached: dict,
+                       results: list) -> list:
+        merged = []
+        new = []
+        results = iter(results)
+        for ip, key in zip(ips, keys):
+            if key is not None and key in cached:
+                merged.append(cached[key])
+                continue
+            result = next(results)
+            merged.append(result)
+            if key is not None and (not isinstance(result, Exception) or isinstance(result, InvalidInputError)):
+                new.append((key, result))
+        self._cache_put_many(new)
+        return merged
+
+    def _resolve_many_cached(self, ips: Iterable[valid_ip_types], resolve_misses, **params) -> list:
+        """
+        | Resolves many IP addresses with resolve_misses(ips), but only the ones that aren't cached.
+        | The cache is read and written in bulk, so persistent caches don't pay one transaction per IP address.
+        :param ips: The IP addresses to resolve.
+        :param resolve_misses: Function resolving a list of IP addresses to a list of responses or exceptions.
+        :param params: The other parameters of the lookups, as passed to resolve().
+        :return: API Responses as pydantic models, or the exception, in the same order as the IP addresses
+        """
+        ips = list(ips)
+        if (keys := self.__cache_keys(ips, params)) is None:
+            return resolve_misses(ips)
+        cached = self.cache.get_many(key for key in keys if key is not None)
+        misses = [ip for ip, key in zip(ips, keys) if key is None or key not in cached]
+        return self.__merge_cached(ips, keys, cached, resolve_misses(misses) if misses else [])
+
+    async def _async_resolve_many_cached(self, ips: Iterable[valid_ip_types], resolve_misses, **params) -> list:
+        """
+        | Resolves many IP addresses with await resolve_misses(ips), but only the ones that aren't cached.
+        | The cache is read and written in bulk, so persistent caches don't pay one transaction per IP address.
+        :param ips: The IP addresses to resolve.
+        :param resolve_misses: Coroutine function resolving a list of IP addresses to a list of responses or exceptions.
+        :param params: The other parameters of the lookups, as passed to async_resolve().
+        :return: API Responses as pydantic models, or the exception, in the same order as the IP addresses
+        """
+        ips = list(ips)
+        if (keys := self.__cache_keys(ips, params)) is None:
+            return await resolve_misses(ips)
+        cached = self.cache.get_many(key for key in keys if key is not None)
+        misses = [ip for ip, key in zip(ips, keys) if key is None or key not in cached]
+        return self.__merge_cached(ips, keys, cached, await resolve_misses(misses) if misses else [])
+
+    def __resolve_waiting(self, ip: valid_ip_types, httpx_args: Optional[dict]) -> Any:
+        # The cache is handled by resolve_many() in bulk
+        resolve = getattr(type(self).resolve, "__wrapped__", type(self).resolve)
+        while True:
+            if delay := self._rate_limit_delay():
+                time.sleep(delay)
+            try:
+                return resolve(self, ip, httpx_args=httpx_args)
+            except RateLimitError:
+                time.sleep(self._rate_limit_delay() or 1)
+            except Exception as e:
+                return e
+
+    def resolve_many(self, ips: Iterable[valid_ip_types], httpx_args: Optional[dict] = None,
+                     max_workers: int = 10) -> list[Any]:
+        """
+        | Resolves many IP addresses on a thread pool, for code that can't use asyncio.
+        | Instead of raising RateLimitError the lookups wait until the resolver has requests left again.
+        | The lookups keep the priority of the caller, e.g. run it in 'with priority(Priority.BULK)' for enrichment.
+        :param ips: The IP addresses to resolve.
+        :param httpx_args: Arguments to pass to httpx.Client.get()
+        :param max_workers: The amount of threads doing lookups.
+        :return: API Responses as pydantic models, or the raised exception, in the same order as the IP addresses
+        """
+        def resolve_misses(misses: list[valid_ip_types]) -> list:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Every lookup runs in a copy of the caller's context, so it keeps its priority
+                return list(executor.map(
+                    lambda ip, context: context.run(self.__resolve_waiting, ip, httpx_args),
+                    misses, [copy_context() for _ in misses]))
+
+        return self._resolve_many_cached(ips, resolve_misses)
+
+    async def __stream_resolve(self, ip: valid_ip_types, httpx_args: Optional[dict]) -> tuple[valid_ip_types, Any]:
+        while True:
+            if delay := self._rate_limit_delay():
+                await asyncio.sleep(delay)
+            try:
+                return ip, await self.async_resolve(ip, httpx_args=httpx_args)
+            except RateLimitError:
+                # Another lookup used up the last request, wait for the reset (at least a second if it's unknown)
+                await asyncio.sleep(self._rate_limit_delay() or 1)
+            except Exception as e:
+                return ip, e
+
+    async def resolve_stream(self, ips: AsyncIterable[valid_ip_types] | Iterable[valid_ip_types],
+                             concurrency: int = 10, ordered: bool = False,
+                             httpx_args: Optional[dict] = None) -> AsyncIterator[tuple[valid_ip_types, Any]]:
+        """
+        | Resolves IP addresses concurrently while they are read from ips.
+        | At most concurrency lookups are in flight and ips is only read as fast as results are consumed.
+        | Instead of raising RateLimitError the lookups wait until the resolver has requests left again.
+        :param ips: The IP addresses to resolve, a (async) iterable.
+        :param concurrency: The maximum amount of lookups in flight.
+        :param ordered: Yield the results in the order of ips instead of as soon as they are done.
+        :param httpx_args: Arguments to pass to httpx.AsyncClient.get()
+        :return: Async iterator of (ip, API Response as a pydantic model or the raised exception)
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        iterator = aiter(ips) if isinstance(ips, AsyncIterable) else _aiter(ips)
+        pending: deque[asyncio.Task] | set[asyncio.Task] = deque() if ordered else set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < concurrency:
+                    try:
+                        ip = await anext(iterator)
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    task = asyncio.ensure_future(self.__stream_resolve(ip, httpx_args))
+                    if ordered:
+                        pending.append(task)
+                    else:
+                        pending.add(task)
+                if not pending:
+                    return
+                if ordered:
+                    yield await pending[0]
+                    pending.popleft()
+                else:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        pending.remove(task)
+                        yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
 
-class ResolverLimited(ABC):
+class ResolverLimited(Resolver):
 
     @abstractmethod
     def resolve(self, ip: valid_ip_types, httpx_args: Optional[dict] = None):
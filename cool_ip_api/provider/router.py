@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Iterable, Optional
+
+import httpx
+from pydantic import BaseModel
+
+from cool_ip_api.provider.resolver_abc import ResolverFull, cached, valid_ip_types
+from cool_ip_api.utils.circuit import Health
+from cool_ip_api.utils.errors import ApiException, CircuitOpenError, InvalidInputError
+from cool_ip_api.utils.geo import GeoResult
+from cool_ip_api.utils.parsing import LazyResponse
+
+
+class RoutedResponse(BaseModel):
+    provider: str
+    response: Any
+
+    class Config:
+        # Lazy responses are serialized (e.g. for a cache) as their raw JSON
+        json_encoders = {LazyResponse: lambda response: response.raw}
+
+    def geo(self) -> GeoResult:
+        return self.response.geo()
+
+
+class Router(ResolverFull):
+    """
+    | Resolves IP addresses with a pool of providers, so the throughput is about the sum of their free tiers.
+    | Every lookup goes to the usable provider with the best score: the share of its rate limit that is left, its
+    | error rate and its moving average latency. When the provider fails (rate limit, quota, authentication, open
+    | circuit breaker, transport or server errors) the lookup fails over to the next one.
+    | Invalid IP addresses are not failed over, every provider would reject them.
+    | With hedge, async_resolve() sends the lookup to a second provider too if the first one hasn't answered within
+    | hedge_percentile of its latency. The first success wins, the other request is cancelled.
+    """
+    latency_alpha = 0.2  # Weight of the latest lookup in the moving average latency
+    latency_samples = 100  # Latencies per provider kept for the hedge percentile
+    hedge_min_samples = 10  # Latencies of a provider needed before its lookups are hedged
+
+    def __init__(self, providers: Iterable[ResolverFull], hedge: bool = False, hedge_percentile: float = 0.95,
+                 hedge_budget: float = 0.05, **kwargs):
+        """
+        :param providers: The providers to route the lookups to, they are not closed by the router.
+        :param hedge: Hedge async lookups that take longer than usual with a second provider.
+        :param hedge_percentile: Percentile of the latency of a provider after which its lookup is hedged.
+        :param hedge_budget: Maximum share of lookups that are hedged, every hedge is an extra request.
+        :param kwargs: Arguments of Resolver, e.g. a cache for the routed lookups.
+        """
+        super().__init__(**kwargs)
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.lookups = 0
+        self.hedges = 0
+        self._samples: dict[str, deque[float]] = {}
+        self.providers: dict[str, ResolverFull] = {}
+        for provider in providers:
+            name = type(provider).__name__
+            if name in self.providers:
+                name = f"{name}#{sum(key.split('#')[0] == name for key in self.providers) + 1}"
+            self.providers[name] = provider
+        if not self.providers:
+            raise ValueError("The router needs at least one provider")
+        self.latency: dict[str, float] = {}
+
+    def _is_negative(self, response: RoutedResponse) -> bool:
+        return self.providers[response.provider]._is_negative(response.response)
+
+    def _geo(self, response: RoutedResponse) -> GeoResult:
+        return self.providers[response.provider]._geo(response.response)
+
+    def score(self, name: str) -> Optional[float]:
+        """
+        | Score of a provider, higher is better. None if the provider isn't usable right now.
+        """
+        provider = self.providers[name]
+        health = provider.health()
+        if not health.usable:
+            return None
+        headroom = 1.0 if provider.limiter is None else provider.limiter.remaining / provider.limiter.amount
+        return headroom * (1 - health.error_rate) / (1 + self.latency.get(name, 0))
+
+    def _candidates(self) -> list[str]:
+        """
+        | The usable providers, best first.
+        """
+        scores = {name: score for name in self.providers if (score := self.score(name)) is not None}
+        return sorted(scores, key=lambda name: scores[name], reverse=True)
+
+    def _observe(self, name: str, latency: float):
+        previous = self.latency.get(name)
+        self.latency[name] = latency if previous is None else \
+            self.latency_alpha * latency + (1 - self.latency_alpha) * previous
+        self._samples.setdefault(name, deque(maxlen=self.latency_samples)).append(latency)
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """
+        | Seconds after which a lookup of the provider is hedged, None if there aren't enough latencies observed yet.
+        """
+        samples = sorted(self._samples.get(name, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[int(self.hedge_percentile * (len(samples) - 1))]
+
+    def __hedge_allowed(self) -> bool:
+        return self.hedges + 1 <= self.hedge_budget * self.lookups
+
+    @staticmethod
+    def __fail_over(error: Exception) -> bool:
+        return isinstance(error, (ApiException, httpx.HTTPError)) and not isinstance(error, InvalidInputError)
+
+    @staticmethod
+    def __check(name: str, response: Any):
+        # A provider that returned no response failed, the lookup is failed over
+        if not isinstance(response, (BaseModel, LazyResponse, dict)):
+            raise ApiException(f"{name} returned no valid response: {response!r}")
+
+    def provider_health(self) -> dict[str, Health]:
+        """
+        | Health of every provider of the pool, see Resolver.health().
+        """
+        return {name: provider.health() for name, provider in self.providers.items()}
+
+    @cached
+    def resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> RoutedResponse:
+        """
+        | Resolves an IP address with the best provider, fails over to the next ones.
+        :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
+        :param httpx_args: Arguments to pass to httpx.Client.get()
+        :return: The API Response as a pydantic model, tagged with the name of the provider
+        :rtype: RoutedResponse
+        """
+        error = None
+        for name in self._candidates():
+            start = time.monotonic()
+            try:
+                response = self.providers[name].resolve(ip, httpx_args=httpx_args)
+                self.__check(name, response)
+            except Exception as e:
+                if not self.__fail_over(e):
+                    raise
+                error = e
+                continue
+            self._observe(name, time.monotonic() - start)
+            return RoutedResponse(provider=name, response=response)
+        raise error or CircuitOpenError("No provider is usable")
+
+    async def __async_attempt(self, name: str, ip: valid_ip_types, httpx_args: Optional[dict]) -> RoutedResponse:
+        start = time.monotonic()
+        try:
+            response = await self.providers[name].async_resolve(ip, httpx_args=httpx_args)
+        except asyncio.CancelledError:
+            # The hedge won, the provider took at least this long
+            self._observe(name, time.monotonic() - start)
+            raise
+        self._observe(name, time.monotonic() - start)
+        self.__check(name, response)
+        return RoutedResponse(provider=name, response=response)
+
+    async def __hedged(self, candidates: list[str], ip: valid_ip_types, httpx_args: Optional[dict]) -> RoutedResponse:
+        # Removes the providers it tried from candidates
+        primary = candidates.pop(0)
+        pending = {asyncio.ensure_future(self.__async_attempt(primary, ip, httpx_args))}
+        try:
+            delay = self.hedge_delay(primary)
+            # The hedge must not wait for the rate limit of the second provider
+            secondary = next((name for name in candidates if self.providers[name].limiter is None
+                              or self.providers[name].limiter.remaining > 0), None)
+            if delay is not None and secondary is not None:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if not done and self.__hedge_allowed():
+                    candidates.remove(secondary)
+                    self.hedges += 1
+                    pending.add(asyncio.ensure_future(self.__async_attempt(secondary, ip, httpx_args)))
+                pending |= done
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    if not self.__fail_over(task.exception()):
+                        raise task.exception()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @cached
+    async def async_resolve(self, ip: valid_ip_types = "", httpx_args: Optional[dict] = None) -> RoutedResponse:
+        """
+        | Resolves an IP address with the best provider, fails over to the next ones.
+        | With hedge, slow lookups are sent to a second provider too.
+        :param ip: The IP address to resolve. If not provided, the IP address of the client is used.
+        :param httpx_args: Arguments to pass to httpx.AsyncClient.get()
+        :return: The API Response as a pydantic model, tagged with the name of the provider
+        :rtype: RoutedResponse
+        """
+        self.lookups += 1
+        candidates = self._candidates()
+        error = None
+        if self.hedge and len(candidates) > 1:
+            try:
+                return await self.__hedged(candidates, ip, httpx_args)
+            except Exception as e:
+                if not self.__fail_over(e):
+                    raise
+                error = e
+        for name in candidates:
+            try:
+                return await self.__async_attempt(name, ip, httpx_args)
+            except Exception as e:
+                if not self.__fail_over(e):
+                    raise
+                error = e
+        raise error or CircuitOpenError("No provider is usable")
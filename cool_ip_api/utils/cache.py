@@ -0,0 +1,545 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_address, ip_network
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Hashable, Iterable, NamedTuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows, SharedMemoryCache is not available
+    fcntl = None
+
+from cool_ip_api.utils import serialization
+from cool_ip_api.utils.chunks import chunked
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+
+class Cache(ABC):
+    """
+    | Base class of the result caches that can be put in front of a resolver.
+    | Keys are (provider, normalized ip, call parameters) tuples, values are responses or (negative cached) exceptions.
+    """
+
+    def __init__(self, ttl: float = 60 * 60, negative_ttl: float = 60, stale_ttl: float = 0):
+        """
+        :param ttl: Default seconds a response is cached.
+        :param negative_ttl: Default seconds a failed lookup is cached.
+        :param stale_ttl: Seconds an expired entry is kept to be served by get_stale(), if the cache supports it.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        | Returns the cached value, None if there is no fresh value for the key.
+        """
+
+    @abstractmethod
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        | Caches a value for ttl seconds, defaults to the ttl of the cache.
+        """
+
+    def get_stale(self, key: Hashable) -> Optional[tuple[Any, bool]]:
+        """
+        | Returns the cached value and whether it is expired, expired values are returned for stale_ttl seconds.
+        | None if there is no value for the key. Caches that don't keep expired values only return fresh ones.
+        """
+        value = self.get(key)
+        return None if value is None else (value, False)
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict[Hashable, Any]:
+        """
+        | Returns the fresh cached values of keys, missing keys are left out.
+        """
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+    def put_many(self, items: Iterable[tuple[Hashable, Any]], ttl: Optional[float] = None):
+        for key, value in items:
+            self.put(key, value, ttl)
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(self.hits, self.misses, self.evictions, len(self))
+
+
+class LRUCache(Cache):
+    """
+    | In memory cache with a maximum size, evicts the least recently used entry when full.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60 * 60, negative_ttl: float = 60, stale_ttl: float = 0):
+        """
+        :param maxsize: Maximum amount of cached entries.
+        :param ttl: Default seconds a response is cached.
+        :param negative_ttl: Default seconds a failed lookup is cached.
+        :param stale_ttl: Seconds an expired entry is kept to be served by get_stale().
+        """
+        super().__init__(ttl, negative_ttl, stale_ttl)
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_stale(self, key: Hashable) -> Optional[tuple[Any, bool]]:
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.monotonic()
+            if entry is None or entry[1] + self.stale_ttl < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1] < now
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.monotonic()
+            if entry is None or entry[1] < now:
+                if entry is not None and entry[1] + self.stale_ttl < now:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache(Cache):
+    """
+    | Persistent cache in a SQLite database, so lookups survive restarts and can be shared between processes.
+    | The database runs in WAL mode, many processes can read while one writes.
+    | Expired entries are not deleted on read, use expire() or compact() (or the cli: cool-ip-api cache compact).
+    """
+
+    def __init__(self, path: str, ttl: float = 60 * 60 * 24, negative_ttl: float = 60 * 60, stale_ttl: float = 0):
+        """
+        :param path: Path of the database file, created if it doesn't exist.
+        :param ttl: Default seconds a response is cached.
+        :param negative_ttl: Default seconds a failed lookup is cached.
+        :param stale_ttl: Seconds an expired entry is kept to be served by get_stale().
+        """
+        super().__init__(ttl, negative_ttl, stale_ttl)
+        self.path = path
+        self._local = threading.local()
+        with self._connection as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cache ("
+                               "key TEXT PRIMARY KEY, value TEXT NOT NULL, fetched_at REAL NOT NULL, "
+                               "expires_at REAL NOT NULL)")
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, every thread gets its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return json.dumps(key)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        return self.get_many([key]).get(key)
+
+    def get_stale(self, key: Hashable) -> Optional[tuple[Any, bool]]:
+        now = time.time()
+        row = self._connection.execute("SELECT value, expires_at FROM cache WHERE key = ? AND expires_at >= ?",
+                                       [self._key(key), now - self.stale_ttl]).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return serialization.loads(row[0]), row[1] < now
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict[Hashable, Any]:
+        keys = {self._key(key): key for key in keys}
+        found = {}
+        now = time.time()
+        for chunk in chunked(keys, 500):
+            rows = self._connection.execute(
+                f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(chunk))}) AND expires_at >= ?",
+                [*chunk, now])
+            for key, value in rows:
+                found[keys[key]] = serialization.loads(value)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self.put_many([(key, value)], ttl)
+
+    def put_many(self, items: Iterable[tuple[Hashable, Any]], ttl: Optional[float] = None):
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        rows = [(self._key(key), serialization.dumps(value), now, expires) for key, value in items]
+        with self._connection as connection:
+            connection.executemany("INSERT OR REPLACE INTO cache (key, value, fetched_at, expires_at) "
+                                   "VALUES (?, ?, ?, ?)", rows)
+
+    def expire(self) -> int:
+        """
+        | Deletes the expired entries (that are older than stale_ttl).
+        :return: The amount of deleted entries
+        """
+        with self._connection as connection:
+            deleted = connection.execute("DELETE FROM cache WHERE expires_at < ?",
+                                         [time.time() - self.stale_ttl]).rowcount
+        self.evictions += deleted
+        return deleted
+
+    def compact(self) -> int:
+        """
+        | Deletes the expired entries and shrinks the database file.
+        :return: The amount of deleted entries
+        """
+        deleted = self.expire()
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._connection.execute("VACUUM")
+        return deleted
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class SharedMemoryCache(Cache):
+    """
+    | Cache in shared memory for pre-fork deployments, every worker process on a host reads and writes the same table.
+    | The table is a fixed-size hash table keyed on the integer of the IP address, so the memory used never grows.
+    | Reads take no lock, every slot has a sequence number that is odd while it is written (seqlock), a reader that
+    | sees it change retries. Writers are serialized with a lock file.
+    | Create it before forking (or with the same name in every worker), call unlink() once it isn't needed anymore.
+    """
+    _magic = b"CIPC"
+    _header = struct.Struct("<4sII")  # magic, slot size, slot count
+    _slot_header = struct.Struct("<IQB16sdI")  # sequence, key hash, ip version, ip, expires at, value length
+    _max_tries = 5
+
+    def __init__(self, name: str = "cool_ip_api_cache", size: int = 64 * 1024 * 1024, slot_size: int = 1024,
+                 ttl: float = 60 * 60, negative_ttl: float = 60, probes: int = 8):
+        """
+        :param name: Name of the shared memory block, processes using the same name share the cache.
+        :param size: Memory cap in bytes, only used by the process creating the block.
+        :param slot_size: Bytes per entry, compressed responses that don't fit aren't cached.
+        :param ttl: Default seconds a response is cached.
+        :param negative_ttl: Default seconds a failed lookup is cached.
+        :param probes: Amount of slots an entry can be placed in, the one expiring first is evicted when all are used.
+        """
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryCache needs fcntl, it is not available on this platform")
+        super().__init__(ttl, negative_ttl)
+        self.name = name
+        self.probes = probes
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._header.pack_into(self._shm.buf, 0, self._magic, slot_size, (size - self._header.size) // slot_size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # The resource tracker would destroy the block when the first process using it exits, unlink() does it.
+        # It tracks the block by its POSIX name, with the leading slash SharedMemory.name leaves out.
+        self._tracked_name = f"/{self._shm.name}"
+        resource_tracker.unregister(self._tracked_name, "shared_memory")
+        magic, self.slot_size, self.slot_count = self._header.unpack_from(self._shm.buf, 0)
+        if magic != self._magic:
+            raise ValueError(f"Shared memory block {name} is not a cache")
+        self._buf = self._shm.buf
+        self._thread_lock = threading.Lock()
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a+b")
+
+    @staticmethod
+    def _pack_key(key: Hashable) -> Optional[tuple[int, int, int]]:
+        provider, ip, params = key
+        try:
+            ip = ip_address(ip)
+        except ValueError:
+            return None
+        key_hash = int.from_bytes(hashlib.blake2b(repr((provider, params)).encode(), digest_size=8).digest(), "little")
+        return key_hash, ip.version, int(ip)
+
+    def _offsets(self, key_hash: int, ip: int) -> Iterable[int]:
+        start = (key_hash ^ (ip * 0x9E3779B97F4A7C15)) % self.slot_count
+        for i in range(min(self.probes, self.slot_count)):
+            yield self._header.size + ((start + i) % self.slot_count) * self.slot_size
+
+    def _read(self, offset: int) -> Optional[tuple]:
+        for _ in range(self._max_tries):
+            sequence = struct.unpack_from("<I", self._buf, offset)[0]
+            if sequence % 2:
+                continue
+            slot = self._slot_header.unpack_from(self._buf, offset)
+            value = bytes(self._buf[offset + self._slot_header.size:offset + self._slot_header.size + slot[5]])
+            if struct.unpack_from("<I", self._buf, offset)[0] == sequence:
+                return slot, value
+        return None
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        packed = self._pack_key(key)
+        if packed is not None:
+            key_hash, version, ip = packed
+            ip_bytes = ip.to_bytes(16, "little")
+            for offset in self._offsets(key_hash, ip):
+                read = self._read(offset)
+                if read is None:
+                    continue
+                (_, slot_hash, slot_version, slot_ip, expires, _), value = read
+                if (slot_hash, slot_version, slot_ip) == (key_hash, version, ip_bytes):
+                    if expires < time.time():
+                        break
+                    self.hits += 1
+                    return serialization.loads(zlib.decompress(value))
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        packed = self._pack_key(key)
+        if packed is None:
+            return
+        key_hash, version, ip = packed
+        ip_bytes = ip.to_bytes(16, "little")
+        data = zlib.compress(serialization.dumps(value).encode())
+        if len(data) > self.slot_size - self._slot_header.size:
+            return
+        now = time.time()
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                # (offset, sequence, key hash, ip version, ip, expires at, value length) of the candidate slots
+                slots = [(offset, *self._slot_header.unpack_from(self._buf, offset))
+                         for offset in self._offsets(key_hash, ip)]
+                slot = next((slot for slot in slots if slot[2:5] == (key_hash, version, ip_bytes) or not slot[3]), None)
+                if slot is None:
+                    slot = min(slots, key=lambda slot: slot[5])
+                    if slot[5] >= now:
+                        self.evictions += 1
+                offset, sequence = slot[:2]
+                struct.pack_into("<I", self._buf, offset, sequence + 1)
+                self._buf[offset + self._slot_header.size:offset + self._slot_header.size + len(data)] = data
+                self._slot_header.pack_into(self._buf, offset, sequence + 1, key_hash, version, ip_bytes,
+                                            now + (self.ttl if ttl is None else ttl), len(data))
+                struct.pack_into("<I", self._buf, offset, (sequence + 2) % 2 ** 32)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        now = time.time()
+        size = 0
+        for i in range(self.slot_count):
+            offset = self._header.size + i * self.slot_size
+            _, _, version, _, expires, _ = self._slot_header.unpack_from(self._buf, offset)
+            size += bool(version) and expires >= now
+        return size
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        """
+        | Removes the shared memory block, processes that still have it open keep working on their mapping.
+        """
+        # SharedMemory.unlink() unregisters the block from the resource tracker, which fails if it isn't registered
+        resource_tracker.register(self._tracked_name, "shared_memory")
+        self._shm.unlink()
+
+
+class _TrieNode:
+    __slots__ = ("children", "parent", "entry")
+
+    def __init__(self, parent: Optional[_TrieNode] = None):
+        self.children: list[Optional[_TrieNode]] = [None, None]
+        self.parent = parent
+        self.entry: Optional[tuple[Any, float, Hashable]] = None  # value, expires at, LRU key
+
+
+class PrefixCache(Cache):
+    """
+    | In memory cache that stores a response for the whole network of the IP address, not only the IP address.
+    | The network is the one returned by the API (e.g. the network field of IPApiCOResponse) or, if there is none,
+    | the IP address with the configured prefix length. Lookups are answered by the longest matching cached network
+    | (binary radix trie), so a lookup of 203.0.113.7 also answers 203.0.113.8.
+    | Note that the fields of a response for a sibling IP address are the ones of the IP address it was fetched for.
+    | Failed lookups are only cached for the IP address itself.
+    """
+
+    def __init__(self, ipv4_prefix: int = 24, ipv6_prefix: int = 64, maxsize: int = 100000, ttl: float = 60 * 60,
+                 negative_ttl: float = 60):
+        """
+        :param ipv4_prefix: Prefix length of the cached network of IPv4 addresses, if the API doesn't return one.
+        :param ipv6_prefix: Prefix length of the cached network of IPv6 addresses, if the API doesn't return one.
+        :param maxsize: Maximum amount of cached networks, the least recently used one is evicted when full.
+        :param ttl: Default seconds a response is cached.
+        :param negative_ttl: Default seconds a failed lookup is cached.
+        """
+        super().__init__(ttl, negative_ttl)
+        self.prefixes = {4: ipv4_prefix, 6: ipv6_prefix}
+        self.maxsize = maxsize
+        self._roots: dict[Hashable, _TrieNode] = {}
+        self._lru: OrderedDict[Hashable, _TrieNode] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _network(self, ip: IPv4Address | IPv6Address, value: Any) -> IPv4Network | IPv6Network:
+        if isinstance(value, Exception):
+            return ip_network(ip)
+        network = getattr(value, "network", None)
+        if network:
+            try:
+                network = ip_network(network, strict=False)
+                if ip in network:
+                    return network
+            except (TypeError, ValueError):
+                pass
+        return ip_network((ip, self.prefixes[ip.version]), strict=False)
+
+    @staticmethod
+    def _bits(address: int, version: int, length: int) -> Iterable[int]:
+        size = 32 if version == 4 else 128
+        for i in range(length):
+            yield (address >> (size - 1 - i)) & 1
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        provider, ip, params = key
+        try:
+            ip = ip_address(ip)
+        except ValueError:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        with self._lock:
+            node = self._roots.get((provider, params, ip.version))
+            found = None
+            for bit in self._bits(int(ip), ip.version, ip.max_prefixlen):
+                if node is None:
+                    break
+                if node.entry is not None and node.entry[1] >= now:
+                    found = node
+                node = node.children[bit]
+            if node is not None and node.entry is not None and node.entry[1] >= now:
+                found = node
+            if found is None:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(found.entry[2])
+            self.hits += 1
+            return found.entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        provider, ip, params = key
+        try:
+            ip = ip_address(ip)
+        except ValueError:
+            return
+        network = self._network(ip, value)
+        lru_key = (provider, params, network)
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            node = self._roots.setdefault((provider, params, ip.version), _TrieNode())
+            for bit in self._bits(int(network.network_address), ip.version, network.prefixlen):
+                if node.children[bit] is None:
+                    node.children[bit] = _TrieNode(node)
+                node = node.children[bit]
+            node.entry = (value, expires, lru_key)
+            self._lru[lru_key] = node
+            self._lru.move_to_end(lru_key)
+            while len(self._lru) > self.maxsize:
+                _, evicted = self._lru.popitem(last=False)
+                evicted.entry = None
+                self._prune(evicted)
+                self.evictions += 1
+
+    @staticmethod
+    def _prune(node: _TrieNode):
+        # Removes the nodes that don't lead to an entry anymore
+        while node.parent is not None and node.entry is None and node.children == [None, None]:
+            parent = node.parent
+            parent.children[parent.children.index(node)] = None
+            node = parent
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+
+class AccessCounter:
+    """
+    | Counts the accesses of keys in fixed time windows, to tell hot keys from cold ones.
+    | Only the maxsize most recently accessed keys are tracked.
+    """
+
+    def __init__(self, window: float = 60, maxsize: int = 10000):
+        """
+        :param window: Seconds accesses are counted for, the count restarts after it.
+        :param maxsize: Maximum amount of tracked keys.
+        """
+        self.window = window
+        self.maxsize = maxsize
+        self._counts: OrderedDict[Hashable, tuple[int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: Hashable) -> int:
+        """
+        | Counts an access of key.
+        :return: The amount of accesses of key in the current window, including this one
+        """
+        now = time.monotonic()
+        with self._lock:
+            count, started = self._counts.get(key, (0, now))
+            if started + self.window < now:
+                count, started = 0, now
+            self._counts[key] = (count + 1, started)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+            return count + 1
@@ -0,0 +1,13 @@
+from itertools import islice
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """
+    | Splits an iterable into lists of at most size items, without reading more of it than needed.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import NamedTuple, Optional
+
+from cool_ip_api.utils.errors import CircuitOpenError
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class Health(NamedTuple):
+    state: CircuitState
+    calls: int
+    error_rate: float
+    latency: Optional[float]  # Mean seconds of the calls in the window
+    usable: bool
+
+
+class CircuitBreaker:
+    """
+    | Fails calls to a provider fast while it is unhealthy, instead of letting every caller wait for the timeout.
+    | Closed: calls go through, errors and slow calls are counted over a rolling window. When too many of them fail the
+    | circuit opens.
+    | Open: calls raise CircuitOpenError right away. After open_seconds the circuit is half open.
+    | Half open: a few trial calls go through, if they succeed the circuit closes, otherwise it opens again.
+    """
+
+    def __init__(self, window: float = 60, min_calls: int = 10, error_threshold: float = 0.5,
+                 slow_call_seconds: Optional[float] = None, open_seconds: float = 30, half_open_calls: int = 1):
+        """
+        :param window: Seconds of calls the error rate is computed over.
+        :param min_calls: Calls in the window needed before the circuit can open.
+        :param error_threshold: Share of failed (or slow) calls in the window that opens the circuit.
+        :param slow_call_seconds: Calls taking longer count as failed, None doesn't count slow calls.
+        :param open_seconds: Seconds the circuit stays open before trial calls are let through.
+        :param half_open_calls: Trial calls let through while half open.
+        """
+        self.window = window
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._calls: deque[tuple[float, bool, float]] = deque()  # time, failed, latency
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def __prune(self, now: float):
+        while self._calls and self._calls[0][0] <= now - self.window:
+            self._calls.popleft()
+
+    def __current_state(self, now: float) -> CircuitState:
+        if self._state == CircuitState.OPEN and now >= self._opened_at + self.open_seconds:
+            self._state = CircuitState.HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def __open(self, now: float):
+        self._state = CircuitState.OPEN
+        self._opened_at = now
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self.__current_state(time.monotonic())
+
+    @property
+    def available(self) -> bool:
+        """
+        | Whether a call would currently be let through, without counting it as a trial call.
+        """
+        with self._lock:
+            state = self.__current_state(time.monotonic())
+            return state == CircuitState.CLOSED or \
+                (state == CircuitState.HALF_OPEN and self._trials < self.half_open_calls)
+
+    def check(self):
+        """
+        | Lets a call through or raises, call it before every call.
+        :raises CircuitOpenError: If the circuit is open (or half open and the trial calls are in flight).
+        """
+        with self._lock:
+            state = self.__current_state(time.monotonic())
+            if state == CircuitState.CLOSED:
+                return
+            if state == CircuitState.HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return
+            raise CircuitOpenError("The provider is unhealthy, the circuit breaker is open")
+
+    def record(self, failed: bool, latency: float):
+        """
+        | Records the outcome of a call.
+        :param failed: Whether the call failed (transport error, server error).
+        :param latency: Seconds the call took.
+        """
+        now = time.monotonic()
+        failed = failed or (self.slow_call_seconds is not None and latency >= self.slow_call_seconds)
+        with self._lock:
+            state = self.__current_state(now)
+            if state == CircuitState.HALF_OPEN:
+                if failed:
+                    self.__open(now)
+                else:
+                    self._state = CircuitState.CLOSED
+                    self._calls.clear()
+                return
+            self._calls.append((now, failed, latency))
+            self.__prune(now)
+            if state == CircuitState.CLOSED and len(self._calls) >= self.min_calls and \
+                    sum(call[1] for call in self._calls) / len(self._calls) >= self.error_threshold:
+                self.__open(now)
+
+    def cancel(self):
+        """
+        | Forgets a call let through by check() that was cancelled before it had an outcome.
+        """
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def health(self) -> Health:
+        """
+        | Current state, error rate and mean latency over the window.
+        """
+        usable = self.available
+        with self._lock:
+            now = time.monotonic()
+            self.__prune(now)
+            calls = len(self._calls)
+            error_rate = sum(call[1] for call in self._calls) / calls if calls else 0.0
+            latency = sum(call[2] for call in self._calls) / calls if calls else None
+            return Health(self.__current_state(now), calls, error_rate, latency, usable)
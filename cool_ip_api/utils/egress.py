@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import httpx
+
+
+class Egress:
+    """
+    | One way out of the host for requests: a forward proxy or a local source address (or both).
+    | Providers that limit requests by client IP address allow each egress its own requests.
+    """
+
+    def __init__(self, proxy: Optional[str] = None, local_address: Optional[str] = None,
+                 transport: Optional[httpx.BaseTransport] = None,
+                 async_transport: Optional[httpx.AsyncBaseTransport] = None, name: Optional[str] = None):
+        """
+        :param proxy: URL of a forward proxy, e.g. http://proxy:3128
+        :param local_address: Local IP address requests are sent from.
+        :param transport: Sync httpx transport to use instead of creating one.
+        :param async_transport: Async httpx transport to use instead of creating one.
+        :param name: Name of the egress, defaults to the proxy or the local address.
+        """
+        self.proxy = proxy
+        self.local_address = local_address
+        self.transport = transport
+        self.async_transport = async_transport
+        self.name = name or proxy or local_address or f"egress-{id(self)}"
+
+    @classmethod
+    def parse(cls, egress: str | Egress) -> Egress:
+        """
+        | Returns an Egress for a proxy URL (with a scheme, e.g. http://proxy:3128) or a local IP address.
+        """
+        if isinstance(egress, Egress):
+            return egress
+        if "://" in egress:
+            return cls(proxy=egress)
+        return cls(local_address=egress)
+
+    def client_args(self, limits: httpx.Limits) -> dict:
+        """
+        | Arguments for httpx.Client() sending through this egress.
+        """
+        if self.transport is not None:
+            return {"transport": self.transport}
+        return {"transport": httpx.HTTPTransport(limits=limits, local_address=self.local_address,
+                                                 proxy=httpx.Proxy(self.proxy) if self.proxy else None)}
+
+    def async_client_args(self, limits: httpx.Limits) -> dict:
+        """
+        | Arguments for httpx.AsyncClient() sending through this egress.
+        """
+        if self.async_transport is not None:
+            return {"transport": self.async_transport}
+        return {"transport": httpx.AsyncHTTPTransport(limits=limits, local_address=self.local_address,
+                                                      proxy=httpx.Proxy(self.proxy) if self.proxy else None)}
+
+    def __repr__(self) -> str:
+        return f"Egress({self.name!r})"
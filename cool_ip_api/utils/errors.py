@@ -16,3 +16,7 @@ class QuotaError(ApiException):
 
 class InvalidInputError(ApiException):
     pass
+
+
+class CircuitOpenError(ApiException):
+    pass
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True, slots=True)
+class GeoResult:
+    """
+    | Location and network of an IP address in the same shape for every provider, see the geo() method of the response
+    | models. Much cheaper to create and keep than a pydantic model, fields a provider doesn't return are None.
+    """
+    ip: Optional[str] = None
+    country_code: Optional[str] = None  # ISO 3166-1 alpha-2
+    country: Optional[str] = None
+    region: Optional[str] = None
+    city: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    asn: Optional[int] = None
+    org: Optional[str] = None
+    timezone: Optional[str] = None  # IANA name, e.g. Europe/Berlin
+    is_eu: Optional[bool] = None
+    is_proxy: Optional[bool] = None  # Proxy, VPN or Tor exit node
+    is_hosting: Optional[bool] = None
+    is_mobile: Optional[bool] = None
+
+
+def split_asn(text: Optional[str]) -> tuple[Optional[int], Optional[str]]:
+    """
+    | Splits an autonomous system like "AS13335 Cloudflare, Inc." into the number and the organization.
+    """
+    if not text:
+        return None, None
+    number, _, org = text.partition(" ")
+    if number[:2].upper() != "AS" or not number[2:].isdigit():
+        return None, text
+    return int(number[2:]), org or None
+
+
+def split_location(text: Optional[str]) -> tuple[Optional[float], Optional[float]]:
+    """
+    | Splits a location like "-27.4820,153.0136" into the latitude and longitude.
+    """
+    latitude, _, longitude = (text or "").partition(",")
+    try:
+        return float(latitude), float(longitude)
+    except ValueError:
+        return None, None
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Iterable
+
+from cool_ip_api.utils.serialization import dumps, parse
+
+
+class Journal:
+    """
+    | Append-only checkpoint file of completed lookups, so a bulk run that crashed can resume without spending quota on
+    | IP addresses it already resolved (see BulkJob).
+    | Every lookup is one JSON line (ip, provider, response). Lines are written right away but fsynced in batches, a
+    | crash of the host loses at most the lookups since the last sync, a crash of the process none.
+    | A line torn by a crash is cut off when the journal is opened again.
+    """
+
+    def __init__(self, path: str, sync_every: int = 1000, sync_interval: float = 1.0):
+        """
+        :param path: Path of the journal file, created if it doesn't exist.
+        :param sync_every: Lookups written before the file is fsynced.
+        :param sync_interval: Maximum seconds between fsyncs while lookups are written.
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.__truncate_torn_line()
+        self._file = open(path, "ab")
+
+    def __truncate_torn_line(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            # Only the end of the file has to be read to find the last complete line
+            position = size
+            while position > 0:
+                step = min(position, 64 * 1024)
+                f.seek(position - step)
+                block = f.read(step)
+                if (index := block.rfind(b"\n")) != -1:
+                    position = position - step + index + 1
+                    break
+                position -= step
+            if position != size:
+                f.truncate(position)
+
+    def replay(self) -> dict[str, tuple[str, Any]]:
+        """
+        | Reads the lookups of the journal, later lines win.
+        :return: (provider, response) by IP address
+        """
+        with self._lock:
+            self._file.flush()
+        entries = {}
+        with open(self.path, "rb") as f:
+            for line in f:
+                ip, provider, response = json.loads(line)
+                entries[ip] = (provider, response)
+        return {ip: (provider, parse(response)) for ip, (provider, response) in entries.items()}
+
+    def append_many(self, entries: Iterable[tuple[str, str, Any]]):
+        """
+        | Writes lookups (ip, provider, response or exception) to the journal.
+        """
+        lines = b"".join(f"[{json.dumps(ip)}, {json.dumps(provider)}, {dumps(response)}]\n".encode()
+                         for ip, provider, response in entries)
+        if not lines:
+            return
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            self._unsynced += lines.count(b"\n")
+            if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self.__sync()
+
+    def append(self, ip: str, provider: str, response: Any):
+        """
+        | Writes a lookup to the journal.
+        """
+        self.append_many([(ip, provider, response)])
+
+    def __sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """
+        | Makes sure all written lookups are on disk.
+        """
+        with self._lock:
+            if self._unsynced:
+                self._file.flush()
+                self.__sync()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
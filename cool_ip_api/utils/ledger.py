@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class QuotaLedger:
+    """
+    | Request quota ledger in a SQLite database, shared by all processes (and threads) on a host.
+    | Limits like 1000 requests per day apply per egress IP address or per API key, not per resolver instance. Every
+    | request is debited from the ledger atomically, so workers can't spend the same budget twice and restarts don't
+    | reset it.
+    | Windows are aligned to the unix epoch (a day window starts at 00:00 UTC), the usage of past windows is kept as
+    | history until prune() is called.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the database file, created if it doesn't exist.
+        """
+        self.path = path
+        self._local = threading.local()
+        # Windows known to be used up by this process, so lookups don't need the database until the window ends
+        self._exhausted: dict[tuple[str, float], float] = {}
+        with self._connection as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS usage ("
+                               "scope TEXT NOT NULL, window_start REAL NOT NULL, period REAL NOT NULL, "
+                               "used INTEGER NOT NULL, PRIMARY KEY (scope, window_start, period))")
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, every thread gets its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def window_start(period: float, now: Optional[float] = None) -> float:
+        """
+        | Start (unix time) of the window of length period containing now.
+        """
+        now = time.time() if now is None else now
+        return now - now % period
+
+    def reset_in(self, period: float) -> float:
+        """
+        | Seconds until the current window of length period ends.
+        """
+        now = time.time()
+        return self.window_start(period, now) + period - now
+
+    def __update(self, scope: str, period: float, update) -> int:
+        start = self.window_start(period)
+        connection = self._connection
+        # BEGIN IMMEDIATE takes the write lock right away, so the read and the update are atomic across processes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT used FROM usage WHERE scope = ? AND window_start = ? AND period = ?",
+                                     [scope, start, period]).fetchone()
+            used = update(row[0] if row else 0)
+            connection.execute("INSERT OR REPLACE INTO usage (scope, window_start, period, used) VALUES (?, ?, ?, ?)",
+                               [scope, start, period, used])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return used
+
+    def debit(self, scope: str, amount: int, limit: int, period: float) -> bool:
+        """
+        | Debits amount requests from the current window of scope if that doesn't exceed limit.
+        :param scope: What the limit applies to, e.g. the provider and a hash of the API key.
+        :param amount: Amount of requests.
+        :param limit: Requests allowed per window.
+        :param period: Length of the window in seconds.
+        :return: False if the window doesn't have amount requests left, nothing is debited then
+        """
+        start = self.window_start(period)
+        if self._exhausted.get((scope, period)) == start:
+            return False
+        debited = False
+
+        def update(used: int) -> int:
+            nonlocal debited
+            if used + amount > limit:
+                return used
+            debited = True
+            return used + amount
+
+        if self.__update(scope, period, update) >= limit:
+            self._exhausted[(scope, period)] = start
+        return debited
+
+    def sync(self, scope: str, used: int, period: float):
+        """
+        | Raises the usage of the current window of scope to used, for example from the remaining requests reported
+        | by the API. The usage is never lowered, the API may not have counted requests in flight yet.
+        """
+        self.__update(scope, period, lambda current: max(current, used))
+
+    def exhaust(self, scope: str, limit: int, period: float):
+        """
+        | Marks the current window of scope as used up, for example after the API answered with 429.
+        """
+        self.sync(scope, limit, period)
+        self._exhausted[(scope, period)] = self.window_start(period)
+
+    def used(self, scope: str, period: float) -> int:
+        """
+        | Requests of scope used in the current window.
+        """
+        row = self._connection.execute("SELECT used FROM usage WHERE scope = ? AND window_start = ? AND period = ?",
+                                       [scope, self.window_start(period), period]).fetchone()
+        return row[0] if row else 0
+
+    def history(self, scope: str, period: float, windows: int = 30) -> list[tuple[datetime, int]]:
+        """
+        | Usage of scope in the last windows windows, newest first.
+        :return: List of (start of the window in UTC, used requests)
+        """
+        rows = self._connection.execute("SELECT window_start, used FROM usage WHERE scope = ? AND period = ? "
+                                        "ORDER BY window_start DESC LIMIT ?", [scope, period, windows])
+        return [(datetime.fromtimestamp(start, timezone.utc), used) for start, used in rows]
+
+    def prune(self, older_than: float) -> int:
+        """
+        | Deletes the history of windows that ended more than older_than seconds ago.
+        :return: The amount of deleted windows
+        """
+        return self._connection.execute("DELETE FROM usage WHERE window_start + period < ?",
+                                        [time.time() - older_than]).rowcount
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
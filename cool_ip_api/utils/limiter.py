@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Mapping, NamedTuple, Optional
+
+from cool_ip_api.utils.priority import Priority, current_priority
+
+
+class PriorityStats(NamedTuple):
+    waiting: int  # Callers waiting right now
+    acquired: int
+    shed: int  # Callers that gave up, because of the timeout or a full queue
+    mean_wait: float  # Mean seconds acquired callers waited
+    max_wait: float
+
+
+class RateLimiter:
+    """
+    | Sliding window rate limiter on time.monotonic(): at most amount requests in any period seconds.
+    | Unlike a fixed window it never allows a burst at a window boundary, a request is allowed again exactly period
+    | seconds after the request it replaces.
+    | acquire() / async_acquire() wait for a free slot instead of failing. Waiting interactive callers reserve their
+    | slot when they start to wait, so they are served in order and can't be overtaken by later callers.
+    | Bulk callers (see cool_ip_api.utils.priority) can't use the reserved share of the window and only take a slot
+    | once it is free, so interactive callers always go first. When the bulk queue is full bulk callers are shed.
+    | The limiter is thread safe.
+    """
+
+    def __init__(self, amount: int, period: float, reserve: float = 0, max_bulk_queue: Optional[int] = None):
+        """
+        :param amount: Requests allowed per period.
+        :param period: Length of the window in seconds.
+        :param reserve: Share of the window reserved for interactive requests.
+        :param max_bulk_queue: Maximum bulk callers waiting, further ones are shed right away. None doesn't limit it.
+        """
+        self.amount = amount
+        self.period = period
+        self.reserve = reserve
+        self.max_bulk_queue = max_bulk_queue
+        self.bulk_amount = amount - int(amount * reserve)
+        self._log: deque[float] = deque()  # Times of the sent and reserved requests, sorted
+        self._blocked_until = 0.0
+        # End of the window the API reported and time of the last sync()
+        self._synced_until = 0.0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+        # waiting, acquired, shed, total wait, max wait
+        self._stats: dict[Priority, list] = {level: [0, 0, 0, 0.0, 0.0] for level in Priority}
+
+    def copy(self) -> RateLimiter:
+        """
+        | A new limiter with the same settings and no requests.
+        """
+        return RateLimiter(self.amount, self.period, self.reserve, self.max_bulk_queue)
+
+    def __prune(self, now: float):
+        while self._log and self._log[0] <= now - self.period:
+            self._log.popleft()
+
+    def __slot(self, amount: int, now: float) -> float:
+        # The earliest time amount requests can be sent, not earlier than already reserved ones
+        if amount > self.amount:
+            raise ValueError(f"Can't acquire {amount} requests, the limit is {self.amount}")
+        at = max(now, self._blocked_until, self._log[-1] if self._log else now)
+        over = len(self._log) + amount - self.amount
+        if over > 0:
+            at = max(at, self._log[over - 1] + self.period)
+        return at
+
+    def __reserve(self, amount: int, timeout: Optional[float]) -> Optional[float]:
+        with self._lock:
+            now = time.monotonic()
+            self.__prune(now)
+            at = self.__slot(amount, now)
+            if timeout is not None and at - now > timeout:
+                self._stats[Priority.INTERACTIVE][2] += 1
+                return None
+            self._log.extend([at] * amount)
+            self.__acquired(Priority.INTERACTIVE, at - now)
+            if at > now:
+                # Waits for its reserved slot, see __interactive_done()
+                self._stats[Priority.INTERACTIVE][0] += 1
+            return at - now
+
+    def __interactive_done(self):
+        with self._lock:
+            self._stats[Priority.INTERACTIVE][0] -= 1
+
+    def __acquired(self, level: Priority, wait: float):
+        stats = self._stats[level]
+        stats[1] += 1
+        stats[3] += wait
+        stats[4] = max(stats[4], wait)
+
+    def __take_bulk(self, amount: int) -> float:
+        # Takes amount requests now if the bulk share allows it and returns 0, otherwise the seconds to wait
+        if amount > self.bulk_amount:
+            raise ValueError(f"Can't acquire {amount} bulk requests, the limit is {self.bulk_amount}")
+        with self._lock:
+            now = time.monotonic()
+            self.__prune(now)
+            if self._blocked_until > now:
+                return self._blocked_until - now
+            # Reserved interactive requests count as well, they are never overtaken
+            over = len(self._log) + amount - self.bulk_amount
+            if over > 0:
+                return max(self._log[over - 1] + self.period - now, 0.001)
+            index = bisect.bisect_right(self._log, now)
+            for _ in range(amount):
+                self._log.insert(index, now)
+            return 0
+
+    def __bulk_queue(self, timeout: Optional[float]) -> Optional[float]:
+        # Enters the bulk queue, returns the deadline or None if the caller is shed
+        with self._lock:
+            stats = self._stats[Priority.BULK]
+            if self.max_bulk_queue is not None and stats[0] >= self.max_bulk_queue:
+                stats[2] += 1
+                return None
+            stats[0] += 1
+        return float("inf") if timeout is None else time.monotonic() + timeout
+
+    def __bulk_done(self, start: float, acquired: bool):
+        with self._lock:
+            stats = self._stats[Priority.BULK]
+            stats[0] -= 1
+            if acquired:
+                self.__acquired(Priority.BULK, time.monotonic() - start)
+            else:
+                stats[2] += 1
+
+    def __acquire_bulk(self, amount: int, timeout: Optional[float]) -> bool:
+        start = time.monotonic()
+        if (deadline := self.__bulk_queue(timeout)) is None:
+            return False
+        acquired = False
+        try:
+            while (wait := self.__take_bulk(amount)) > 0:
+                if time.monotonic() + wait > deadline:
+                    return False
+                time.sleep(wait)
+            acquired = True
+            return True
+        finally:
+            self.__bulk_done(start, acquired)
+
+    async def __async_acquire_bulk(self, amount: int, timeout: Optional[float]) -> bool:
+        start = time.monotonic()
+        if (deadline := self.__bulk_queue(timeout)) is None:
+            return False
+        acquired = False
+        try:
+            while (wait := self.__take_bulk(amount)) > 0:
+                if time.monotonic() + wait > deadline:
+                    return False
+                await asyncio.sleep(wait)
+            acquired = True
+            return True
+        finally:
+            self.__bulk_done(start, acquired)
+
+    def stats(self) -> dict[Priority, PriorityStats]:
+        """
+        | Queue depth and wait times per priority.
+        """
+        with self._lock:
+            return {level: PriorityStats(waiting, acquired, shed, total_wait / acquired if acquired else 0.0, max_wait)
+                    for level, (waiting, acquired, shed, total_wait, max_wait) in self._stats.items()}
+
+    def wait_time(self, amount: int = 1) -> float:
+        """
+        | Seconds until amount requests could be acquired.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.__prune(now)
+            return self.__slot(amount, now) - now
+
+    @property
+    def remaining(self) -> int:
+        """
+        | Requests that can be acquired right now without waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.__prune(now)
+            if self._blocked_until > now:
+                return 0
+            return max(self.amount - len(self._log), 0)
+
+    def try_acquire(self, amount: int = 1, priority: Optional[Priority] = None) -> bool:
+        """
+        | Acquires amount requests if that is possible without waiting.
+        """
+        return self.acquire(amount, 0, priority)
+
+    def acquire(self, amount: int = 1, timeout: Optional[float] = None, priority: Optional[Priority] = None) -> bool:
+        """
+        | Acquires amount requests, blocks until they are available.
+        :param amount: Amount of requests.
+        :param timeout: Maximum seconds to wait, None waits as long as needed.
+        :param priority: Priority of the requests, the one of the current context if not provided.
+        :return: False if the requests aren't available within timeout (interactive callers don't wait then)
+        """
+        if (priority or current_priority()) == Priority.BULK:
+            return self.__acquire_bulk(amount, timeout)
+        wait = self.__reserve(amount, timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self.__interactive_done()
+        return True
+
+    async def async_acquire(self, amount: int = 1, timeout: Optional[float] = None,
+                            priority: Optional[Priority] = None) -> bool:
+        """
+        | Acquires amount requests, waits until they are available.
+        :param amount: Amount of requests.
+        :param timeout: Maximum seconds to wait, None waits as long as needed.
+        :param priority: Priority of the requests, the one of the current context if not provided.
+        :return: False if the requests aren't available within timeout (interactive callers don't wait then)
+        """
+        if (priority or current_priority()) == Priority.BULK:
+            return await self.__async_acquire_bulk(amount, timeout)
+        wait = self.__reserve(amount, timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.__interactive_done()
+        return True
+
+    def block(self, seconds: float):
+        """
+        | Allows no requests for the next seconds, for example after the API answered with 429.
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def drain(self):
+        """
+        | Marks the remaining requests of the current window as used.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.__prune(now)
+            self._log.extend([self._log[-1] if self._log else now] * (self.amount - len(self._log)))
+
+    def sync(self, remaining: int, reset_in: Optional[float] = None):
+        """
+        | Resyncs the limiter with the rate limit state reported by the API.
+        | In a new window of the API the requests sent so far are replaced by the ones it counted, requests acquired
+        | since the last sync are in flight and stay. Within the same window the usage is only raised: the API hasn't
+        | counted requests in flight yet and responses can arrive out of order, so a state reporting more requests left
+        | is stale. Reserved requests of waiting callers always stay.
+        :param remaining: Requests the API allows until its window resets.
+        :param reset_in: Seconds until the window of the API resets, a full period if not provided.
+        """
+        known_reset = reset_in is not None
+        reset_in = min(max(reset_in, 0), self.period) if known_reset else self.period
+        with self._lock:
+            now = time.monotonic()
+            self.__prune(now)
+            window_end = now + reset_in
+            past = [at for at in self._log if at <= now]
+            reserved = [at for at in self._log if at > now]
+            # X-Ttl like headers are rounded to seconds, a window ending within a second of the last one is the same
+            if now < self._synced_until and (not known_reset or window_end <= self._synced_until + 1):
+                kept = past
+            else:
+                kept = [at for at in past if at > self._synced_at]
+                self._synced_until = window_end
+            self._synced_at = now
+            counted = max(self.amount - remaining - len(kept), 0)
+            self._log = deque(sorted([window_end - self.period] * counted + kept) + reserved)
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    | Seconds to wait from the Retry-After header (seconds or a HTTP date), None if there is none.
+    """
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def rate_limit_headers(headers: Mapping[str, str]) -> tuple[Optional[int], Optional[float]]:
+    """
+    | Remaining requests and seconds until the reset from the RateLimit-Remaining / RateLimit-Reset headers (or their
+    | X-RateLimit- variants), None for a value that isn't sent.
+    | Reset values that look like a unix timestamp are converted to seconds from now.
+    """
+    remaining = headers.get("ratelimit-remaining", headers.get("x-ratelimit-remaining"))
+    reset = headers.get("ratelimit-reset", headers.get("x-ratelimit-reset"))
+    try:
+        remaining = int(remaining) if remaining is not None else None
+    except ValueError:
+        remaining = None
+    try:
+        reset = float(reset) if reset is not None else None
+    except ValueError:
+        reset = None
+    if reset is not None and reset > 1e9:
+        reset = max(reset - time.time(), 0)
+    return remaining, reset
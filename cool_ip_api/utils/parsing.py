@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Literal
+
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import MissingError
+
+try:
+    import orjson
+except ImportError:  # Optional, the standard library decoder is used instead
+    orjson = None
+
+parse_modes = Literal["raw", "lazy", "validated"]
+
+
+def json_loads(content: bytes | str) -> Any:
+    """
+    | Decodes JSON with orjson if it is installed, it is several times faster than the json module.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class LazyResponse:
+    """
+    | Read-only stand-in for a response model that validates a field only when it is read.
+    | Lookups that only need a few fields (or only the GeoResult, see geo()) don't pay for the validation of the whole
+    | response. Anything that isn't a field (e.g. json()) validates the whole response with model().
+    """
+    __slots__ = ("model_class", "raw", "_values", "_model", "_prepared")
+
+    def __init__(self, model_class: type[BaseModel], raw: dict):
+        """
+        :param model_class: The response model.
+        :param raw: The decoded JSON of the response.
+        """
+        self.model_class = model_class
+        self.raw = raw
+        self._values: dict[str, Any] = {}
+        self._model = None
+        self._prepared = None
+
+    def __data(self) -> dict:
+        # Models like IpifyOrgResponse derive fields from the payload in _prepare()
+        if self._prepared is None:
+            prepare = getattr(self.model_class, "_prepare", None)
+            self._prepared = self.raw if prepare is None else prepare(dict(self.raw))
+        return self._prepared
+
+    def __validate(self, name: str) -> Any:
+        field = self.model_class.__fields__[name]
+        data = self.__data()
+        if field.alias in data:
+            value = data[field.alias]
+        elif name in data and self.model_class.__config__.allow_population_by_field_name:
+            value = data[name]
+        elif field.required:
+            raise ValidationError([ErrorWrapper(MissingError(), loc=field.alias)], self.model_class)
+        else:
+            return field.get_default()
+        value, errors = field.validate(value, {}, loc=field.alias, cls=self.model_class)
+        if errors:
+            raise ValidationError(errors if isinstance(errors, list) else [errors], self.model_class)
+        return value
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes that aren't slots
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name in self.model_class.__fields__:
+            if name not in self._values:
+                self._values[name] = self.__validate(name)
+            return self._values[name]
+        return getattr(self.model(), name)
+
+    def model(self) -> BaseModel:
+        """
+        | The response validated as a whole.
+        """
+        if self._model is None:
+            self._model = self.model_class(**self.raw)
+        return self._model
+
+    def geo(self):
+        """
+        | GeoResult of the response, read from the payload without validating it if the model supports that.
+        """
+        if hasattr(self.model_class, "geo_from_payload"):
+            return self.model_class.geo_from_payload(self.raw)
+        return self.model().geo()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, LazyResponse):
+            return self.model_class is other.model_class and self.raw == other.raw
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"LazyResponse({self.model_class.__name__}, {self.raw!r})"
+
+
+def parse_response(model_class: type[BaseModel], data: dict, mode: parse_modes = "validated") -> Any:
+    """
+    | Turns the decoded JSON of a response into the model (validated), a LazyResponse (lazy) or leaves it as is (raw).
+    """
+    if mode == "validated":
+        return model_class(**data)
+    if mode == "lazy":
+        return LazyResponse(model_class, data)
+    return data
+
+
+def validated(model_class: type[BaseModel], response: Any) -> Any:
+    """
+    | The validated model of a response of any parse mode.
+    """
+    if isinstance(response, LazyResponse):
+        return response.model()
+    if isinstance(response, dict):
+        return model_class(**response)
+    return response
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Iterator
+
+
+class Priority(Enum):
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+
+
+_priority: ContextVar[Priority] = ContextVar("cool_ip_api_priority", default=Priority.INTERACTIVE)
+
+
+def current_priority() -> Priority:
+    """
+    | Priority of the lookups of the current thread / asyncio task, interactive unless set with priority().
+    """
+    return _priority.get()
+
+
+@contextmanager
+def priority(level: Priority | str) -> Iterator[Priority]:
+    """
+    | Tags the lookups done inside the with block (in the current thread / asyncio task and tasks started from it).
+    | Bulk lookups can't use the share of the rate limit reserved for interactive ones and wait (or are shed) first.
+    :param level: Priority.INTERACTIVE / "interactive" or Priority.BULK / "bulk"
+    """
+    level = Priority(level)
+    token = _priority.set(level)
+    try:
+        yield level
+    finally:
+        _priority.reset(token)
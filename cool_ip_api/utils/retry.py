@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import random
+from typing import Optional
+
+import httpx
+
+from cool_ip_api.utils.limiter import retry_after
+
+
+class RetryPolicy:
+    """
+    | When and how long to wait before a failed request is sent again.
+    | Transport errors (connection errors, timeouts) and responses with a retryable status are retried with exponential
+    | backoff and full jitter (a random delay between 0 and the backoff), or after Retry-After if the API sent it.
+    """
+
+    def __init__(self, max_attempts: int = 3, backoff: float = 0.5, max_backoff: float = 30,
+                 retry_on: tuple[type[BaseException], ...] = (httpx.TransportError,),
+                 retry_statuses: tuple[int, ...] = (429, 500, 502, 503, 504), max_retry_after: float = 60):
+        """
+        :param max_attempts: Attempts per request including the first one, 1 disables retries.
+        :param backoff: Backoff of the first retry in seconds, doubled for every further retry.
+        :param max_backoff: Maximum backoff in seconds.
+        :param retry_on: Exceptions that are retried.
+        :param retry_statuses: Response status codes that are retried.
+        :param max_retry_after: Responses asking to retry later than this many seconds (Retry-After) are not retried.
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+        self.retry_statuses = retry_statuses
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None,
+              exception: Optional[BaseException] = None) -> Optional[float]:
+        """
+        | Seconds to wait before the next attempt, None if the request shouldn't be retried.
+        :param attempt: The attempt that failed, starting at 1.
+        :param response: The response of the failed attempt.
+        :param exception: The exception raised by the failed attempt.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if exception is not None and not isinstance(exception, self.retry_on):
+            return None
+        if response is not None:
+            if response.status_code not in self.retry_statuses:
+                return None
+            if (wait := retry_after(response.headers)) is not None:
+                return wait if wait <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
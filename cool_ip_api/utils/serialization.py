@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import importlib
+import json
+from typing import Any
+
+from pydantic import BaseModel
+
+from cool_ip_api.utils.geo import GeoResult
+from cool_ip_api.utils.parsing import LazyResponse
+
+
+def _type_name(value: Any) -> str:
+    return _class_name(type(value))
+
+
+def _class_name(cls: type) -> str:
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def _load_type(name: str) -> type:
+    module, _, qualname = name.partition(":")
+    # Only types of this package can be loaded, a cache file must not be able to import arbitrary code
+    if module.split(".")[0] != "cool_ip_api":
+        raise ValueError(f"Can't load {name}, only types of cool_ip_api can be deserialized")
+    obj = importlib.import_module(module)
+    for part in qualname.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _routed_response_type() -> type:
+    # Imported when used, the router module imports the caches that use this module
+    from cool_ip_api.provider.router import RoutedResponse
+    return RoutedResponse
+
+
+def dumps(value: BaseModel | LazyResponse | dict | GeoResult | Exception) -> str:
+    """
+    | Serializes a response (of any parse mode), a GeoResult or an exception (of a negative cached lookup) to JSON.
+    | The response of a RoutedResponse is serialized with its type, so loads() rebuilds the model of the provider.
+    """
+    if isinstance(value, Exception):
+        return json.dumps({"type": _type_name(value), "error": str(value)})
+    if isinstance(value, LazyResponse):
+        return json.dumps({"type": _class_name(value.model_class), "lazy": value.raw})
+    if isinstance(value, dict):
+        return json.dumps({"raw": value})
+    if isinstance(value, GeoResult):
+        return json.dumps({"type": _type_name(value), "fields": [getattr(value, field) for field in value.__slots__]})
+    if isinstance(value, _routed_response_type()):
+        return f'{{"type": {json.dumps(_type_name(value))}, "provider": {json.dumps(value.provider)}, ' \
+               f'"routed": {dumps(value.response)}}}'
+    # The model JSON is embedded as is, decoding and encoding it again would double the cost
+    return f'{{"type": {json.dumps(_type_name(value))}, "data": {value.json(by_alias=True)}}}'
+
+
+def loads(text: str | bytes) -> BaseModel | LazyResponse | dict | GeoResult | Exception:
+    """
+    | Deserializes a response, a GeoResult or an exception serialized with dumps().
+    """
+    return parse(json.loads(text))
+
+
+def parse(data: dict) -> BaseModel | LazyResponse | dict | GeoResult | Exception:
+    """
+    | Deserializes a response, a GeoResult or an exception from the parsed JSON of dumps().
+    """
+    if "raw" in data:
+        return data["raw"]
+    cls = _load_type(data["type"])
+    if "error" in data:
+        return cls(data["error"])
+    if "fields" in data:
+        return cls(*data["fields"])
+    if "lazy" in data:
+        return LazyResponse(cls, data["lazy"])
+    if "routed" in data:
+        return cls(provider=data["provider"], response=parse(data["routed"]))
+    return cls.parse_obj(data["data"])
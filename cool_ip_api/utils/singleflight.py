@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Abandoned(Exception):
+    """
+    | The leader of a call was cancelled, its followers have to do the call again.
+    """
+
+
+class SingleFlight:
+    """
+    | Coalesces concurrent identical calls: while a call for a key is in flight, other callers with the same key wait
+    | for it and get its result (or exception) instead of doing the call again.
+    | Works across threads and event loops, threaded callers can wait for an async call and the other way around.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def __join(self, key: Hashable) -> tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def __done(self, key: Hashable, future: Future, result: Any = None, exception: BaseException = None):
+        with self._lock:
+            del self._calls[key]
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    def __settle(future: Future, waiter: asyncio.Future):
+        if waiter.done():  # The follower was cancelled
+            return
+        if future.exception() is not None:
+            waiter.set_exception(future.exception())
+        else:
+            waiter.set_result(future.result())
+
+    async def __follow(self, future: Future) -> Any:
+        # Every follower waits on its own asyncio future, cancelling it never touches the shared one
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        def wake(done: Future):
+            try:
+                loop.call_soon_threadsafe(self.__settle, done, waiter)
+            except RuntimeError:  # The loop of the follower is closed
+                pass
+
+        future.add_done_callback(wake)
+        return await waiter
+
+    def do(self, key: Hashable, call: Callable[[], Any]) -> Any:
+        """
+        | Returns call(), or the result of the call in flight for key.
+        """
+        while True:
+            future, leader = self.__join(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except _Abandoned:
+                continue  # The leader was cancelled, one of the followers does the call
+        try:
+            result = call()
+        except Exception as e:
+            self.__done(key, future, exception=e)
+            raise
+        except BaseException:
+            self.__done(key, future, exception=_Abandoned())
+            raise
+        self.__done(key, future, result)
+        return result
+
+    async def async_do(self, key: Hashable, call: Callable[[], Awaitable]) -> Any:
+        """
+        | Returns await call(), or the result of the call in flight for key.
+        | Cancelling a follower doesn't affect the others, when the leader is cancelled the next caller takes over.
+        """
+        while True:
+            future, leader = self.__join(key)
+            if leader:
+                break
+            try:
+                return await self.__follow(future)
+            except _Abandoned:
+                continue  # The leader was cancelled, one of the followers does the call
+        try:
+            result = await call()
+        except Exception as e:
+            self.__done(key, future, exception=e)
+            raise
+        except BaseException:
+            # Cancellation (or an interrupt) of the leader, the followers must not get it
+            self.__done(key, future, exception=_Abandoned())
+            raise
+        self.__done(key, future, result)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._calls)
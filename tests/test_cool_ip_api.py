@@ -23,6 +23,15 @@ def current_ip_v6():
     return ip
 
 
+def mock_clients(handler):
+    """
+    | Returns a sync and async httpx client that answer every request with handler(request) instead of the network.
+    """
+    import httpx
+    transport = httpx.MockTransport(handler)
+    return httpx.Client(transport=transport), httpx.AsyncClient(transport=transport)
+
+
 def get_secret(name: str):
     with open("secrets.json") as f:
         import json
@@ -192,3 +201,1814 @@ class TestMyIpWTF:
         response = self.api_co.resolve("dualstack")
         assert any(
             [response.YourFuckingIPv4Address == self.own_ip_v4, response.YourFuckingIPv6Address == self.own_ip_v6])
+
+
+class TestMyIpWTFCombinedFallback:
+    @staticmethod
+    def handler(request):
+        import httpx
+        if request.url.host.startswith("ipv6."):
+            raise httpx.ConnectError("Network is unreachable", request=request)
+        return httpx.Response(200, json={
+            "YourFuckingIPAddress": "1.1.1.1", "YourFuckingLocation": "Brisbane, QLD, Australia",
+            "YourFuckingHostname": "one.one.one.one", "YourFuckingISP": "Cloudflare, Inc.",
+            "YourFuckingTorExit": False, "YourFuckingCountryCode": "AU",
+        })
+
+    def test_ipv4_only_host(self):
+        from cool_ip_api.provider.myip_wtf import MyIpWTF
+        resolver = MyIpWTF(client=mock_clients(self.handler)[0], rate_limit_timeout=3)
+        response = resolver.resolve("combined")
+        assert response.YourFuckingIPv4Address == "1.1.1.1"
+        assert response.YourFuckingIPv6Address is None
+        # The IPv6 probe isn't retried, it only used one request
+        assert resolver.requests_left == 0
+
+    def test_ipv4_only_host_async(self):
+        import asyncio
+        from cool_ip_api.provider.myip_wtf import MyIpWTF
+        resolver = MyIpWTF(async_client=mock_clients(self.handler)[1], rate_limit_timeout=3)
+        response = asyncio.run(resolver.async_resolve("combined"))
+        assert response.YourFuckingIPv4Address == "1.1.1.1"
+        assert response.YourFuckingISP == "Cloudflare, Inc."
+
+
+IP_API_COM_PAYLOAD = {
+    "status": "success", "continent": "Oceania", "continentCode": "OC", "country": "Australia", "countryCode": "AU",
+    "region": "QLD", "regionName": "Queensland", "city": "South Brisbane", "district": "", "zip": "4101",
+    "lat": -27.4766, "lon": 153.0166, "timezone": "Australia/Brisbane", "offset": 36000, "currency": "AUD",
+    "isp": "Cloudflare, Inc", "org": "APNIC and Cloudflare DNS Resolver project", "as": "AS13335 Cloudflare, Inc.",
+    "asname": "CLOUDFLARENET", "reverse": "one.one.one.one", "mobile": False, "proxy": False, "hosting": True,
+    "query": "1.1.1.1",
+}
+
+
+class TestClientPooling:
+    def setup_method(self):
+        import httpx
+        self.connections = []
+
+        def handler(request: httpx.Request):
+            self.connections.append(request.url.host)
+            return httpx.Response(200, json=IP_API_COM_PAYLOAD, headers={"x-rl": "44"})
+
+        self.handler = handler
+
+    def test_reuses_client(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        client, _ = mock_clients(self.handler)
+        with IPAPICom(client=client) as resolver:
+            assert resolver.resolve("1.1.1.1").query == "1.1.1.1"
+            assert resolver.resolve("1.1.1.1").query == "1.1.1.1"
+            assert resolver.client is client
+        assert len(self.connections) == 2
+        # Clients passed in by the caller are not closed
+        assert not client.is_closed
+
+    def test_owned_client_is_closed(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        import httpx
+        with IPAPICom(limits=httpx.Limits(max_connections=5)) as resolver:
+            client = resolver.client
+            assert resolver.client is client
+        assert client.is_closed
+
+    def test_async_reuses_client(self):
+        import asyncio
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        _, async_client = mock_clients(self.handler)
+
+        async def run():
+            async with IPAPICom(async_client=async_client) as resolver:
+                await resolver.async_resolve("1.1.1.1")
+                await resolver.async_resolve("1.1.1.1")
+                assert resolver.async_client is async_client
+
+        asyncio.run(run())
+        assert len(self.connections) == 2
+
+
+class TestIpApiCOMBatch:
+    def setup_method(self):
+        import json
+        import httpx
+        self.batches = []
+
+        def handler(request: httpx.Request):
+            entries = json.loads(request.content)
+            self.batches.append(entries)
+            return httpx.Response(200, json=[
+                {**IP_API_COM_PAYLOAD, "query": entry["query"]} if not entry["query"].startswith("10.")
+                else {"status": "fail", "message": "private range", "query": entry["query"]}
+                for entry in entries
+            ])
+
+        self.clients = mock_clients(handler)
+
+    def test_chunks_and_order(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        resolver = IPAPICom(client=self.clients[0])
+        ips = [f"1.1.{i // 256}.{i % 256}" for i in range(250)]
+        responses = resolver.resolve_batch(iter(ips), localization="de")
+        assert [response.query for response in responses] == ips
+        assert [len(batch) for batch in self.batches] == [100, 100, 50]
+        assert self.batches[0][0]["lang"] == "de"
+        # The batch API has a rate limit of its own
+        assert resolver.batch_route_limiters()["default"].remaining == 15 - 3
+        assert resolver.requests_left == resolver._request_limit_amount
+
+    def test_failed_entries(self):
+        import asyncio
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        resolver = IPAPICom(async_client=self.clients[1])
+        responses = asyncio.run(resolver.async_resolve_batch(["1.1.1.1", "10.0.0.1"]))
+        assert responses[0].status == "success"
+        assert responses[1].status == "fail"
+        assert responses[1].message == "private range"
+
+    def test_own_rate_limit(self):
+        import json
+        import httpx
+        import pytest
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.errors import ApiException
+        from cool_ip_api.utils.retry import RetryPolicy
+
+        def handler(request: httpx.Request):
+            if request.method == "GET":
+                return httpx.Response(200, json=IP_API_COM_PAYLOAD, headers={"X-Rl": "40", "X-Ttl": "30"})
+            if len(json.loads(request.content)) == 1:
+                return httpx.Response(500)
+            return httpx.Response(200, json=[IP_API_COM_PAYLOAD, IP_API_COM_PAYLOAD],
+                                  headers={"X-Rl": "10", "X-Ttl": "30"})
+
+        resolver = IPAPICom(client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=1))
+        resolver.resolve("1.1.1.1")
+        resolver.resolve_batch(["1.1.1.1", "1.0.0.1"])
+        # X-Rl of the batch API only syncs its limiter
+        assert resolver.requests_left == 40
+        assert resolver.batch_route_limiters()["default"].remaining == 10
+        with pytest.raises(ApiException):
+            resolver.resolve_batch(["1.1.1.1"])
+
+
+IP_INFO_IO_PAYLOAD = {
+    "ip": "1.1.1.1", "hostname": "one.one.one.one", "city": "Brisbane", "region": "Queensland", "country": "AU",
+    "loc": "-27.4820,153.0136", "org": "AS13335 Cloudflare, Inc.", "postal": "4101", "timezone": "Australia/Brisbane",
+}
+
+APIIP_API_COM_PAYLOAD = {
+    "ip": "1.1.1.1", "type": "ipv4", "continent_code": "OC", "continent_name": "Oceania", "country_code": "AU",
+    "country_name": "Australia", "region_code": "QLD", "region_name": "Queensland", "city": "Brisbane",
+    "zip": "4000", "latitude": -27.46, "longitude": 153.02,
+    "location": {"geoname_id": 2174003, "capital": "Canberra", "languages": [], "country_flag": "",
+                 "country_flag_emoji": "", "country_flag_emoji_unicode": "", "calling_code": "61", "is_eu": False},
+}
+
+
+class TestBulkLookups:
+    def test_ipinfo_io(self):
+        import json
+        import httpx
+        from cool_ip_api.provider.ipinfo_io import IPInfoIo
+        from cool_ip_api.utils.errors import InvalidInputError
+        batches = []
+
+        def handler(request: httpx.Request):
+            ips = json.loads(request.content)
+            batches.append(ips)
+            return httpx.Response(200, json={
+                ip: {"ip": ip, "bogon": True} if ip.startswith("10.") else {**IP_INFO_IO_PAYLOAD, "ip": ip}
+                for ip in ips
+            })
+
+        client, _ = mock_clients(handler)
+        ips = [f"1.1.{i // 256}.{i % 256}" for i in range(1500)] + ["10.0.0.1"]
+        results = IPInfoIo("token", client=client).resolve_many(ips)
+        assert sorted(len(batch) for batch in batches) == [501, 1000]
+        assert [result.ip for result in results[:-1]] == ips[:-1]
+        assert isinstance(results[-1], InvalidInputError)
+
+    def test_apiip_api_com(self):
+        import asyncio
+        import httpx
+        from cool_ip_api.provider.ipapi_com import APIIPApiCOM
+        from cool_ip_api.utils.errors import InvalidInputError
+
+        def handler(request: httpx.Request):
+            ips = request.url.path.rsplit("/", 1)[1].split(",")
+            return httpx.Response(200, json=[
+                {"success": False, "error": {"code": 106, "info": "invalid ip"}} if ip == "nope"
+                else {**APIIP_API_COM_PAYLOAD, "ip": ip}
+                for ip in ips
+            ])
+
+        _, async_client = mock_clients(handler)
+        resolver = APIIPApiCOM("key", async_client=async_client)
+        ips = [f"1.1.1.{i}" for i in range(60)] + ["nope"]
+        results = asyncio.run(resolver.async_resolve_many(ips))
+        assert [result.ip for result in results[:-1]] == ips[:-1]
+        assert isinstance(results[-1], InvalidInputError)
+        assert resolver.requests_left == resolver._request_limit_amount - len(ips)
+
+    def test_apiip_api_com_missing_and_request_errors(self):
+        import httpx
+        import pytest
+        from cool_ip_api.provider.ipapi_com import APIIPApiCOM
+        from cool_ip_api.utils.errors import ApiException, InvalidInputError
+        skip = {"1.1.1.2"}
+
+        def handler(request: httpx.Request):
+            ips = request.url.path.rsplit("/", 1)[1].split(",")
+            if "2.2.2.2" in ips:
+                return httpx.Response(200, json={"success": False, "error": {"code": 303, "info": "no bulk"}})
+            return httpx.Response(200, json=[{**APIIP_API_COM_PAYLOAD, "ip": ip} for ip in ips if ip not in skip])
+
+        resolver = APIIPApiCOM("key", client=mock_clients(handler)[0])
+        results = resolver.resolve_many(["1.1.1.1", "1.1.1.2", "1.1.1.3"])
+        assert results[0].ip == "1.1.1.1" and results[2].ip == "1.1.1.3"
+        assert type(results[1]) is ApiException  # Not final, it is resolved again
+        # An error of the whole request isn't blamed on its IP addresses
+        with pytest.raises(ApiException) as error:
+            resolver.resolve_many(["2.2.2.2", "3.3.3.3"])
+        assert not isinstance(error.value, InvalidInputError)
+
+
+class TestResolveStream:
+    def setup_method(self):
+        import asyncio
+        import httpx
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        async def handler(request: httpx.Request):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            ip = request.url.path.rsplit("/", 1)[1]
+            # Later IPs answer faster, so unordered results come back shuffled
+            await asyncio.sleep(0.01 * (10 - int(ip.rsplit(".", 1)[1]) % 10))
+            self.in_flight -= 1
+            return httpx.Response(200, json={**IP_API_COM_PAYLOAD, "query": ip})
+
+        self.async_client = mock_clients(handler)[1]
+
+    def collect(self, resolver, ips, **kwargs):
+        import asyncio
+
+        async def run():
+            return [item async for item in resolver.resolve_stream(ips, **kwargs)]
+
+        return asyncio.run(run())
+
+    def test_bounded_concurrency(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        ips = [f"1.1.1.{i}" for i in range(20)]
+        results = self.collect(IPAPICom(async_client=self.async_client), ips, concurrency=4)
+        assert self.max_in_flight == 4
+        assert sorted(ip for ip, _ in results) == sorted(ips)
+        assert all(response.query == ip for ip, response in results)
+
+    def test_ordered_async_iterable(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        ips = [f"1.1.1.{i}" for i in range(10)]
+
+        async def source():
+            for ip in ips:
+                yield ip
+
+        results = self.collect(IPAPICom(async_client=self.async_client), source(), concurrency=5, ordered=True)
+        assert [ip for ip, _ in results] == ips
+
+    def test_waits_for_rate_limit(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.limiter import RateLimiter
+        resolver = IPAPICom(async_client=self.async_client)
+        resolver.limiter = RateLimiter(2, 0.05)
+        results = self.collect(resolver, [f"1.1.1.{i}" for i in range(5)], concurrency=1)
+        assert not any(isinstance(response, Exception) for _, response in results)
+
+
+class TestThreadSafety:
+    def test_shared_resolver_does_not_overspend(self):
+        import threading
+        import httpx
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.errors import RateLimitError
+        from cool_ip_api.utils.limiter import RateLimiter
+        sent = []
+        barrier = threading.Barrier(20)
+
+        def handler(request: httpx.Request):
+            sent.append(request.url)
+            return httpx.Response(200, json={})
+
+        resolver = IPApiCO(client=mock_clients(handler)[0], rate_limit_timeout=0)
+        resolver.limiter = RateLimiter(5, 60)
+        errors = []
+
+        def lookup():
+            barrier.wait()
+            try:
+                resolver.resolve("1.1.1.1")
+            except RateLimitError as e:
+                errors.append(e)
+            except Exception:
+                pass
+
+        threads = [threading.Thread(target=lookup) for _ in range(20)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert len(sent) == 5
+        assert len(errors) == 15
+        assert resolver.requests_left == 0
+
+    def test_resolve_many(self):
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+
+        def handler(request: httpx.Request):
+            return httpx.Response(200, json={**IP_API_COM_PAYLOAD, "query": request.url.path.rsplit("/", 1)[1]})
+
+        ips = [f"1.1.1.{i}" for i in range(30)]
+        resolver = IPAPICom(client=mock_clients(handler)[0])
+        results = resolver.resolve_many(ips, max_workers=8)
+        assert [result.query for result in results] == ips
+        assert resolver.requests_left == resolver._request_limit_amount - 30
+
+
+class TestCache:
+    def setup_method(self):
+        import httpx
+        self.requests = []
+
+        def handler(request: httpx.Request):
+            ip = request.url.path.rsplit("/", 1)[1]
+            self.requests.append(ip)
+            if ip.startswith("10."):
+                return httpx.Response(200, json={"status": "fail", "message": "private range", "query": ip})
+            return httpx.Response(200, json={**IP_API_COM_PAYLOAD, "query": ip})
+
+        self.clients = mock_clients(handler)
+
+    def test_hits_and_parameters(self):
+        import asyncio
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.cache import LRUCache
+        cache = LRUCache()
+        resolver = IPAPICom(client=self.clients[0], async_client=self.clients[1], cache=cache)
+        first = resolver.resolve("2001:DB8:0::1")
+        assert resolver.resolve("2001:db8::1") is first
+        assert asyncio.run(resolver.async_resolve("2001:db8::1")) is first
+        resolver.resolve("2001:db8::1", localization="de")
+        assert len(self.requests) == 2
+        assert cache.stats.hits == 2
+        assert cache.stats.misses == 2
+
+    def test_negative_ttl_and_eviction(self):
+        import time
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.cache import LRUCache
+        cache = LRUCache(maxsize=2, negative_ttl=0.05)
+        resolver = IPAPICom(client=self.clients[0], cache=cache)
+        assert resolver.resolve("10.0.0.1").status == "fail"
+        assert resolver.resolve("10.0.0.1").status == "fail"
+        assert len(self.requests) == 1
+        time.sleep(0.06)
+        resolver.resolve("10.0.0.1")
+        assert len(self.requests) == 2
+        resolver.resolve("1.1.1.1")
+        resolver.resolve("1.1.1.2")
+        assert cache.stats.evictions == 1
+        assert len(cache) == 2
+
+    def test_invalid_input_is_cached(self):
+        import httpx
+        import pytest
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.cache import LRUCache
+        from cool_ip_api.utils.errors import InvalidInputError
+        calls = []
+
+        def handler(request: httpx.Request):
+            calls.append(request)
+            return httpx.Response(400)
+
+        resolver = IPApiCO(client=mock_clients(handler)[0], cache=LRUCache())
+        for _ in range(2):
+            with pytest.raises(InvalidInputError):
+                resolver.resolve("not an ip")
+        assert len(calls) == 1
+
+
+class TestSQLiteCache:
+    def setup_method(self):
+        import httpx
+        self.requests = []
+
+        def handler(request: httpx.Request):
+            ips = request.url.path.rsplit("/", 1)[1]
+            self.requests.append(ips)
+            results = [{**APIIP_API_COM_PAYLOAD, "ip": ip} for ip in ips.split(",")]
+            return httpx.Response(200, json=results if len(results) > 1 else results[0])
+
+        self.handler = handler
+
+    def test_survives_restart(self, tmp_path):
+        from cool_ip_api.provider.ipapi_com import APIIPApiCOM
+        from cool_ip_api.utils.cache import SQLiteCache
+        path = str(tmp_path / "cache.sqlite")
+        resolver = APIIPApiCOM("key", client=mock_clients(self.handler)[0], cache=SQLiteCache(path))
+        first = resolver.resolve("1.1.1.1")
+        resolver.cache.close()
+
+        resolver = APIIPApiCOM("key", client=mock_clients(self.handler)[0], cache=SQLiteCache(path))
+        assert resolver.resolve("1.1.1.1") == first
+        assert len(self.requests) == 1
+
+    def test_bulk(self, tmp_path):
+        from cool_ip_api.provider.ipapi_com import APIIPApiCOM
+        from cool_ip_api.utils.cache import SQLiteCache
+        cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+        resolver = APIIPApiCOM("key", client=mock_clients(self.handler)[0], cache=cache)
+        resolver.resolve_many(["1.1.1.1", "1.1.1.2"])
+        results = resolver.resolve_many(["1.1.1.2", "1.1.1.3", "1.1.1.1"])
+        assert [result.ip for result in results] == ["1.1.1.2", "1.1.1.3", "1.1.1.1"]
+        # Only 1.1.1.3 was looked up again, in one bulk request
+        assert self.requests == ["1.1.1.1,1.1.1.2", "1.1.1.3"]
+        assert len(cache) == 3
+
+    def test_expire_cli(self, tmp_path, capsys):
+        from cool_ip_api.main import cache_cli
+        from cool_ip_api.utils.cache import SQLiteCache
+        from cool_ip_api.utils.errors import InvalidInputError
+        path = str(tmp_path / "cache.sqlite")
+        cache = SQLiteCache(path)
+        cache.put(("IPAPICom", "1.1.1.1", ()), InvalidInputError("gone"), ttl=-1)
+        cache.put(("IPAPICom", "1.1.1.2", ()), InvalidInputError("kept"))
+        assert cache.get(("IPAPICom", "1.1.1.1", ())) is None
+        cache_cli(["compact", path])
+        assert "Deleted 1 expired entries, 1 entries left" in capsys.readouterr().out
+
+
+def _shared_memory_cache_writer(name: str):
+    from cool_ip_api.provider.ip_api_com import IPAPIComResponse
+    from cool_ip_api.utils.cache import SharedMemoryCache
+    cache = SharedMemoryCache(name)
+    cache.put(("IPAPICom", "1.1.1.1", (("localization", "en"),)), IPAPIComResponse(**IP_API_COM_PAYLOAD))
+    cache.close()
+
+
+class TestSharedMemoryCache:
+    def setup_method(self):
+        import uuid
+        self.name = f"cool_ip_api_test_{uuid.uuid4().hex[:8]}"
+
+    def test_shared_between_processes(self):
+        import multiprocessing
+        from cool_ip_api.utils.cache import SharedMemoryCache
+        cache = SharedMemoryCache(self.name, size=64 * 1024)
+        try:
+            process = multiprocessing.get_context("spawn").Process(target=_shared_memory_cache_writer,
+                                                                   args=(self.name,))
+            process.start()
+            process.join()
+            response = cache.get(("IPAPICom", "1.1.1.1", (("localization", "en"),)))
+            assert response.query == "1.1.1.1"
+            assert response.as_ == "AS13335 Cloudflare, Inc."
+            assert cache.get(("IPAPICom", "1.1.1.1", (("localization", "de"),))) is None
+        finally:
+            cache.close()
+            cache.unlink()
+
+    def test_memory_cap(self):
+        from cool_ip_api.provider.ip_api_com import IPAPIComResponse
+        from cool_ip_api.utils.cache import SharedMemoryCache
+        cache = SharedMemoryCache(self.name, size=16 * 1024, slot_size=1024)
+        try:
+            for i in range(100):
+                cache.put(("IPAPICom", f"1.1.1.{i}", ()), IPAPIComResponse(**{**IP_API_COM_PAYLOAD, "query": str(i)}))
+            assert len(cache) == cache.slot_count == 15
+            assert cache.stats.evictions == 85
+            assert cache.get(("IPAPICom", "1.1.1.99", ())).query == "99"
+            # Keys that aren't IP addresses can't be stored
+            cache.put(("IPAPICom", "example.com", ()), IPAPIComResponse(**IP_API_COM_PAYLOAD))
+            assert cache.get(("IPAPICom", "example.com", ())) is None
+        finally:
+            cache.close()
+            cache.unlink()
+
+    def test_unlink_leaves_resource_tracker_quiet(self):
+        import subprocess
+        import sys
+        script = ("from cool_ip_api.utils.cache import SharedMemoryCache\n"
+                  f"cache = SharedMemoryCache({self.name!r}, size=16 * 1024)\n"
+                  f"other = SharedMemoryCache({self.name!r})\n"
+                  "other.close()\n"
+                  "cache.close()\n"
+                  "cache.unlink()\n")
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=30)
+        assert result.returncode == 0
+        assert result.stderr == ""
+
+
+IP_API_CO_PAYLOAD = {
+    "ip": "1.1.1.1", "network": "1.1.1.0/24", "version": "IPv4", "city": "Sydney", "region": "New South Wales",
+    "region_code": "NSW", "country": "AU", "country_name": "Australia", "country_code": "AU",
+    "country_code_iso3": "AUS", "country_capital": "Canberra", "country_tld": ".au", "continent_code": "OC",
+    "in_eu": False, "postal": "2000", "latitude": -33.8688, "longitude": 151.209, "timezone": "Australia/Sydney",
+    "utc_offset": "+1100", "country_calling_code": "+61", "currency": "AUD", "currency_name": "Dollar",
+    "languages": "en-AU", "country_area": 7686850.0, "country_population": 24992369, "asn": "AS13335",
+    "org": "CLOUDFLARENET",
+}
+
+
+class TestPrefixCache:
+    def setup_method(self):
+        import httpx
+        self.requests = []
+
+        def handler(request: httpx.Request):
+            self.requests.append(request.url.path)
+            if request.url.host == "ipapi.co":
+                return httpx.Response(200, json={**IP_API_CO_PAYLOAD, "network": "1.1.0.0/16"})
+            return httpx.Response(200, json=IP_API_COM_PAYLOAD)
+
+        self.client = mock_clients(handler)[0]
+
+    def test_returned_network(self):
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.cache import PrefixCache
+        resolver = IPApiCO(client=self.client, cache=PrefixCache())
+        resolver.resolve("1.1.1.1")
+        assert resolver.resolve("1.1.200.3").network == "1.1.0.0/16"
+        assert len(self.requests) == 1
+        resolver.resolve("1.2.0.1")
+        assert len(self.requests) == 2
+
+    def test_prefix_length_and_longest_match(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom, IPAPIComResponse
+        from cool_ip_api.utils.cache import PrefixCache
+        from cool_ip_api.utils.errors import InvalidInputError
+        cache = PrefixCache(ipv4_prefix=24, ipv6_prefix=64, maxsize=3)
+        resolver = IPAPICom(client=self.client, cache=cache)
+        resolver.resolve("203.0.113.7")
+        resolver.resolve("203.0.113.8")
+        resolver.resolve("2001:db8::1")
+        resolver.resolve("2001:db8::ffff")
+        assert len(self.requests) == 2
+        # Failed lookups are cached for the IP address, the more specific network wins over the cached /24
+        key = ("IPAPICom", "203.0.113.9", (("localization", "en"),))
+        cache.put(key, InvalidInputError("invalid"))
+        assert isinstance(cache.get(key), InvalidInputError)
+        assert cache.get(("IPAPICom", "203.0.113.10", (("localization", "en"),))).status == "success"
+        # The least recently used network (the IPv6 one) is evicted
+        cache.put(("IPAPICom", "198.51.100.1", (("localization", "en"),)), IPAPIComResponse(status="success"))
+        assert cache.stats.evictions == 1
+        assert cache.get(("IPAPICom", "2001:db8::2", (("localization", "en"),))) is None
+
+
+class TestStaleWhileRevalidate:
+    def setup_method(self):
+        import httpx
+        self.requests = []
+
+        def handler(request: httpx.Request):
+            self.requests.append(request.url.path)
+            return httpx.Response(200, json={**IP_API_COM_PAYLOAD, "city": str(len(self.requests))})
+
+        self.async_client = mock_clients(handler)[1]
+
+    def resolver(self, **kwargs):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.cache import LRUCache
+        return IPAPICom(async_client=self.async_client, cache=LRUCache(ttl=0.05, stale_ttl=60),
+                        stale_while_revalidate=True, **kwargs)
+
+    def test_hot_key_served_stale_and_refreshed(self):
+        import asyncio
+        resolver = self.resolver(hot_key_hits=2)
+
+        async def run():
+            assert (await resolver.async_resolve("1.1.1.1")).city == "1"
+            await asyncio.sleep(0.06)
+            assert (await resolver.async_resolve("1.1.1.1")).city == "1"
+            await asyncio.sleep(0.01)
+            assert (await resolver.async_resolve("1.1.1.1")).city == "2"
+
+        asyncio.run(run())
+        assert len(self.requests) == 2
+
+    def test_cold_key_blocks(self):
+        import asyncio
+        resolver = self.resolver(hot_key_hits=3)
+
+        async def run():
+            await resolver.async_resolve("1.1.1.1")
+            await asyncio.sleep(0.06)
+            assert (await resolver.async_resolve("1.1.1.1")).city == "2"
+
+        asyncio.run(run())
+
+    def test_refresh_respects_budget(self):
+        import asyncio
+        resolver = self.resolver(hot_key_hits=1, refresh_reserve=0.5)
+
+        async def run():
+            await resolver.async_resolve("1.1.1.1")
+            resolver.limiter.acquire(resolver.limiter.remaining - 10)
+            await asyncio.sleep(0.06)
+            assert (await resolver.async_resolve("1.1.1.1")).city == "1"
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        assert len(self.requests) == 1
+
+
+class TestSingleFlight:
+    def test_async_callers_share_request(self):
+        import asyncio
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        requests = []
+
+        async def handler(request: httpx.Request):
+            requests.append(request)
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json=IP_API_COM_PAYLOAD)
+
+        resolver = IPAPICom(async_client=mock_clients(handler)[1], single_flight=True)
+
+        async def run():
+            return await asyncio.gather(*[resolver.async_resolve("1.1.1.1") for _ in range(10)],
+                                        resolver.async_resolve("1.1.1.1", localization="de"))
+
+        responses = asyncio.run(run())
+        assert len(requests) == 2
+        assert all(response is responses[0] for response in responses[:10])
+        assert len(resolver.single_flight) == 0
+
+    def test_threads_and_async_share_request_and_exception(self):
+        import asyncio
+        import threading
+        import time
+        import httpx
+        import pytest
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.errors import InvalidInputError
+        requests = []
+
+        def handler(request: httpx.Request):
+            requests.append(request)
+            time.sleep(0.1)
+            return httpx.Response(400)
+
+        resolver = IPApiCO(client=mock_clients(handler)[0], single_flight=True)
+        errors = []
+
+        def lookup():
+            try:
+                resolver.resolve("1.1.1.1")
+            except InvalidInputError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=lookup) for _ in range(5)]
+        [thread.start() for thread in threads]
+        time.sleep(0.02)
+        with pytest.raises(InvalidInputError):
+            asyncio.run(resolver.async_resolve("1.1.1.1"))
+        [thread.join() for thread in threads]
+        assert len(requests) == 1
+        assert len(errors) == 5
+
+    def test_cancelled_follower_leaves_leader_alone(self):
+        import asyncio
+        from cool_ip_api.utils.singleflight import SingleFlight
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def run():
+            leader = asyncio.create_task(flight.async_do("key", call))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(flight.async_do("key", call))
+            other = asyncio.create_task(flight.async_do("key", call))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            return await leader, await other, await asyncio.gather(follower, return_exceptions=True)
+
+        leader, other, (follower,) = asyncio.run(run())
+        assert leader == other == "result"
+        assert isinstance(follower, asyncio.CancelledError)
+        assert len(calls) == 1
+        assert len(flight) == 0
+
+    def test_cancelled_leader_hands_off(self):
+        import asyncio
+        from cool_ip_api.utils.singleflight import SingleFlight
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        async def run():
+            leader = asyncio.create_task(flight.async_do("key", call))
+            await asyncio.sleep(0)
+            followers = [asyncio.create_task(flight.async_do("key", call)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.gather(leader, return_exceptions=True), await asyncio.gather(*followers)
+
+        (leader,), followers = asyncio.run(run())
+        assert isinstance(leader, asyncio.CancelledError)
+        # One of the followers took over the call, the others share its result
+        assert followers == [2, 2, 2]
+        assert len(calls) == 2
+        assert len(flight) == 0
+
+
+class TestRateLimiter:
+    def test_sliding_window(self):
+        import time
+        from cool_ip_api.utils.limiter import RateLimiter
+        limiter = RateLimiter(3, 0.1)
+        assert all(limiter.try_acquire() for _ in range(3))
+        assert not limiter.try_acquire()
+        assert limiter.remaining == 0
+        assert 0 < limiter.wait_time() <= 0.1
+        time.sleep(0.11)
+        assert limiter.remaining == 3
+
+    def test_acquire_waits(self):
+        import time
+        from cool_ip_api.utils.limiter import RateLimiter
+        limiter = RateLimiter(2, 0.1)
+        start = time.monotonic()
+        for _ in range(4):
+            assert limiter.acquire()
+        assert time.monotonic() - start >= 0.1
+        assert not limiter.acquire(timeout=0.01)
+
+    def test_async_acquire_waits_in_order(self):
+        import asyncio
+        import time
+        from cool_ip_api.utils.limiter import RateLimiter
+        limiter = RateLimiter(1, 0.05)
+        done = []
+
+        async def acquire(i):
+            await limiter.async_acquire()
+            done.append((i, time.monotonic()))
+
+        start = time.monotonic()
+        async def run():
+            await asyncio.gather(*(acquire(i) for i in range(3)))
+
+        asyncio.run(run())
+        assert [i for i, _ in done] == [0, 1, 2]
+        assert done[-1][1] - start >= 0.1
+
+    def test_block(self):
+        from cool_ip_api.utils.limiter import RateLimiter
+        limiter = RateLimiter(10, 60)
+        limiter.block(30)
+        assert limiter.remaining == 0
+        assert 29 < limiter.wait_time() <= 30
+        assert not limiter.acquire(timeout=0)
+
+    def test_resolver_waits_instead_of_raising(self):
+        import time
+        import httpx
+        from cool_ip_api.provider.abstractapi_com import AbstractApiCom
+        sent = []
+
+        def handler(request: httpx.Request):
+            sent.append(time.monotonic())
+            return httpx.Response(200, json={})
+
+        resolver = AbstractApiCom("key", client=mock_clients(handler)[0])
+        for _ in range(2):
+            try:
+                resolver.resolve("1.1.1.1")
+            except Exception:
+                pass
+        assert len(sent) == 2
+        assert sent[1] - sent[0] >= 0.95  # Slots are taken before the request is sent
+
+
+class TestRateLimitHeaders:
+    def test_ip_api_com_headers(self):
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        headers = {"X-Rl": "0", "X-Ttl": "5"}
+
+        def handler(request: httpx.Request):
+            return httpx.Response(200, json=IP_API_COM_PAYLOAD, headers=headers)
+
+        resolver = IPAPICom(client=mock_clients(handler)[0])
+        resolver.resolve("1.1.1.1")
+        assert resolver.requests_left == 0
+        assert 4 < resolver.limiter.wait_time() <= 5
+        headers["X-Rl"] = "40"
+        resolver.limiter.sync(45, 60)  # The window reset
+        resolver.resolve("1.1.1.2")
+        assert resolver.requests_left == 40
+
+    def test_sync_keeps_in_flight_and_ignores_stale_state(self):
+        from cool_ip_api.utils.limiter import RateLimiter
+        limiter = RateLimiter(45, 60)
+        for _ in range(10):
+            limiter.try_acquire()
+        limiter.sync(44, 30)  # Only one of the requests was counted by the API yet
+        assert limiter.remaining == 35
+        limiter.sync(30, 30)
+        limiter.sync(34, 30)  # Out of order
+        assert limiter.remaining == 30
+        for _ in range(3):
+            limiter.try_acquire()
+        limiter.sync(44, 60)  # The window reset, the requests acquired since the last sync are in flight
+        assert limiter.remaining == 42
+
+    def test_concurrent_responses_out_of_order(self):
+        import threading
+        import time
+        import httpx
+        from concurrent.futures import ThreadPoolExecutor
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        lock = threading.Lock()
+        received = []
+
+        def handler(request: httpx.Request):
+            with lock:
+                received.append(request)
+                remaining = 45 - len(received)
+            # The response of the first request arrives last
+            time.sleep(remaining * 0.01 - 0.34)
+            return httpx.Response(200, json=IP_API_COM_PAYLOAD, headers={"X-Rl": str(remaining), "X-Ttl": "60"})
+
+        resolver = IPAPICom(client=mock_clients(handler)[0])
+        with ThreadPoolExecutor(10) as executor:
+            list(executor.map(resolver.resolve, [f"1.1.1.{i}" for i in range(10)]))
+        assert resolver.requests_left == 35
+
+    def test_retry_after(self):
+        import httpx
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.errors import RateLimitError
+        from cool_ip_api.utils.retry import RetryPolicy
+
+        def handler(request: httpx.Request):
+            return httpx.Response(429, headers={"Retry-After": "3"})
+
+        resolver = IPApiCO(client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=1))
+        try:
+            resolver.resolve("1.1.1.1")
+        except RateLimitError:
+            pass
+        assert 2 < resolver.limiter.wait_time() <= 3
+
+    def test_parse_headers(self):
+        import time
+        from email.utils import formatdate
+        from cool_ip_api.utils.limiter import rate_limit_headers, retry_after
+        assert retry_after({"retry-after": "7"}) == 7
+        assert 8 < retry_after({"retry-after": formatdate(time.time() + 10, usegmt=True)}) <= 10
+        assert retry_after({}) is None
+        assert rate_limit_headers({"ratelimit-remaining": "3", "ratelimit-reset": "20"}) == (3, 20)
+        remaining, reset = rate_limit_headers({"x-ratelimit-remaining": "1", "x-ratelimit-reset": str(time.time() + 30)})
+        assert remaining == 1 and 29 < reset <= 30
+
+
+class TestQuotaLedger:
+    def setup_method(self):
+        import os
+        import tempfile
+        self.path = os.path.join(tempfile.mkdtemp(), "ledger.sqlite")
+
+    def test_debit(self):
+        from cool_ip_api.utils.ledger import QuotaLedger
+        ledger = QuotaLedger(self.path)
+        assert ledger.debit("scope", 2, 3, 60)
+        assert not ledger.debit("scope", 2, 3, 60)
+        assert ledger.debit("scope", 1, 3, 60)
+        assert not ledger.debit("scope", 1, 3, 60)
+        assert ledger.debit("other", 1, 3, 60)
+        # Persists across instances (restarts)
+        assert QuotaLedger(self.path).used("scope", 60) == 3
+        assert [used for _, used in ledger.history("scope", 60)] == [3]
+
+    def test_concurrent_ledgers_do_not_overspend(self):
+        import threading
+        from cool_ip_api.utils.ledger import QuotaLedger
+        debited = []
+
+        def worker():
+            ledger = QuotaLedger(self.path)  # Own connection, like another process
+            for _ in range(20):
+                if ledger.debit("scope", 1, 50, 3600):
+                    debited.append(1)
+
+        QuotaLedger(self.path)
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert len(debited) == 50
+
+    def test_sync_and_exhaust(self):
+        from cool_ip_api.utils.ledger import QuotaLedger
+        ledger = QuotaLedger(self.path)
+        ledger.sync("scope", 5, 60)
+        ledger.sync("scope", 2, 60)
+        assert ledger.used("scope", 60) == 5
+        ledger.exhaust("scope", 10, 60)
+        assert ledger.used("scope", 60) == 10
+        assert not ledger.debit("scope", 1, 10, 60)
+        assert 0 < ledger.reset_in(60) <= 60
+
+    def test_resolvers_share_quota(self):
+        import httpx
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.errors import RateLimitError
+        from cool_ip_api.utils.ledger import QuotaLedger
+        sent = []
+
+        def handler(request: httpx.Request):
+            sent.append(request)
+            return httpx.Response(200, json={})
+
+        resolvers = [IPApiCO(client=mock_clients(handler)[0], ledger=QuotaLedger(self.path), rate_limit_timeout=0)
+                     for _ in range(3)]
+        resolvers[0].ledger.sync(resolvers[0]._quota_scope(), 995, resolvers[0].limiter.period)
+        errors = 0
+        for resolver in resolvers:
+            for _ in range(3):
+                try:
+                    resolver.resolve("1.1.1.1")
+                except RateLimitError:
+                    errors += 1
+                except Exception:
+                    pass
+        assert len(sent) == 5
+        assert errors == 4
+
+
+class TestRetry:
+    def flaky_handler(self, failures: list):
+        import httpx
+
+        def handler(request: httpx.Request):
+            self.sent.append(request)
+            if failures:
+                failure = failures.pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                return httpx.Response(failure, headers={"Retry-After": "0"} if failure == 429 else {})
+            return httpx.Response(200, json=IP_API_CO_PAYLOAD)
+        return handler
+
+    def setup_method(self):
+        self.sent = []
+
+    def test_retries_transport_errors_and_5xx(self):
+        import httpx
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.retry import RetryPolicy
+        handler = self.flaky_handler([httpx.ConnectError("blip"), 503, 429])
+        resolver = IPApiCO(client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=4, backoff=0.01))
+        assert resolver.resolve("1.1.1.1").ip == IP_API_CO_PAYLOAD["ip"]
+        assert len(self.sent) == 4
+        # Every attempt is charged against the rate limit
+        assert resolver.requests_left == resolver._request_limit_amount - 4
+
+    def test_gives_up(self):
+        import httpx
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.errors import ApiException
+        from cool_ip_api.utils.retry import RetryPolicy
+        handler = self.flaky_handler([httpx.ConnectError("blip")] * 2 + [500] * 2)
+        resolver = IPApiCO(client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=2, backoff=0.01))
+        try:
+            resolver.resolve("1.1.1.1")
+            assert False
+        except httpx.ConnectError:
+            pass
+        try:
+            resolver.resolve("1.1.1.2")
+            assert False
+        except ApiException:
+            pass
+        assert len(self.sent) == 4
+
+    def test_async(self):
+        import asyncio
+        import httpx
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.retry import RetryPolicy
+        handler = self.flaky_handler([httpx.ReadTimeout("timeout"), 502])
+        resolver = IPApiCO(async_client=mock_clients(handler)[1], retry=RetryPolicy(backoff=0.01))
+        assert asyncio.run(resolver.async_resolve("1.1.1.1")).ip == IP_API_CO_PAYLOAD["ip"]
+        assert len(self.sent) == 3
+
+    def test_delay(self):
+        import httpx
+        from cool_ip_api.utils.retry import RetryPolicy
+        policy = RetryPolicy(max_attempts=5, backoff=1, max_backoff=3, max_retry_after=10)
+        assert all(0 <= policy.delay(attempt) <= min(3, 2 ** (attempt - 1)) for attempt in range(1, 5))
+        assert policy.delay(5) is None
+        assert policy.delay(1, exception=ValueError()) is None
+        assert policy.delay(1, response=httpx.Response(404)) is None
+        assert policy.delay(1, response=httpx.Response(429, headers={"Retry-After": "7"})) == 7
+        assert policy.delay(1, response=httpx.Response(429, headers={"Retry-After": "70"})) is None
+
+
+class TestCircuitBreaker:
+    def test_opens_and_recovers(self):
+        import time
+        from cool_ip_api.utils.circuit import CircuitBreaker, CircuitState
+        from cool_ip_api.utils.errors import CircuitOpenError
+        breaker = CircuitBreaker(min_calls=4, error_threshold=0.5, open_seconds=0.05)
+        for failed in [False, True, False, True]:
+            breaker.check()
+            breaker.record(failed, 0.01)
+        assert breaker.state == CircuitState.OPEN
+        assert not breaker.health().usable
+        try:
+            breaker.check()
+            assert False
+        except CircuitOpenError:
+            pass
+        time.sleep(0.06)
+        assert breaker.state == CircuitState.HALF_OPEN
+        breaker.check()
+        try:
+            breaker.check()  # Only one trial call
+            assert False
+        except CircuitOpenError:
+            pass
+        breaker.record(False, 0.01)
+        assert breaker.state == CircuitState.CLOSED
+
+    def test_half_open_failure_reopens(self):
+        import time
+        from cool_ip_api.utils.circuit import CircuitBreaker, CircuitState
+        breaker = CircuitBreaker(min_calls=1, open_seconds=0.01)
+        breaker.record(True, 0.01)
+        time.sleep(0.02)
+        breaker.check()
+        breaker.record(True, 0.01)
+        assert breaker.state == CircuitState.OPEN
+
+    def test_slow_calls(self):
+        from cool_ip_api.utils.circuit import CircuitBreaker, CircuitState
+        breaker = CircuitBreaker(min_calls=2, slow_call_seconds=1)
+        breaker.record(False, 2)
+        breaker.record(False, 3)
+        health = breaker.health()
+        assert health.state == CircuitState.OPEN
+        assert health.error_rate == 1 and health.latency == 2.5
+
+    def test_resolver_fails_fast(self):
+        import httpx
+        from cool_ip_api.provider.ip_who_is_io import IPWhoIsIo
+        from cool_ip_api.utils.circuit import CircuitBreaker, CircuitState
+        from cool_ip_api.utils.errors import CircuitOpenError
+        from cool_ip_api.utils.retry import RetryPolicy
+        sent = []
+
+        def handler(request: httpx.Request):
+            sent.append(request)
+            return httpx.Response(503)
+
+        resolver = IPWhoIsIo(client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=1),
+                             circuit_breaker=CircuitBreaker(min_calls=3))
+        errors = []
+        for i in range(5):
+            try:
+                resolver.resolve(f"1.1.1.{i}")
+            except Exception as e:
+                errors.append(type(e))
+        assert len(sent) == 3
+        assert errors[3:] == [CircuitOpenError, CircuitOpenError]
+        assert resolver.health().state == CircuitState.OPEN
+        # No rate limit is spent on requests stopped by the breaker
+        assert resolver.requests_left == resolver._request_limit_amount - 3
+
+
+class TestRouter:
+    def providers(self, status_codes: dict):
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.retry import RetryPolicy
+        self.sent = []
+
+        def handler(payload, name):
+            def handle(request: httpx.Request):
+                self.sent.append(name)
+                status_code = status_codes.get(name, 200)
+                return httpx.Response(status_code, json=payload if status_code == 200 else {})
+            return handle
+
+        clients = {name: mock_clients(handler(payload, name))
+                   for name, payload in [("IPAPICom", IP_API_COM_PAYLOAD), ("IPApiCO", IP_API_CO_PAYLOAD)]}
+        kwargs = dict(retry=RetryPolicy(max_attempts=1), rate_limit_timeout=0)
+        return [IPAPICom(*clients["IPAPICom"], **kwargs), IPApiCO(*clients["IPApiCO"], **kwargs)]
+
+    def test_fails_over(self):
+        from cool_ip_api.provider.router import Router
+        router = Router(self.providers({"IPApiCO": 429}))
+        router.providers["IPAPICom"].limiter.sync(20)  # IPApiCO is preferred by headroom
+        response = router.resolve("1.1.1.1")
+        assert self.sent == ["IPApiCO", "IPAPICom"]
+        assert response.provider == "IPAPICom"
+        assert response.response.query == IP_API_COM_PAYLOAD["query"]
+
+    def test_invalid_input_is_not_failed_over(self):
+        from cool_ip_api.provider.router import Router
+        from cool_ip_api.utils.errors import InvalidInputError
+        router = Router(self.providers({"IPApiCO": 400}))
+        router.providers["IPAPICom"].limiter.sync(0)
+        try:
+            router.resolve("1.1.1.1")
+            assert False
+        except InvalidInputError:
+            pass
+        assert self.sent == ["IPApiCO"]
+
+    def test_spreads_load_by_quota(self):
+        from cool_ip_api.provider.router import Router
+        from cool_ip_api.utils.limiter import RateLimiter
+        providers = self.providers({})
+        for provider in providers:
+            provider.limiter = RateLimiter(3, 60)
+        router = Router(providers)
+        for i in range(6):
+            router.resolve(f"1.1.1.{i}")
+        assert sorted(self.sent) == ["IPAPICom"] * 3 + ["IPApiCO"] * 3
+
+    def test_prefers_fast_providers(self):
+        import asyncio
+        from cool_ip_api.provider.router import Router
+        router = Router(self.providers({}))
+        router.latency = {"IPAPICom": 2, "IPApiCO": 0.1}
+        router.providers["IPAPICom"].limiter.sync(45)
+        router.providers["IPApiCO"].limiter.sync(1000)
+        response = asyncio.run(router.async_resolve("1.1.1.1"))
+        assert response.provider == "IPApiCO"
+        assert router.latency["IPApiCO"] < 0.1
+
+    def test_skips_open_circuit(self):
+        from cool_ip_api.provider.router import Router
+        from cool_ip_api.utils.circuit import CircuitState
+        router = Router(self.providers({"IPApiCO": 503}))
+        for _ in range(10):
+            router.providers["IPApiCO"].circuit_breaker.record(True, 0.1)
+        assert router.provider_health()["IPApiCO"].state == CircuitState.OPEN
+        assert router.resolve("1.1.1.1").provider == "IPAPICom"
+        assert self.sent == ["IPAPICom"]
+
+    def test_no_response_is_failed_over(self):
+        import asyncio
+        from cool_ip_api.provider.router import Router
+        router = Router(self.providers({}))
+        router.providers["IPAPICom"].limiter.sync(20)  # IPApiCO is preferred by headroom
+
+        async def no_response(*args, **kwargs):
+            return None
+
+        router.providers["IPApiCO"].resolve = lambda *args, **kwargs: None
+        router.providers["IPApiCO"].async_resolve = no_response
+        assert router.resolve("1.1.1.1").provider == "IPAPICom"
+        assert asyncio.run(router.async_resolve("1.1.1.2")).provider == "IPAPICom"
+
+    def test_cached_response_keeps_provider_model(self):
+        import os
+        import tempfile
+        from cool_ip_api.provider.router import Router, RoutedResponse
+        from cool_ip_api.utils.cache import SQLiteCache
+        from cool_ip_api.utils.parsing import LazyResponse
+        from cool_ip_api.utils.serialization import dumps, loads
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SQLiteCache(os.path.join(directory, "cache.sqlite"))
+            router = Router(self.providers({"IPApiCO": 429}), cache=cache)
+            assert router.resolve("1.1.1.1").provider == "IPAPICom"
+            response = Router(self.providers({}), cache=cache).resolve("1.1.1.1")
+            cache.close()
+        assert self.sent == []  # Read from the cache
+        assert response.provider == "IPAPICom"
+        assert response.response.query == IP_API_COM_PAYLOAD["query"]
+        assert response.geo().asn == 13335
+        providers = self.providers({})
+        providers[0].parse = "lazy"
+        lazy = Router(providers).resolve("1.1.1.1")
+        assert isinstance(lazy.response, LazyResponse)
+        assert loads(dumps(lazy)) == lazy
+        # json() stays the plain pydantic JSON
+        assert RoutedResponse.parse_raw(lazy.json()).response == IP_API_COM_PAYLOAD
+
+
+class TestHedging:
+    def router(self, delays: dict, **kwargs):
+        import asyncio
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.provider.router import Router
+        self.started = []
+        self.finished = []
+
+        def handler(payload, name):
+            async def handle(request: httpx.Request):
+                self.started.append(name)
+                await asyncio.sleep(delays[name])
+                self.finished.append(name)
+                return httpx.Response(200, json=payload)
+            return handle
+
+        router = Router([IPAPICom(async_client=mock_clients(handler(IP_API_COM_PAYLOAD, "IPAPICom"))[1]),
+                         IPApiCO(async_client=mock_clients(handler(IP_API_CO_PAYLOAD, "IPApiCO"))[1])],
+                        hedge=True, **kwargs)
+        router.providers["IPApiCO"].limiter.sync(500)  # IPAPICom is the primary
+        for _ in range(20):
+            router._observe("IPAPICom", 0.01)
+        return router
+
+    def test_slow_primary_is_hedged(self):
+        import asyncio
+        router = self.router({"IPAPICom": 0.5, "IPApiCO": 0.01}, hedge_budget=1)
+
+        async def run():
+            response = await router.async_resolve("1.1.1.1")
+            await asyncio.sleep(0)
+            return response
+
+        response = asyncio.run(run())
+        assert response.provider == "IPApiCO"
+        assert self.started == ["IPAPICom", "IPApiCO"]
+        assert self.finished == ["IPApiCO"]  # The primary was cancelled
+        assert router.hedges == 1
+
+    def test_fast_primary_is_not_hedged(self):
+        import asyncio
+        router = self.router({"IPAPICom": 0, "IPApiCO": 0}, hedge_budget=1)
+        assert asyncio.run(router.async_resolve("1.1.1.1")).provider == "IPAPICom"
+        assert self.started == ["IPAPICom"]
+        assert router.hedges == 0
+
+    def test_budget(self):
+        import asyncio
+        router = self.router({"IPAPICom": 0.05, "IPApiCO": 0}, hedge_percentile=0)
+
+        async def run():
+            for i in range(20):
+                await router.async_resolve(f"1.1.1.{i}")
+
+        asyncio.run(run())
+        assert router.hedges == 1
+        assert self.started.count("IPApiCO") == 1
+
+
+class TestApiKeyPool:
+    def resolver(self, invalid_keys=()):
+        import json
+        import httpx
+        from cool_ip_api.provider.ipinfo_io import IPInfoIo
+        from cool_ip_api.utils.retry import RetryPolicy
+        self.keys = []
+
+        def handler(request: httpx.Request):
+            key = request.url.params["token"]
+            self.keys.append(key)
+            if key in invalid_keys:
+                return httpx.Response(403)
+            return httpx.Response(200, json=IP_INFO_IO_PAYLOAD if request.method == "GET" else
+                                  {ip: IP_INFO_IO_PAYLOAD for ip in json.loads(request.content)})
+
+        return IPInfoIo(["a", "b", "c"], client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=1),
+                        rate_limit_timeout=0)
+
+    def test_uses_key_with_most_headroom(self):
+        resolver = self.resolver()
+        resolver._limiters[("a", None)].sync(10)
+        resolver._limiters[("b", None)].sync(30)
+        resolver._limiters[("c", None)].sync(20)
+        for i in range(3):
+            resolver.resolve(f"1.1.1.{i}")
+        assert self.keys == ["b", "b", "b"]
+        assert resolver._limiters[("b", None)].remaining == 27
+        assert resolver.api_key == "b"
+
+    def test_spreads_over_keys(self):
+        from cool_ip_api.utils.limiter import RateLimiter
+        resolver = self.resolver()
+        resolver.limiter = RateLimiter(2, 60)
+        for i in range(6):
+            resolver.resolve(f"1.1.1.{i}")
+        assert sorted(self.keys) == ["a", "a", "b", "b", "c", "c"]
+
+    def test_retires_invalid_keys(self):
+        from cool_ip_api.utils.errors import AuthenticationError
+        resolver = self.resolver(invalid_keys={"a"})
+        resolver._limiters[("b", None)].sync(40000)
+        resolver._limiters[("c", None)].sync(40000)
+        try:
+            resolver.resolve_many(["1.1.1.1"])
+            assert False
+        except AuthenticationError:
+            pass
+        assert self.keys == ["a"]
+        assert resolver._limiters[("a", None)].remaining == 0
+        resolver.resolve_many(["1.1.1.2", "1.1.1.3"])
+        assert self.keys[1] in ["b", "c"]
+
+    def test_retires_invalid_keys_on_resolve(self):
+        import pytest
+        from cool_ip_api.utils.errors import AuthenticationError
+        resolver = self.resolver(invalid_keys={"a"})
+        resolver._limiters[("b", None)].sync(40000)
+        resolver._limiters[("c", None)].sync(40000)
+        with pytest.raises(AuthenticationError):
+            resolver.resolve("1.1.1.1")
+        assert resolver._limiters[("a", None)].remaining == 0
+        resolver.resolve("1.1.1.2")
+        assert self.keys[0] == "a" and self.keys[1] in ["b", "c"]
+
+    def test_rate_limited_key_is_exhausted(self):
+        import httpx
+        import pytest
+        from cool_ip_api.provider.ipinfo_io import IPInfoIo
+        from cool_ip_api.utils.errors import RateLimitError
+        from cool_ip_api.utils.retry import RetryPolicy
+        resolver = IPInfoIo("a", client=mock_clients(lambda request: httpx.Response(429))[0],
+                            retry=RetryPolicy(max_attempts=1), rate_limit_timeout=0)
+        with pytest.raises(RateLimitError):
+            resolver.resolve("1.1.1.1")
+        assert resolver.requests_left == 0
+        resolver.limiter.sync(50000, 60 * 60 * 24 * 30)
+        with pytest.raises(RateLimitError):
+            resolver.resolve_many(["1.1.1.1", "1.1.1.2"])
+        assert resolver.requests_left == 0
+
+    def test_abstractapi_com_statuses(self):
+        import httpx
+        import pytest
+        from cool_ip_api.provider.abstractapi_com import AbstractApiCom
+        from cool_ip_api.utils.errors import ApiException, AuthenticationError
+        from cool_ip_api.utils.retry import RetryPolicy
+        statuses = {"a": 401, "b": 500}
+
+        def handler(request: httpx.Request):
+            return httpx.Response(statuses[request.url.params["api_key"]])
+
+        client = mock_clients(handler)[0]
+        resolver = AbstractApiCom("a", client=client, retry=RetryPolicy(max_attempts=1))
+        with pytest.raises(AuthenticationError):
+            resolver.resolve("1.1.1.1")
+        assert resolver.quota.remaining == 0 and resolver.quota.wait_time() > 60 * 60 * 24 * 29  # Retired for the month
+        with pytest.raises(ApiException) as error:
+            AbstractApiCom("b", client=client, retry=RetryPolicy(max_attempts=1)).resolve("1.1.1.1")
+        assert not isinstance(error.value, AuthenticationError)
+
+    def test_abstractapi_com_quota(self):
+        import httpx
+        import pytest
+        from cool_ip_api.provider.abstractapi_com import AbstractApiCom
+        from cool_ip_api.utils.errors import AuthenticationError, QuotaError
+        from cool_ip_api.utils.limiter import RateLimiter
+        from cool_ip_api.utils.retry import RetryPolicy
+        keys = []
+
+        def handler(request: httpx.Request):
+            keys.append(request.url.params["api_key"])
+            if keys[-1] == "bad":
+                return httpx.Response(401)
+            return httpx.Response(200, json={"ip_address": request.url.params["ip_address"], "security": {},
+                                             "timezone": {}, "connection": {}})
+
+        resolver = AbstractApiCom(["good", "bad"], client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=1))
+        resolver.limiter = RateLimiter(10, 1)
+        # The key with the most quota left is used first
+        resolver._quotas["good"].sync(10)
+        with pytest.raises(AuthenticationError):
+            resolver.resolve("1.1.1.1")
+        # The rejected key stays retired, not just for a rate limit period
+        for index in range(5):
+            assert resolver.resolve(f"1.1.1.{index}").ip_address == f"1.1.1.{index}"
+        assert keys == ["bad"] + ["good"] * 5 and resolver._quotas["good"].remaining == 5
+        for index in range(5):
+            resolver.resolve(f"1.1.2.{index}")
+        # A used up quota fails without sending a request
+        with pytest.raises(QuotaError):
+            resolver.resolve("1.1.3.1")
+        assert len(keys) == 11
+
+    def test_keys_with_same_start(self):
+        from cool_ip_api.provider.bulk_job import BulkJob
+        from cool_ip_api.provider.ipinfo_io import IPInfoIo
+        resolver = IPInfoIo(["tokenA1", "tokenB2"], priority_reserve=0)
+        assert len(resolver.route_limiters()) == 2
+        plan = BulkJob([resolver], [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(60000)]).plan()
+        # Both keys have their monthly quota left right away
+        assert plan.eta == 0 and plan.providers[0].lookups == 60000
+
+    def test_single_key(self):
+        from cool_ip_api.provider.abstractapi_com import AbstractApiCom
+        resolver = AbstractApiCom("key")
+        assert resolver.api_keys == ["key"] and resolver.api_key == "key"
+
+
+class TestEgressPool:
+    def egress(self, name: str):
+        import httpx
+        from cool_ip_api.utils.egress import Egress
+
+        def handler(request: httpx.Request):
+            # Stands in for a forward proxy, records which path the request took
+            self.paths.append(name)
+            return httpx.Response(200, json=IP_API_COM_PAYLOAD)
+
+        return Egress(transport=httpx.MockTransport(handler), async_transport=httpx.MockTransport(handler), name=name)
+
+    def setup_method(self):
+        self.paths = []
+
+    def test_limits_per_egress(self):
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.errors import RateLimitError
+        from cool_ip_api.utils.limiter import RateLimiter
+        resolver = IPAPICom(egress=[self.egress("proxy-1"), self.egress("proxy-2"), self.egress("proxy-3")],
+                            rate_limit_timeout=0)
+        resolver.limiter = RateLimiter(2, 60)
+        for i in range(6):
+            resolver.resolve(f"1.1.1.{i}")
+        assert sorted(self.paths) == ["proxy-1"] * 2 + ["proxy-2"] * 2 + ["proxy-3"] * 2
+        try:
+            resolver.resolve("1.1.1.7")
+            assert False
+        except RateLimitError:
+            pass
+        assert {name: limiter.remaining for name, limiter in resolver.route_limiters().items()} == \
+            {"proxy-1": 0, "proxy-2": 0, "proxy-3": 0}
+
+    def test_async_balances(self):
+        import asyncio
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        resolver = IPAPICom(egress=[self.egress("a"), self.egress("b")])
+
+        async def run():
+            await asyncio.gather(*(resolver.async_resolve(f"1.1.1.{i}") for i in range(10)))
+            await resolver.aclose()
+
+        asyncio.run(run())
+        assert self.paths.count("a") == self.paths.count("b") == 5
+
+    def test_parse(self):
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        from cool_ip_api.utils.egress import Egress
+        assert Egress.parse("http://proxy:3128").proxy == "http://proxy:3128"
+        assert Egress.parse("10.0.0.2").local_address == "10.0.0.2"
+        resolver = IPApiCO(egress=["10.0.0.2", "http://proxy:3128"])
+        assert resolver._quota_scope() in ["IPApiCO@10.0.0.2", "IPApiCO@http://proxy:3128"]
+        resolver.close()
+
+
+class TestPriority:
+    def test_bulk_leaves_reserve(self):
+        from cool_ip_api.utils.limiter import RateLimiter
+        from cool_ip_api.utils.priority import Priority
+        limiter = RateLimiter(10, 60, reserve=0.2)
+        assert sum(limiter.try_acquire(priority=Priority.BULK) for _ in range(10)) == 8
+        assert sum(limiter.try_acquire(priority=Priority.INTERACTIVE) for _ in range(10)) == 2
+        stats = limiter.stats()
+        assert stats[Priority.BULK].acquired == 8 and stats[Priority.BULK].shed == 2
+        assert stats[Priority.INTERACTIVE].acquired == 2 and stats[Priority.INTERACTIVE].shed == 8
+
+    def test_interactive_jumps_ahead(self):
+        import threading
+        import time
+        from cool_ip_api.utils.limiter import RateLimiter
+        from cool_ip_api.utils.priority import Priority, priority
+        limiter = RateLimiter(2, 0.3, reserve=0.5)
+        assert limiter.acquire(2)
+        order = []
+
+        def bulk():
+            with priority("bulk"):
+                limiter.acquire()
+            order.append("bulk")
+
+        thread = threading.Thread(target=bulk)
+        thread.start()
+        time.sleep(0.05)
+        assert limiter.stats()[Priority.BULK].waiting == 1
+        # Queued after the bulk caller, but takes the slot first
+        limiter.acquire()
+        order.append("interactive")
+        thread.join()
+        assert order == ["interactive", "bulk"]
+        assert limiter.stats()[Priority.BULK].waiting == 0
+
+    def test_interactive_waiting(self):
+        import asyncio
+        import threading
+        import time
+        from cool_ip_api.utils.limiter import RateLimiter
+        from cool_ip_api.utils.priority import Priority
+        limiter = RateLimiter(1, 0.2)
+        assert limiter.acquire()
+        thread = threading.Thread(target=limiter.acquire)
+        thread.start()
+        time.sleep(0.05)
+        assert limiter.stats()[Priority.INTERACTIVE].waiting == 1
+        thread.join()
+        assert limiter.stats()[Priority.INTERACTIVE].waiting == 0
+
+        async def run():
+            task = asyncio.create_task(limiter.async_acquire())
+            await asyncio.sleep(0.05)
+            assert limiter.stats()[Priority.INTERACTIVE].waiting == 1
+            return await task
+
+        assert asyncio.run(run())
+        assert limiter.stats()[Priority.INTERACTIVE].waiting == 0
+
+    def test_bulk_shed(self):
+        import asyncio
+        from cool_ip_api.utils.limiter import RateLimiter
+        from cool_ip_api.utils.priority import Priority, priority
+        limiter = RateLimiter(1, 0.2, max_bulk_queue=1)
+        assert limiter.try_acquire()
+
+        async def run():
+            with priority(Priority.BULK):
+                return await asyncio.gather(limiter.async_acquire(), limiter.async_acquire())
+
+        assert sorted(asyncio.run(run())) == [False, True]
+        assert limiter.stats()[Priority.BULK].shed == 1
+        assert not limiter.acquire(priority=Priority.BULK, timeout=0)
+
+    def test_resolver(self):
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.errors import RateLimitError
+        from cool_ip_api.utils.limiter import RateLimiter
+        from cool_ip_api.utils.priority import Priority, priority
+        client, async_client = mock_clients(lambda request: httpx.Response(200, json=IP_API_COM_PAYLOAD))
+        resolver = IPAPICom(client=client, async_client=async_client, rate_limit_timeout=0, priority_reserve=0.5)
+        assert resolver.limiter.bulk_amount == 23
+        resolver.limiter = RateLimiter(4, 60, reserve=0.5)
+        with priority(Priority.BULK):
+            results = resolver.resolve_many([f"1.1.1.{i}" for i in range(2)])
+            assert all(not isinstance(result, Exception) for result in results)
+            try:
+                resolver.resolve("1.1.1.3")
+                assert False
+            except RateLimitError:
+                pass
+        resolver.resolve("1.1.1.4")
+        stats = resolver.priority_stats()
+        assert stats[Priority.BULK].acquired == 2 and stats[Priority.BULK].shed == 1
+        assert stats[Priority.INTERACTIVE].acquired == 1
+
+    def test_batched_resolvers(self):
+        import json
+        import httpx
+        from cool_ip_api.provider.ipapi_com import APIIPApiCOM
+        from cool_ip_api.provider.ipinfo_io import IPInfoIo
+        from cool_ip_api.utils.priority import Priority, priority
+
+        def handler(request: httpx.Request):
+            if request.method == "POST":
+                ips = json.loads(request.content)
+                return httpx.Response(200, json={ip: {**IP_INFO_IO_PAYLOAD, "ip": ip} for ip in ips})
+            ips = request.url.path.rsplit("/", 1)[1].split(",")
+            return httpx.Response(200, json=[{**APIIP_API_COM_PAYLOAD, "ip": ip} for ip in ips])
+
+        client = mock_clients(handler)[0]
+        for resolver in [IPInfoIo("token", client=client), APIIPApiCOM("key", client=client)]:
+            # The batches are sent from worker threads, they keep the priority of the caller
+            with priority(Priority.BULK):
+                results = resolver.resolve_many(["1.1.1.1", "1.1.1.2"])
+            assert all(not isinstance(result, Exception) for result in results)
+            stats = resolver.priority_stats()
+            assert stats[Priority.BULK].acquired > 0 and stats[Priority.INTERACTIVE].acquired == 0
+
+
+class TestBulkJob:
+    def test_plan(self):
+        from cool_ip_api.provider.abstractapi_com import AbstractApiCom
+        from cool_ip_api.provider.bulk_job import BulkJob
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.provider.ipapi_co import IPApiCO
+        ips = [f"10.0.{i // 256}.{i % 256}" for i in range(20000)] + ["10.0.0.0", " 10.0.0.1"]
+        job = BulkJob([IPAPICom(priority_reserve=0), IPApiCO(priority_reserve=0), AbstractApiCom("key")], ips)
+        plan = job.plan()
+        assert (plan.total, plan.unique) == (20002, 20000)
+        providers = {item.provider: item for item in plan.providers}
+        # ip-api.com resolves 15 * 100 per minute, ipapi.co 1000 right away and abstractapi.com 1 per second
+        assert providers["IPApiCO"].lookups == 1000 and providers["IPApiCO"].finish_in == 0
+        assert providers["IPAPICom"].requests == -(-providers["IPAPICom"].lookups // 100)
+        assert sum(item.lookups for item in plan.providers) == 20000
+        assert 11 * 60 <= plan.eta <= 12 * 60
+        assert "20000 unique IP addresses" in str(plan)
+
+    def test_plan_leaves_reserve(self):
+        from cool_ip_api.provider.bulk_job import BulkJob
+        from cool_ip_api.provider.ip_who_is_io import IPWhoIsIo
+        from cool_ip_api.utils.limiter import RateLimiter
+        resolver = IPWhoIsIo()
+        resolver.limiter = RateLimiter(10, 60, reserve=0.2)
+        plan = BulkJob([resolver], [f"1.1.1.{i}" for i in range(20)]).plan()
+        assert plan.eta == 120 and plan.providers[0].requests == 20
+
+    def test_run(self):
+        import json
+        import httpx
+        from cool_ip_api.provider.bulk_job import BulkJob
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.provider.ip_who_is_io import IPWhoIsIo
+        from cool_ip_api.utils.circuit import CircuitBreaker
+
+        def handler(request: httpx.Request):
+            if request.method == "POST":
+                return httpx.Response(200, json=[dict(IP_API_COM_PAYLOAD, query=query["query"])
+                                                 for query in json.loads(request.content)])
+            return httpx.Response(500)
+
+        ip_api = IPAPICom(client=mock_clients(handler)[0])
+        broken = IPWhoIsIo(client=mock_clients(handler)[0], circuit_breaker=CircuitBreaker(min_calls=1))
+        broken.circuit_breaker.record(True, 0)
+        job = BulkJob([ip_api, broken], [f"1.1.{i // 256}.{i % 256}" for i in range(250)] + ["1.1.0.1"])
+        progress = []
+        results = job.run(progress.append)
+        assert len(results) == 250 and not any(isinstance(result, Exception) for result in results.values())
+        assert [item.done for item in progress] == [100, 200, 250]
+        assert job.progress().failed == 0 and job.progress().throughput > 0
+        assert ip_api.batch_route_limiters()["default"].remaining == 15 - 3
+
+
+class TestJournal:
+    def test_replay(self, tmp_path):
+        from cool_ip_api.provider.ip_api_com import IPAPIComResponse
+        from cool_ip_api.utils.errors import InvalidInputError
+        from cool_ip_api.utils.journal import Journal
+        journal = Journal(str(tmp_path / "journal"), sync_every=2)
+        journal.append("1.1.1.1", "IPAPICom", IPAPIComResponse.parse_obj(IP_API_COM_PAYLOAD))
+        journal.append_many([("foo", "IPAPICom", InvalidInputError("invalid query"))])
+        journal.close()
+        with open(tmp_path / "journal", "ab") as f:
+            f.write(b'["8.8.8.8", "IPAPICom", {"type": "cool_ip')  # Torn by a crash
+        journal = Journal(str(tmp_path / "journal"))
+        entries = journal.replay()
+        assert set(entries) == {"1.1.1.1", "foo"}
+        assert entries["1.1.1.1"][1].country == IP_API_COM_PAYLOAD["country"]
+        assert isinstance(entries["foo"][1], InvalidInputError)
+        journal.append("8.8.8.8", "IPAPICom", IPAPIComResponse.parse_obj(IP_API_COM_PAYLOAD))
+        assert set(journal.replay()) == {"1.1.1.1", "foo", "8.8.8.8"}
+        journal.close()
+
+    def test_resume(self, tmp_path):
+        import json
+        import httpx
+        from cool_ip_api.provider.bulk_job import BulkJob
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.utils.journal import Journal
+        from cool_ip_api.utils.retry import RetryPolicy
+        sent = []
+
+        def handler(request: httpx.Request):
+            queries = json.loads(request.content)
+            sent.extend(query["query"] for query in queries)
+            if len(sent) > 100:
+                return httpx.Response(500)
+            return httpx.Response(200, json=[dict(IP_API_COM_PAYLOAD, query=query["query"]) for query in queries])
+
+        ips = [f"1.1.0.{i}" for i in range(150)]
+        journal = Journal(str(tmp_path / "journal"))
+        resolver = IPAPICom(client=mock_clients(handler)[0], retry=RetryPolicy(max_attempts=1))
+        results = BulkJob([resolver], ips, journal=journal).run()
+        assert sum(isinstance(result, Exception) for result in results.values()) == 50
+        journal.close()
+        # The failed lookups are resolved again, the others come from the journal
+        sent.clear()
+        resolver = IPAPICom(client=mock_clients(handler)[0])
+        job = BulkJob([resolver], ips, journal=Journal(str(tmp_path / "journal")))
+        assert job.plan().resumed == 100
+        results = job.run()
+        assert sorted(sent) == sorted(ips[100:])
+        assert not any(isinstance(result, Exception) for result in results.values())
+        job.journal.close()
+
+
+class TestGeoResult:
+    def test_adapters(self):
+        from cool_ip_api.provider.ip_api_com import IPAPIComResponse
+        from cool_ip_api.provider.ipapi_co import IPApiCOResponse
+        from cool_ip_api.provider.ipapi_com import APIIPApiCOMResponse
+        from cool_ip_api.provider.ipinfo_io import IPInfoIoResponse
+        geo = IPAPIComResponse.parse_obj(IP_API_COM_PAYLOAD).geo()
+        assert (geo.ip, geo.country_code, geo.region, geo.asn, geo.is_hosting) == \
+            ("1.1.1.1", "AU", "Queensland", 13335, True)
+        geo = IPInfoIoResponse.parse_obj(IP_INFO_IO_PAYLOAD).geo()
+        assert (geo.latitude, geo.longitude, geo.asn, geo.org) == (-27.482, 153.0136, 13335, "Cloudflare, Inc.")
+        geo = IPApiCOResponse.parse_obj(IP_API_CO_PAYLOAD).geo()
+        assert (geo.country, geo.asn, geo.timezone, geo.is_eu) == ("Australia", 13335, "Australia/Sydney", False)
+        geo = APIIPApiCOMResponse.parse_obj(APIIP_API_COM_PAYLOAD).geo()
+        assert (geo.city, geo.asn, geo.is_eu) == ("Brisbane", None, False)
+
+    def test_payload_adapters(self):
+        from cool_ip_api.provider.ip_api_com import IPAPIComResponse
+        from cool_ip_api.provider.ipapi_co import IPApiCOResponse
+        from cool_ip_api.provider.ipapi_com import APIIPApiCOMResponse
+        from cool_ip_api.provider.ipinfo_io import IPInfoIoResponse
+        for model, payload in [(IPAPIComResponse, IP_API_COM_PAYLOAD), (IPInfoIoResponse, IP_INFO_IO_PAYLOAD),
+                               (IPApiCOResponse, IP_API_CO_PAYLOAD), (APIIPApiCOMResponse, APIIP_API_COM_PAYLOAD)]:
+            assert model.geo_from_payload(payload) == model.parse_obj(payload).geo()
+
+    def test_frozen_and_slotted(self):
+        import dataclasses
+        from cool_ip_api.utils.geo import GeoResult, split_asn
+        geo = GeoResult("1.1.1.1", "AU")
+        assert not hasattr(geo, "__dict__")
+        try:
+            geo.city = "Sydney"
+            assert False
+        except dataclasses.FrozenInstanceError:
+            pass
+        assert split_asn("AS13335") == (13335, None) and split_asn("Cloudflare") == (None, "Cloudflare")
+
+    def test_serialization_and_router(self):
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        from cool_ip_api.provider.router import Router
+        from cool_ip_api.utils.geo import GeoResult
+        from cool_ip_api.utils.serialization import dumps, loads
+        client, async_client = mock_clients(lambda request: httpx.Response(200, json=IP_API_COM_PAYLOAD))
+        router = Router([IPAPICom(client=client, async_client=async_client)])
+        geo = router.resolve_geo("1.1.1.1")
+        assert isinstance(geo, GeoResult) and geo.city == "South Brisbane"
+        assert loads(dumps(geo)) == geo
+
+
+class TestParseModes:
+    def resolver(self, parse: str, payload: dict = IP_API_COM_PAYLOAD, **kwargs):
+        import httpx
+        from cool_ip_api.provider.ip_api_com import IPAPICom
+        client, async_client = mock_clients(lambda request: httpx.Response(200, json=payload))
+        return IPAPICom(client=client, async_client=async_client, parse=parse, **kwargs)
+
+    def test_raw(self):
+        import asyncio
+        resolver = self.resolver("raw")
+        assert resolver.resolve("1.1.1.1") == IP_API_COM_PAYLOAD
+        assert asyncio.run(resolver.async_resolve("1.1.1.1")) == IP_API_COM_PAYLOAD
+        assert resolver.resolve_geo("1.1.1.1").asn == 13335
+
+    def test_lazy(self):
+        import pydantic
+        from cool_ip_api.provider.ip_api_com import IPAPIComResponse
+        from cool_ip_api.utils.parsing import LazyResponse
+        response = self.resolver("lazy").resolve("1.1.1.1")
+        assert isinstance(response, LazyResponse)
+        assert (response.country_code, response.lat, response.as_) == ("AU", -27.4766, "AS13335 Cloudflare, Inc.")
+        assert response._model is None  # Only the fields read were validated
+        assert response.geo() == IPAPIComResponse.parse_obj(IP_API_COM_PAYLOAD).geo()
+        assert response.json(by_alias=True) == IPAPIComResponse.parse_obj(IP_API_COM_PAYLOAD).json(by_alias=True)
+        response = self.resolver("lazy", {"status": "success", "lat": "north"}).resolve("1.1.1.1")
+        assert response.city is None
+        try:
+            response.lat
+            assert False
+        except pydantic.ValidationError:
+            pass
+        try:
+            self.resolver("eager")
+            assert False
+        except ValueError:
+            pass
+
+    def test_lazy_prepare(self):
+        from cool_ip_api.provider.ipify_org import IpifyOrgResponse
+        from cool_ip_api.utils.parsing import LazyResponse, parse_response, validated
+        response = parse_response(IpifyOrgResponse, {"ip": "2001:db8::1"}, "lazy")
+        assert isinstance(response, LazyResponse)
+        assert (response.ipv4, response.ipv6) == (None, "2001:db8::1")
+        assert validated(IpifyOrgResponse, {"ip": "1.1.1.1"}).ipv4 == "1.1.1.1"
+
+    def test_cache(self):
+        from cool_ip_api.utils.cache import SQLiteCache
+        from cool_ip_api.utils.parsing import LazyResponse
+        cache = SQLiteCache(":memory:")
+        lazy, raw = self.resolver("lazy", cache=cache), self.resolver("raw", cache=cache)
+        lazy.resolve("1.1.1.1")
+        raw.resolve("1.1.1.1")
+        # The parse mode is part of the key, a resolver never gets the responses of another mode
+        assert isinstance(lazy.resolve("1.1.1.1"), LazyResponse)
+        assert raw.resolve("1.1.1.1") == IP_API_COM_PAYLOAD
+        cache.close()